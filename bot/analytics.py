@@ -0,0 +1,301 @@
+"""
+Poll analytics: turnout, option share trends, vote changes and voter overlap
+تحلیل نظرسنجی‌ها: مشارکت، روند سهم گزینه‌ها، تغییر رای و هم‌پوشانی رای‌دهندگان
+
+Vote event logs are read as columns (NumPy arrays when NumPy is installed,
+stdlib arrays otherwise) and reduced into hourly buckets. Aggregates are
+cached per poll together with the log offset they cover, so a later report
+only reads the events appended since.
+"""
+import logging
+import time
+from datetime import datetime
+from bot.ledger import (
+    VoteLedger, events_path, ledger_path,
+    VOTE_EVENT, EVENT_ADDED, EVENT_CHANGED, EVENT_REMOVED
+)
+from bot.polls import get_tally, list_polls
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Width of a time bucket in seconds
+BUCKET_SECONDS = 3600
+
+# Buckets shown in the turnout and trend lines
+REPORT_BUCKETS = 24
+
+# Polls compared with each other in the overlap section
+OVERLAP_POLLS = 6
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+if np is not None:
+    EVENT_DTYPE = np.dtype([
+        ("time", "<u4"), ("user", "<i8"), ("option", "<i2"), ("previous", "<i2"), ("kind", "u1")
+    ])
+
+class PollStats:
+    """Hourly aggregates of one poll's vote events, extended as the log grows"""
+    
+    def __init__(self, poll_id, option_count):
+        self.poll_id = poll_id
+        self.option_count = option_count
+        self.offset = 0
+        # bucket -> [new voters, changed votes, removed selections]
+        self.activity = {}
+        # bucket -> net change of every option's count
+        self.deltas = {}
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+    
+    def update(self):
+        """Aggregate the events appended since the last update"""
+        path = events_path(self.poll_id)
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return self
+        
+        # Only whole records; a flush may be appending right now
+        length = (size - self.offset) // VOTE_EVENT.size * VOTE_EVENT.size
+        if length <= 0:
+            return self
+        
+        with open(path, 'rb') as f:
+            f.seek(self.offset)
+            content = f.read(length)
+        
+        if np is not None:
+            self._aggregate_numpy(content)
+        else:
+            self._aggregate_stdlib(content)
+        self.offset += length
+        return self
+    
+    def _bucket(self, bucket):
+        """Activity and delta rows of a bucket"""
+        if bucket not in self.activity:
+            self.activity[bucket] = [0, 0, 0]
+            self.deltas[bucket] = [0] * self.option_count
+        return self.activity[bucket], self.deltas[bucket]
+    
+    def _aggregate_numpy(self, content):
+        """Vectorised reduction of a block of events"""
+        events = np.frombuffer(content, dtype=EVENT_DTYPE)
+        buckets, bucket_index = np.unique(events["time"] // BUCKET_SECONDS * BUCKET_SECONDS, return_inverse=True)
+        kinds = events["kind"]
+        options = events["option"].astype(np.intp)
+        
+        activity = np.zeros((len(buckets), 3), dtype=np.int64)
+        for column, kind in enumerate((EVENT_ADDED, EVENT_CHANGED, EVENT_REMOVED)):
+            activity[:, column] = np.bincount(bucket_index, weights=kinds == kind, minlength=len(buckets))
+        
+        # Added and changed votes count for their option, changed ones against the
+        # previous option, removed selections against theirs
+        deltas = np.zeros((len(buckets), self.option_count), dtype=np.int64)
+        plus = kinds != EVENT_REMOVED
+        np.add.at(deltas, (bucket_index[plus], options[plus]), 1)
+        np.add.at(deltas, (bucket_index[~plus], options[~plus]), -1)
+        moved = kinds == EVENT_CHANGED
+        np.add.at(deltas, (bucket_index[moved], events["previous"][moved].astype(np.intp)), -1)
+        
+        for bucket, counts, changes in zip(buckets.tolist(), activity.tolist(), deltas.tolist()):
+            row, delta = self._bucket(bucket)
+            for i in range(3):
+                row[i] += counts[i]
+            for i in range(self.option_count):
+                delta[i] += changes[i]
+        
+        totals = activity.sum(axis=0).tolist()
+        self.added += totals[0]
+        self.changed += totals[1]
+        self.removed += totals[2]
+    
+    def _aggregate_stdlib(self, content):
+        """Reduction of a block of events without NumPy"""
+        for when, user, option, previous, kind in VOTE_EVENT.iter_unpack(content):
+            row, delta = self._bucket(when // BUCKET_SECONDS * BUCKET_SECONDS)
+            if kind == EVENT_ADDED:
+                row[0] += 1
+                delta[option] += 1
+                self.added += 1
+            elif kind == EVENT_CHANGED:
+                row[1] += 1
+                delta[option] += 1
+                delta[previous] -= 1
+                self.changed += 1
+            else:
+                row[2] += 1
+                delta[option] -= 1
+                self.removed += 1
+    
+    @property
+    def change_rate(self):
+        """Share of votes that were later changed"""
+        return self.changed / self.added if self.added else 0.0
+    
+    def turnout(self, buckets=REPORT_BUCKETS):
+        """(bucket start, new voters) for the latest buckets, empty hours included"""
+        if not self.activity:
+            return []
+        last = max(self.activity)
+        starts = [last - i * BUCKET_SECONDS for i in range(buckets - 1, -1, -1)]
+        return [(start, self.activity.get(start, (0, 0, 0))[0]) for start in starts]
+    
+    def share_trend(self, buckets=REPORT_BUCKETS):
+        """(bucket start, share of every option) after each of the latest active buckets"""
+        totals = [0] * self.option_count
+        trend = []
+        for bucket in sorted(self.deltas):
+            totals = [total + change for total, change in zip(totals, self.deltas[bucket])]
+            all_votes = sum(totals)
+            trend.append((bucket, [total / all_votes if all_votes else 0.0 for total in totals]))
+        return trend[-buckets:]
+
+# poll id -> PollStats
+_stats = {}
+
+# (poll id, poll id) -> (voter counts it was computed for, overlap)
+_overlaps = {}
+
+def poll_stats(poll_id):
+    """Up-to-date aggregates of a poll, or None if the poll is unknown"""
+    tally = get_tally(poll_id)
+    if tally is None:
+        return None
+    
+    stats = _stats.get(poll_id)
+    if stats is None:
+        stats = _stats[poll_id] = PollStats(poll_id, len(tally.counts))
+    return stats.update()
+
+def _voters(poll_id):
+    """Sorted voter ids of a poll, or None for anonymous polls"""
+    tally = get_tally(poll_id)
+    if tally is None or tally.anonymous:
+        return None
+    
+    ledger = tally.ledger if isinstance(tally.ledger, VoteLedger) else VoteLedger.load(ledger_path(poll_id))
+    ledger.merge()
+    if np is not None:
+        return np.frombuffer(ledger.voters, dtype=np.int64) if len(ledger.voters) else np.empty(0, dtype=np.int64)
+    return ledger.voters
+
+def _intersection_size(a, b):
+    """Number of ids in both sorted arrays"""
+    if len(a) > len(b):
+        a, b = b, a
+    if not len(a):
+        return 0
+    if np is not None:
+        positions = np.searchsorted(b, a)
+        positions[positions == len(b)] = 0
+        return int(np.count_nonzero(b[positions] == a))
+    return len(set(a).intersection(b))
+
+def voter_overlap(first_id, second_id):
+    """Jaccard overlap of the voters of two polls, cached until either poll gets new voters"""
+    first, second = _voters(first_id), _voters(second_id)
+    if first is None or second is None:
+        return None
+    
+    key = (first_id, second_id) if first_id < second_id else (second_id, first_id)
+    sizes = (len(first), len(second))
+    cached = _overlaps.get(key)
+    if cached and cached[0] == sizes:
+        return cached[1]
+    
+    shared = _intersection_size(first, second)
+    union = len(first) + len(second) - shared
+    overlap = shared / union if union else 0.0
+    _overlaps[key] = (sizes, overlap)
+    return overlap
+
+def sparkline(values, peak=None):
+    """Render numbers as a line of block characters, scaled to peak (default: the largest value)"""
+    if peak is None:
+        peak = max(values) if values else 0
+    if not peak:
+        return SPARK_CHARS[0] * len(values)
+    return "".join(SPARK_CHARS[min(len(SPARK_CHARS) - 1, value * len(SPARK_CHARS) // (peak + 1))] for value in values)
+
+def poll_report(poll_id):
+    """Analytics text of one poll"""
+    tally = get_tally(poll_id)
+    stats = poll_stats(poll_id)
+    if tally is None:
+        return "Poll not found."
+    
+    text = f"📈 تحلیل نظرسنجی: {tally.poll['title']}\n\n"
+    if not stats.added:
+        return text + "هنوز رویداد رایی برای این نظرسنجی ثبت نشده است."
+    
+    turnout = stats.turnout()
+    text += f"👥 رای‌دهندگان جدید در {len(turnout)} ساعت اخیر:\n{sparkline([count for start, count in turnout])}\n"
+    text += f"از {datetime.fromtimestamp(turnout[0][0]).strftime('%m-%d %H:%M')} تا {datetime.fromtimestamp(turnout[-1][0]).strftime('%m-%d %H:%M')}\n\n"
+    
+    trend = stats.share_trend()
+    text += "📊 روند سهم گزینه‌ها:\n"
+    for i, option in enumerate(tally.poll["options"]):
+        shares = [round(share[i] * 100) for start, share in trend]
+        text += f"{option['text']}: {sparkline(shares, 100)} {shares[-1]}%\n"
+    
+    text += f"\n🔁 نرخ تغییر رای: {stats.change_rate:.1%} ({stats.changed} از {stats.added})"
+    if tally.multiple_choices:
+        text += f"\n❎ انتخاب‌های لغو شده: {stats.removed}"
+    return text
+
+def summary_report():
+    """Analytics text across all polls"""
+    started = time.perf_counter()
+    active, _, _ = list_polls(False, 0, page_size=1 << 30)
+    finished, _, _ = list_polls(True, 0, page_size=1 << 30)
+    tallies = active + finished
+    
+    total_votes = 0
+    total_changes = 0
+    hourly = {}
+    busiest = []
+    for tally in tallies:
+        stats = poll_stats(tally.poll["id"])
+        total_votes += stats.added
+        total_changes += stats.changed
+        for bucket, row in stats.activity.items():
+            hourly[bucket] = hourly.get(bucket, 0) + row[0]
+        busiest.append((stats.added, tally))
+    
+    text = "📈 تحلیل نظرسنجی‌ها\n\n"
+    text += f"📊 {len(active)} فعال، {len(finished)} پایان یافته\n"
+    text += f"🗳️ {total_votes} رای ثبت شده، نرخ تغییر رای {total_changes / total_votes if total_votes else 0:.1%}\n"
+    
+    if hourly:
+        last = max(hourly)
+        counts = [hourly.get(last - i * BUCKET_SECONDS, 0) for i in range(REPORT_BUCKETS - 1, -1, -1)]
+        text += f"\n👥 مشارکت {REPORT_BUCKETS} ساعت اخیر:\n{sparkline(counts)}\n"
+    
+    busiest.sort(key=lambda item: item[0], reverse=True)
+    top = [tally for added, tally in busiest[:OVERLAP_POLLS] if added]
+    if top:
+        text += "\n🏆 پرمشارکت‌ترین نظرسنجی‌ها:\n"
+        for tally in top:
+            text += f"• {tally.poll['title'][:40]}: {len(tally.ledger) if tally.ledger is not None else tally.poll.get('voter_count', 0)} رای‌دهنده\n"
+    
+    pairs = []
+    for i, first in enumerate(top):
+        for second in top[i + 1:]:
+            overlap = voter_overlap(first.poll["id"], second.poll["id"])
+            if overlap:
+                pairs.append((overlap, first, second))
+    if pairs:
+        text += "\n🔗 هم‌پوشانی رای‌دهندگان:\n"
+        for overlap, first, second in sorted(pairs, key=lambda pair: pair[0], reverse=True)[:5]:
+            text += f"• {first.poll['title'][:20]} ↔ {second.poll['title'][:20]}: {overlap:.0%}\n"
+    
+    logger.info(f"Poll analytics over {len(tallies)} polls took {time.perf_counter() - started:.3f}s")
+    return text
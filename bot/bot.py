@@ -2,10 +2,12 @@
 Main bot module with initialization and core functionality
 """
 import logging
+from telegram import Update
 from telegram.ext import (
     Application, 
     CommandHandler, 
     CallbackQueryHandler,
+    ChatMemberHandler,
     MessageHandler, 
     filters
 )
@@ -13,17 +15,43 @@ from telegram.ext import (
 from bot.handlers import (
     start, help_command, add_admin_command, add_channel, del_channel, list_channels,
     add_group, del_group, list_groups, send_message_command,
-    schedule_message, list_scheduled, cancel_schedule,
-    set_autopost, list_autopost, delete_autopost,
-    set_welcome, create_poll, get_members,
-    button_callback, new_chat_members, handle_text_message
+    schedule_message, list_scheduled, cancel_schedule, import_schedules, export_data,
+    set_autopost, list_autopost, delete_autopost, queue_add, queue_mode,
+    set_welcome, create_poll, get_members, send_stats, post_action,
+    button_callback, poll_vote_callback, captcha_callback, new_chat_members, chat_member_update,
+    moderate_message, filter_command,
+    handle_text_message, handle_media_message
 )
 from bot.scheduler import setup_scheduler
+from bot.timers import timers
+from bot import polls, captcha, roster
 from bot.storage import load_data
 import config
 
 logger = logging.getLogger(__name__)
 
+async def post_init(application):
+    """Start background services once the event loop is running"""
+    # Setup scheduler
+    setup_scheduler(application.bot)
+    
+    # Single loop for delayed actions (auto-delete, edit, pin)
+    application.create_task(timers.run(application.bot))
+    
+    # Batched saving of poll votes
+    application.create_task(polls.flush_loop())
+    
+    # Removal of members who did not pass the captcha in time
+    application.create_task(captcha.expiry_loop(application.bot))
+    
+    # Batched saving of member rosters
+    application.create_task(roster.flush_loop())
+
+async def post_shutdown(application):
+    """Save pending state before exiting"""
+    await polls.flush()
+    roster.flush()
+
 def start_bot(token):
     """Initialize and start the bot"""
     # Initialize configuration
@@ -33,10 +61,7 @@ def start_bot(token):
     data = load_data()
     
     # Create the Application
-    application = Application.builder().token(token).build()
-    
-    # Setup scheduler
-    scheduler = setup_scheduler(application.bot)
+    application = Application.builder().token(token).post_init(post_init).post_shutdown(post_shutdown).build()
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start))
@@ -60,16 +85,27 @@ def start_bot(token):
     application.add_handler(CommandHandler("schedule", schedule_message))
     application.add_handler(CommandHandler("schedulelist", list_scheduled))
     application.add_handler(CommandHandler("cancelschedule", cancel_schedule))
+    application.add_handler(CommandHandler("sendstats", send_stats))
+    application.add_handler(CommandHandler("import", import_schedules))
+    application.add_handler(CommandHandler("export", export_data))
+    application.add_handler(CommandHandler("postaction", post_action))
     
     # Auto-posting commands
     application.add_handler(CommandHandler("autopost", set_autopost))
     application.add_handler(CommandHandler("autopostlist", list_autopost))
     application.add_handler(CommandHandler("delautopost", delete_autopost))
+    application.add_handler(CommandHandler("queueadd", queue_add))
+    application.add_handler(CommandHandler("queuemode", queue_mode))
     
     # Other features
     application.add_handler(CommandHandler("welcome", set_welcome))
     application.add_handler(CommandHandler("poll", create_poll))
     application.add_handler(CommandHandler("getmembers", get_members))
+    application.add_handler(CommandHandler("filter", filter_command))
+    
+    # Poll votes come from any user, so they are handled before the admin-only callbacks
+    application.add_handler(CallbackQueryHandler(poll_vote_callback, pattern=r'^\{"action": "poll_vote"'))
+    application.add_handler(CallbackQueryHandler(captcha_callback, pattern=r'^\{"action": "captcha"'))
     
     # Callback query handler for inline buttons
     application.add_handler(CallbackQueryHandler(button_callback))
@@ -79,12 +115,32 @@ def start_bot(token):
         MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_chat_members)
     )
     
+    # Member rosters: joins, leaves and status changes, including the bot's own
+    application.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.ANY_CHAT_MEMBER))
+    
+    # Anti-spam filters on group messages
+    application.add_handler(
+        MessageHandler(filters.ChatType.GROUPS & ~filters.StatusUpdate.ALL & ~filters.COMMAND, moderate_message)
+    )
+    
     # Text message handler for conversational states
     application.add_handler(
-        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message)
+        MessageHandler(filters.ChatType.PRIVATE & filters.TEXT & ~filters.COMMAND, handle_text_message)
+    )
+    
+    # Media message handler for post content
+    application.add_handler(
+        MessageHandler(
+            filters.ChatType.PRIVATE & (
+                filters.PHOTO | filters.VIDEO | filters.Document.ALL |
+                filters.ANIMATION | filters.AUDIO | filters.VOICE
+            ),
+            handle_media_message
+        )
     )
     
     # Start the Bot
-    application.run_polling()
+    # chat_member updates are only delivered when requested explicitly
+    application.run_polling(allowed_updates=Update.ALL_TYPES)
     
     return application
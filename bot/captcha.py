@@ -0,0 +1,319 @@
+"""
+Captcha for new group members: restricted on join until they press the right button
+کپچا برای اعضای جدید گروه: محدودیت هنگام ورود تا زدن دکمه درست
+
+Members waiting for verification live in a fixed-size table of parallel
+arrays (about 29 bytes a slot plus one index entry), so a raid cannot grow
+memory past CAPTCHA_CAPACITY; members beyond it are removed right away.
+Deadlines are kept on a timing wheel of CAPTCHA_WHEEL_SIZE buckets that one
+loop advances every CAPTCHA_TICK seconds, kicking every expired member of a
+bucket in one pass. Joins within CAPTCHA_CHALLENGE_WINDOW seconds share one
+challenge message per group.
+
+Every pending member also has a captcha_expire timer on the persisted timer
+heap, cancelled when they pass or are removed. After a restart the table and
+the wheel are rebuilt from those timers, so nobody stays muted for good.
+"""
+import asyncio
+import json
+import logging
+import random
+import time
+from array import array
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions
+from bot.registry import schedule_action
+from bot.timers import timers
+from bot.welcome import get_welcome_settings, queue_welcome
+
+logger = logging.getLogger(__name__)
+
+# Members that can wait for verification at the same time
+CAPTCHA_CAPACITY = 10000
+
+# Seconds between wheel ticks, and buckets on the wheel; together they must
+# cover the longest captcha timeout
+CAPTCHA_TICK = 5
+CAPTCHA_WHEEL_SIZE = 64
+
+# Joins within this many seconds get the same challenge message
+CAPTCHA_CHALLENGE_WINDOW = 30
+
+# Buttons of a challenge; one of them is the answer
+CAPTCHA_EMOJIS = ("🍎", "🚗", "🐱", "⚽", "🌙", "🎈", "📚", "🔑")
+CAPTCHA_CHOICES = 4
+
+# Permissions of a member waiting for verification
+RESTRICTED = ChatPermissions(can_send_messages=False)
+
+class PendingTable:
+    """Members waiting for verification, in preallocated parallel arrays"""
+    
+    def __init__(self, capacity=CAPTCHA_CAPACITY):
+        self.chats = array('q', bytes(8 * capacity))
+        self.users = array('q', bytes(8 * capacity))
+        self.deadlines = array('I', bytes(4 * capacity))
+        self.answers = array('B', bytes(capacity))
+        # Id of each member's captcha_expire timer
+        self.timer_ids = array('Q', bytes(8 * capacity))
+        self.used = bytearray(capacity)
+        self._free = list(range(capacity - 1, -1, -1))
+        # (chat id, user id) -> slot
+        self._index = {}
+    
+    def __len__(self):
+        return len(self._index)
+    
+    def add(self, chat_id, user_id, deadline, answer):
+        """Store a pending member; returns the slot, or -1 if the table is full"""
+        key = (chat_id, user_id)
+        slot = self._index.get(key)
+        if slot is None:
+            if not self._free:
+                return -1
+            slot = self._index[key] = self._free.pop()
+        
+        self.chats[slot] = chat_id
+        self.users[slot] = user_id
+        self.deadlines[slot] = deadline
+        self.answers[slot] = answer
+        self.used[slot] = 1
+        return slot
+    
+    def get(self, chat_id, user_id):
+        """Slot of a pending member, or -1"""
+        return self._index.get((chat_id, user_id), -1)
+    
+    def remove(self, slot):
+        """Free a slot"""
+        if self.used[slot]:
+            self.used[slot] = 0
+            del self._index[(self.chats[slot], self.users[slot])]
+            self._free.append(slot)
+
+class ExpiryWheel:
+    """Slots bucketed by deadline on a wheel of CAPTCHA_WHEEL_SIZE ticks"""
+    
+    def __init__(self, size=CAPTCHA_WHEEL_SIZE, tick=CAPTCHA_TICK):
+        self.size = size
+        self.tick = tick
+        self.buckets = [array('I') for _ in range(size)]
+        self.position = int(time.time()) // tick
+    
+    def add(self, slot, deadline):
+        """Put a slot in the first bucket at or after its deadline"""
+        due = max(-(-deadline // self.tick), self.position + 1)
+        if due - self.position >= self.size:
+            raise ValueError("captcha timeout is longer than the expiry wheel")
+        self.buckets[due % self.size].append(slot)
+    
+    def advance(self, now):
+        """Slots of every bucket passed since the last call"""
+        expired = []
+        target = int(now) // self.tick
+        while self.position < target:
+            self.position += 1
+            bucket = self.buckets[self.position % self.size]
+            if bucket:
+                expired.extend(bucket)
+                self.buckets[self.position % self.size] = array('I')
+        return expired
+
+_pending = PendingTable()
+_wheel = ExpiryWheel()
+
+# Whether the members pending before a restart were put back
+_loaded = False
+
+# (chat id, user id) of restored members that did not fit in the table
+_overflow = set()
+
+# chat id -> (answer, opened at, permissions to restore) of the open challenge
+_challenges = {}
+
+def _load():
+    """Put back the members who were waiting for verification before a restart"""
+    global _loaded
+    
+    if _loaded:
+        return
+    _loaded = True
+    
+    restored = 0
+    for timer_id, payload in timers.pending("captcha_expire"):
+        slot = _pending.add(payload["chat_id"], payload["user_id"], payload["deadline"], payload["answer"])
+        if slot < 0:
+            # Their timer still removes them when it comes due
+            _overflow.add((payload["chat_id"], payload["user_id"]))
+            continue
+        _pending.timer_ids[slot] = timer_id
+        _wheel.add(slot, payload["deadline"])
+        restored += 1
+    if restored:
+        logger.info(f"Restored {restored} members waiting for the captcha")
+
+def captcha_enabled():
+    """Whether new members have to pass the captcha"""
+    return get_welcome_settings()["captcha"]
+
+def _challenge_keyboard(answer_choices):
+    """One row of emoji buttons"""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton(
+            emoji,
+            callback_data=json.dumps({"action": "captcha", "c": i})
+        )
+        for i, emoji in enumerate(answer_choices)
+    ]])
+
+async def _open_challenge(bot, chat, now, timeout):
+    """The group's current challenge, sending a new message if the last one is too old"""
+    challenge = _challenges.get(chat.id)
+    if challenge and now - challenge[1] < CAPTCHA_CHALLENGE_WINDOW:
+        return challenge
+    
+    choices = random.sample(CAPTCHA_EMOJIS, CAPTCHA_CHOICES)
+    answer = random.randrange(CAPTCHA_CHOICES)
+    try:
+        # Verified members get the group's own default permissions back
+        permissions = (await bot.get_chat(chat.id)).permissions or ChatPermissions.all_permissions()
+        message = await bot.send_message(
+            chat_id=chat.id,
+            text=f"👋 اعضای جدید: برای ارسال پیام در گروه تا {timeout} ثانیه روی {choices[answer]} بزنید.",
+            reply_markup=_challenge_keyboard(choices)
+        )
+    except Exception as e:
+        logger.error(f"Error sending captcha challenge to {chat.id}: {e}")
+        return None
+    
+    # The challenge disappears once the last member it covers has expired
+    schedule_action(chat.id, message.message_id, {"type": "delete"}, now + CAPTCHA_CHALLENGE_WINDOW + timeout + CAPTCHA_TICK)
+    challenge = _challenges[chat.id] = (answer, now, permissions)
+    return challenge
+
+async def challenge_members(bot, chat, members):
+    """Restrict new members and ask them to solve the group's challenge"""
+    _load()
+    now = int(time.time())
+    timeout = get_welcome_settings()["captcha_timeout"]
+    challenge = await _open_challenge(bot, chat, now, timeout)
+    if challenge is None:
+        # Without a challenge nobody could pass, so the members are let in
+        await queue_welcome(bot, chat, [(member.first_name, member.username) for member in members])
+        return
+    
+    overflow = 0
+    slots = []
+    for member in members:
+        slot = _pending.get(chat.id, member.id)
+        if slot >= 0:
+            # Joined again while pending: the new deadline replaces the old one
+            timers.cancel(_pending.timer_ids[slot])
+        slot = _pending.add(chat.id, member.id, now + timeout, challenge[0])
+        if slot < 0:
+            # During a raid that fills the table, further members are removed right away
+            overflow += 1
+            await _kick(bot, chat.id, member.id)
+            continue
+        _wheel.add(slot, now + timeout)
+        slots.append(slot)
+    
+    # One journal flush for the whole batch; the timers come due a tick after
+    # the wheel, which cancels them when it removes the members itself
+    timer_ids = timers.schedule_many([
+        (now + timeout + CAPTCHA_TICK, "captcha_expire", {
+            "chat_id": chat.id,
+            "user_id": _pending.users[slot],
+            "deadline": now + timeout,
+            "answer": challenge[0]
+        })
+        for slot in slots
+    ])
+    for slot, timer_id in zip(slots, timer_ids):
+        _pending.timer_ids[slot] = timer_id
+    
+    for slot in slots:
+        try:
+            await bot.restrict_chat_member(chat.id, _pending.users[slot], RESTRICTED)
+        except Exception as e:
+            logger.error(f"Error restricting {_pending.users[slot]} in {chat.id}: {e}")
+    
+    if overflow:
+        logger.warning(f"Captcha table full, removed {overflow} new members from {chat.id}")
+
+async def solve(bot, chat, user, choice):
+    """Check a button press; returns True if the user passed, False if failed, None if not pending"""
+    _load()
+    slot = _pending.get(chat.id, user.id)
+    if slot < 0:
+        return None
+    
+    passed = _pending.answers[slot] == choice
+    timers.cancel(_pending.timer_ids[slot])
+    _pending.remove(slot)
+    if not passed:
+        await _kick(bot, chat.id, user.id)
+        return False
+    
+    try:
+        challenge = _challenges.get(chat.id)
+        # After a restart the challenge is gone and the group's permissions are fetched again
+        permissions = challenge[2] if challenge else (await bot.get_chat(chat.id)).permissions or ChatPermissions.all_permissions()
+        await bot.restrict_chat_member(chat.id, user.id, permissions)
+    except Exception as e:
+        logger.error(f"Error lifting restrictions of {user.id} in {chat.id}: {e}")
+    
+    # Verified members get the usual welcome
+    await queue_welcome(bot, chat, [(user.first_name, user.username)])
+    return True
+
+async def _kick(bot, chat_id, user_id):
+    """Remove a member without a lasting ban, so they can join again"""
+    try:
+        await bot.ban_chat_member(chat_id, user_id)
+        await bot.unban_chat_member(chat_id, user_id, only_if_banned=True)
+    except Exception as e:
+        logger.error(f"Error removing {user_id} from {chat_id}: {e}")
+
+async def expire(bot, now=None):
+    """Kick every member whose deadline has passed; returns how many were kicked"""
+    _load()
+    now = now or time.time()
+    expired = []
+    for slot in _wheel.advance(now):
+        # Solved slots may have been reused by later members with later deadlines
+        if _pending.used[slot] and _pending.deadlines[slot] <= now:
+            expired.append((_pending.chats[slot], _pending.users[slot]))
+            timers.cancel(_pending.timer_ids[slot])
+            _pending.remove(slot)
+    
+    for chat_id, user_id in expired:
+        await _kick(bot, chat_id, user_id)
+    if expired:
+        logger.info(f"Removed {len(expired)} members who did not pass the captcha")
+    return len(expired)
+
+async def expiry_loop(bot):
+    """Advance the expiry wheel every CAPTCHA_TICK seconds"""
+    while True:
+        await asyncio.sleep(CAPTCHA_TICK)
+        try:
+            await expire(bot)
+        except Exception as e:
+            logger.error(f"Error expiring captchas: {e}")
+
+async def _expire_timers(bot, payloads):
+    """Kick members whose timer came due before the wheel removed them, e.g. past a full table after a restart"""
+    _load()
+    for payload in payloads:
+        key = (payload["chat_id"], payload["user_id"])
+        slot = _pending.get(*key)
+        if slot >= 0 and _pending.deadlines[slot] == payload["deadline"]:
+            _pending.remove(slot)
+        elif key in _overflow:
+            _overflow.discard(key)
+        else:
+            # Passed or removed meanwhile, or joined again with a timer of their own
+            continue
+        await _kick(bot, *key)
+
+timers.register("captcha_expire", _expire_timers, batch=True)
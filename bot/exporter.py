@@ -0,0 +1,133 @@
+"""
+Streaming export of polls, votes, scheduled messages and automatic posts
+خروجی گرفتن از نظرسنجی‌ها، آراء، پیام‌های زمان‌بندی شده و پست‌های خودکار
+
+Rows are produced by generators that read the data file incrementally and
+are written straight into a gzip stream, so an export never holds the whole
+data set in memory.
+
+Command line usage:
+    python -m bot.exporter votes --format csv --output votes.csv.gz
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+from bot.storage import iter_data_items
+from bot.ledger import VoteLedger, ledger_path
+
+logger = logging.getLogger(__name__)
+
+# Column order of each export
+EXPORT_FIELDS = {
+    "polls": ["poll_id", "title", "created_at", "option_id", "option_text", "count"],
+    "votes": ["poll_id", "user_id", "option_id"],
+    "schedules": ["id", "time", "target_id", "target_type", "text", "media_type", "keyboard"],
+    "autoposts": ["id", "type", "day", "hour", "minute", "target_id", "target_type", "text", "media_type", "keyboard"]
+}
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+def iter_poll_rows():
+    """One row per poll option with its vote count"""
+    for poll in iter_data_items("polls"):
+        for option_id, option in enumerate(poll.get("options", [])):
+            yield {
+                "poll_id": poll["id"],
+                "title": poll.get("title", ""),
+                "created_at": poll.get("created_at", ""),
+                "option_id": option_id,
+                "option_text": option["text"],
+                "count": option.get("count", 0)
+            }
+
+def iter_vote_rows():
+    """One row per recorded vote, read from each poll's ledger file"""
+    for poll in iter_data_items("polls"):
+        if poll.get("anonymous"):
+            # Anonymous polls keep no voter ids
+            continue
+        
+        # Polls not yet migrated still carry their votes inline
+        votes = poll["votes"].items() if poll.get("votes") else VoteLedger.load(ledger_path(poll["id"])).items()
+        for user_id, option in votes:
+            # Multiple-choice votes are bitmasks: one row per selected option
+            option_ids = [i for i in range(option.bit_length()) if option >> i & 1] if poll.get("multiple_choices") else [option]
+            for option_id in option_ids:
+                yield {
+                    "poll_id": poll["id"],
+                    "user_id": user_id,
+                    "option_id": option_id
+                }
+
+def _post_columns(post):
+    """Columns shared by scheduled messages and automatic posts"""
+    return {
+        "target_id": post.get("target", {}).get("id", ""),
+        "target_type": post.get("target", {}).get("type", ""),
+        "text": post.get("text", ""),
+        "media_type": post.get("media", {}).get("type", "") if post.get("media") else "",
+        "keyboard": json.dumps(post["keyboard"], ensure_ascii=False) if post.get("keyboard") else ""
+    }
+
+def iter_schedule_rows():
+    """One row per scheduled message"""
+    for msg in iter_data_items("scheduled_messages"):
+        yield dict({"id": msg["id"], "time": msg.get("time", "")}, **_post_columns(msg))
+
+def iter_autopost_rows():
+    """One row per automatic post"""
+    for post in iter_data_items("auto_posts"):
+        yield dict({
+            "id": post["id"],
+            "type": post.get("type", ""),
+            "day": post.get("day", ""),
+            "hour": post.get("hour", ""),
+            "minute": post.get("minute", "")
+        }, **_post_columns(post))
+
+EXPORT_SOURCES = {
+    "polls": iter_poll_rows,
+    "votes": iter_vote_rows,
+    "schedules": iter_schedule_rows,
+    "autoposts": iter_autopost_rows
+}
+
+def export(kind, output_path, export_format="csv"):
+    """Write an export as gzip-compressed CSV or JSONL; returns the number of rows"""
+    if kind not in EXPORT_SOURCES:
+        raise ValueError(f"Unknown export: {kind}")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format: {export_format}")
+    
+    count = 0
+    with gzip.open(output_path, 'wt', encoding='utf-8', newline='') as f:
+        if export_format == "csv":
+            writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS[kind])
+            writer.writeheader()
+            for row in EXPORT_SOURCES[kind]():
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in EXPORT_SOURCES[kind]():
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                count += 1
+    
+    logger.info(f"Exported {count} {kind} rows to {output_path}")
+    return count
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Export bot data as gzip-compressed CSV or JSONL")
+    parser.add_argument("kind", choices=sorted(EXPORT_SOURCES))
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--output", help="output file (default: <kind>.<format>.gz)")
+    args = parser.parse_args()
+    
+    output_path = args.output or f"{args.kind}.{args.format}.gz"
+    count = export(args.kind, output_path, args.format)
+    print(f"Exported {count} rows to {output_path}")
+
+if __name__ == "__main__":
+    main()
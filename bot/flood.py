@@ -0,0 +1,124 @@
+"""
+Per-user flood control in groups, and batched deletes and mutes
+کنترل ارسال پیاپی کاربران در گروه‌ها و حذف و بی‌صدا کردن دسته‌ای
+
+Rates are checked with GCRA (generic cell rate algorithm): each user keeps a
+single number, the theoretical arrival time of their next message. A limit
+of N messages per T seconds spaces messages T/N seconds apart and allows a
+burst of N; a message arriving more than T - T/N seconds before that time is
+a flood. Users are kept per group in an LRU-ordered dict capped at
+FLOOD_TRACKED_USERS, so memory does not grow with the number of users seen;
+an evicted user has no recent messages and would start from a clean state
+anyway.
+
+Deletions are collected per chat for FLOOD_FLUSH_DELAY seconds and sent as
+delete_messages calls of up to 100 ids.
+"""
+import asyncio
+import heapq
+import logging
+import time
+from collections import OrderedDict
+from telegram import ChatPermissions
+from bot.registry import DELETE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Users tracked per group; the least recently active ones are forgotten first
+FLOOD_TRACKED_USERS = 4096
+
+# Seconds deletions are collected before they are sent together
+FLOOD_FLUSH_DELAY = 1
+
+FLOOD_ACTIONS = ("mute", "delete")
+
+MUTED = ChatPermissions(can_send_messages=False)
+
+class FloodLimiter:
+    """GCRA rate limit of one group, N messages per T seconds per user"""
+    
+    def __init__(self, limit, seconds, capacity=FLOOD_TRACKED_USERS):
+        self.interval = seconds / limit
+        self.tolerance = seconds - self.interval
+        self.capacity = capacity
+        # user id -> theoretical arrival time, least recently seen first
+        self._arrivals = OrderedDict()
+    
+    def __len__(self):
+        return len(self._arrivals)
+    
+    def hit(self, user_id, now=None):
+        """Count a message; returns True if it exceeds the limit"""
+        now = time.monotonic() if now is None else now
+        arrivals = self._arrivals
+        arrival = arrivals.get(user_id, now)
+        if arrival < now:
+            arrival = now
+        if arrival - now > self.tolerance:
+            # Over the limit: the message is not counted, so the user recovers at the normal rate
+            arrivals.move_to_end(user_id)
+            return True
+        
+        arrivals[user_id] = arrival + self.interval
+        arrivals.move_to_end(user_id)
+        if len(arrivals) > self.capacity:
+            arrivals.popitem(last=False)
+        return False
+
+# chat id -> message ids waiting to be deleted
+_deletions = {}
+
+# (chat id, user id) -> monotonic time until which the user is muted
+_muted = {}
+
+# (until, (chat id, user id)) of every mute, earliest first, so finished
+# mutes are dropped without scanning the table
+_mute_deadlines = []
+
+def queue_delete(bot, chat_id, message_id):
+    """Delete a message together with the others of its chat in the next flush"""
+    pending = _deletions.get(chat_id)
+    if pending is None:
+        pending = _deletions[chat_id] = []
+        asyncio.get_running_loop().call_later(
+            FLOOD_FLUSH_DELAY, lambda: asyncio.ensure_future(_flush_deletions(bot, chat_id))
+        )
+    pending.append(message_id)
+
+async def _flush_deletions(bot, chat_id):
+    """Delete the collected messages of a chat in batches"""
+    message_ids = _deletions.pop(chat_id, [])
+    for i in range(0, len(message_ids), DELETE_BATCH_SIZE):
+        chunk = message_ids[i:i + DELETE_BATCH_SIZE]
+        try:
+            if hasattr(bot, "delete_messages"):
+                await bot.delete_messages(chat_id, chunk)
+            else:
+                for message_id in chunk:
+                    await bot.delete_message(chat_id, message_id)
+        except Exception as e:
+            logger.error(f"Error deleting {len(chunk)} messages in {chat_id}: {e}")
+    if len(message_ids) > 1:
+        logger.info(f"Deleted {len(message_ids)} messages in {chat_id} in batches of up to {DELETE_BATCH_SIZE}")
+
+async def mute(bot, chat_id, user_id, seconds):
+    """Mute a user for a while; repeated floods during the mute do not call the API again"""
+    now = time.monotonic()
+    if _muted.get((chat_id, user_id), 0) > now:
+        return False
+    
+    # Drop finished mutes so the table only holds users muted right now
+    while _mute_deadlines and _mute_deadlines[0][0] <= now:
+        until, key = heapq.heappop(_mute_deadlines)
+        if _muted.get(key) == until:
+            del _muted[key]
+    _muted[(chat_id, user_id)] = now + seconds
+    heapq.heappush(_mute_deadlines, (now + seconds, (chat_id, user_id)))
+    
+    try:
+        await bot.restrict_chat_member(chat_id, user_id, MUTED, until_date=int(time.time()) + seconds)
+    except Exception as e:
+        logger.error(f"Error muting {user_id} in {chat_id}: {e}")
+        return False
+    logger.info(f"Muted {user_id} in {chat_id} for {seconds}s for flooding")
+    return True
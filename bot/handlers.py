@@ -1,14 +1,18 @@
 """
 Command handlers for the Telegram Bot
 """
+import asyncio
+import io
 import logging
 import json
+import re
+import tempfile
 from datetime import datetime, timedelta
+from pathlib import Path
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
-from telegram.constants import ParseMode
 from bot.admin import is_admin
-from bot.storage import load_data, save_data
+from bot.storage import load_data
 from bot.keyboards import (
     create_channels_keyboard, 
     create_groups_keyboard,
@@ -28,12 +32,34 @@ from bot.messages import (
     format_scheduled_list,
     format_autopost_list
 )
+from bot.media import extract_media, send_media, ALBUM_MEDIA_TYPES, MAX_ALBUM_ITEMS
 from bot.scheduler import (
     schedule_one_time_message, 
     cancel_scheduled_job,
     schedule_recurring_message,
-    cancel_autopost
+    cancel_autopost,
+    get_send_latency_stats,
+    add_post_action,
+    register_scheduled_messages
 )
+from bot.importer import ImportResult, parse_batches, store_messages, format_errors, IMPORT_REGISTER_CHUNK
+from bot.exporter import export, EXPORT_SOURCES, EXPORT_FORMATS
+from bot.queues import ContentQueue, QUEUE_MODES, split_items, iter_file_items
+from bot.polls import (
+    record_vote, get_tally, list_polls, set_poll_message, poll_messages, request_result_edit,
+    toggle_poll_setting, cycle_poll_time_limit, format_time_limit, close_polls,
+    VOTE_ADDED, VOTE_CHANGED, VOTE_UNCHANGED, VOTE_REMOVED, VOTE_DUPLICATE
+)
+from bot.analytics import poll_report, summary_report
+from bot.captcha import captcha_enabled, challenge_members, solve
+from bot.moderation import check_message, is_group_admin, get_rules, update_rules, REASON_FLOOD
+from bot.flood import queue_delete, mute, FLOOD_ACTIONS
+from bot.roster import get_roster, sync_admins, record_update, forget_managed, id_list, ADMINS
+from bot.raid import record_joins, unlock, review, kick_reviewed, approve_reviewed
+from bot.welcome import queue_welcome, set_welcome_message, forget_welcome, get_welcome_settings, cycle_welcome_setting
+from bot.utils import process_poll_creation, create_and_send_poll, ask_poll_targets
+from bot.poll_templates import get_custom_template, BUILTIN_TEMPLATES, CUSTOM_TEMPLATE
+from bot.registry import record_sent, schedule_action, action_due, POST_ACTIONS
 import config
 
 logger = logging.getLogger(__name__)
@@ -113,6 +139,7 @@ async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         
         # Save config
         config.save_config(conf)
+        forget_managed()
         
         await update.message.reply_text(config.MESSAGES["channel_added"])
     except Exception as e:
@@ -181,6 +208,7 @@ async def add_group(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         
         # Save config
         config.save_config(conf)
+        forget_managed()
         
         await update.message.reply_text(config.MESSAGES["group_added"])
     except Exception as e:
@@ -315,6 +343,96 @@ async def schedule_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         logger.error(f"Error scheduling message: {e}")
         await update.message.reply_text(config.MESSAGES["error"].format(str(e)))
 
+@is_admin
+async def import_schedules(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Wait for a CSV/JSONL file of posts to schedule"""
+    context.user_data["importing"] = True
+    await update.message.reply_text(
+        "فایل CSV یا JSONL پیام‌ها را ارسال کنید.\n"
+        "ستون‌ها: time, target, text, buttons (اختیاری)\n"
+        "مثال: 2025-01-01 14:30, -1001234567890, متن پیام, "
+        '[[{"text": "سایت", "url": "https://example.com"}]]'
+    )
+
+async def _import_document(update: Update, context: ContextTypes.DEFAULT_TYPE, media) -> None:
+    """Import scheduled posts from an uploaded document"""
+    suffix = Path(update.message.document.file_name or "").suffix.lower()
+    if suffix not in (".csv", ".jsonl"):
+        await update.message.reply_text("❌ فقط فایل‌های .csv و .jsonl پشتیبانی می‌شوند.")
+        return
+    
+    result = ImportResult()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / f"import{suffix}"
+        document = await context.bot.get_file(media["file_id"])
+        await document.download_to_drive(path)
+        
+        # Rows are parsed on a worker thread one batch at a time, then every
+        # valid post is saved at once here on the event loop, which is the
+        # only writer of the data file
+        messages = []
+        batches = parse_batches(path, result)
+        while True:
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            messages.extend(batch)
+        
+        if messages and not store_messages(messages):
+            await update.message.reply_text("❌ ذخیره پیام‌ها ناموفق بود. هیچ پیامی زمان‌بندی نشد.")
+            return
+        for i in range(0, len(messages), IMPORT_REGISTER_CHUNK):
+            register_scheduled_messages(messages[i:i + IMPORT_REGISTER_CHUNK])
+            await asyncio.sleep(0)
+        result.imported = len(messages)
+    
+    report = f"✅ {result.imported} پیام زمان‌بندی شد."
+    if result.error_count:
+        report += f"\n❌ {result.error_count} ردیف رد شد:\n\n"
+        errors = format_errors(result)
+        if len(errors) < 3000:
+            await update.message.reply_text(report + errors)
+        else:
+            await update.message.reply_text(report + "جزئیات در فایل پیوست.")
+            await update.message.reply_document(
+                document=io.BytesIO(errors.encode('utf-8')),
+                filename="import_errors.txt"
+            )
+    else:
+        await update.message.reply_text(report)
+
+@is_admin
+async def export_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send polls, votes, schedules or autoposts as a compressed CSV/JSONL document"""
+    kinds = "|".join(EXPORT_SOURCES)
+    if not context.args or context.args[0] not in EXPORT_SOURCES:
+        await update.message.reply_text(
+            f"نحوه استفاده:\n/export <{kinds}> [csv|jsonl]"
+        )
+        return
+    
+    kind = context.args[0]
+    export_format = context.args[1].lower() if len(context.args) > 1 else "csv"
+    if export_format not in EXPORT_FORMATS:
+        await update.message.reply_text("فرمت باید csv یا jsonl باشد.")
+        return
+    
+    try:
+        filename = f"{kind}.{export_format}.gz"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / filename
+            count = await asyncio.to_thread(export, kind, path, export_format)
+            
+            with open(path, 'rb') as f:
+                await update.message.reply_document(
+                    document=f,
+                    filename=filename,
+                    caption=f"📦 {count} ردیف"
+                )
+    except Exception as e:
+        logger.error(f"Error exporting {kind}: {e}")
+        await update.message.reply_text(config.MESSAGES["error"].format(str(e)))
+
 @is_admin
 async def list_scheduled(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """List all scheduled messages"""
@@ -348,6 +466,137 @@ async def cancel_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
+@is_admin
+async def send_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show how accurately scheduled posts were sent"""
+    stats = get_send_latency_stats()
+    
+    if not stats:
+        await update.message.reply_text("هنوز هیچ پیام زمان‌بندی شده‌ای ارسال نشده است.")
+        return
+    
+    await update.message.reply_text(
+        "⏱️ تأخیر ارسال نسبت به زمان تعیین شده:\n\n"
+        f"تعداد: {stats['count']}\n"
+        f"میانگین: {stats['average']:.3f} ثانیه\n"
+        f"صدک ۹۵: {stats['p95']:.3f} ثانیه\n"
+        f"بیشترین: {stats['max']:.3f} ثانیه"
+    )
+
+def _parse_action_time(value):
+    """Parse an action time: hours from sending (e.g. 24, 0.5) or HH:MM for the next such time after each send"""
+    if ":" in value:
+        # Kept as a time of day, so recurring posts get it relative to every send
+        return {"time": datetime.strptime(value, "%H:%M").strftime("%H:%M")}
+    return {"after": float(value) * 3600}
+
+@is_admin
+async def post_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Schedule delete/edit/pin/unpin on a sent message or on future sends of a post"""
+    usage = (
+        "نحوه استفاده:\n"
+        "/postaction <شناسه> delete <ساعت>\n"
+        "/postaction <شناسه> edit <ساعت یا HH:MM> <متن جدید>\n"
+        "/postaction <شناسه> pin\n"
+        "/postaction <شناسه> unpin <ساعت>\n\n"
+        "شناسه می‌تواند شناسه پیام زمان‌بندی شده/پست خودکار باشد، "
+        "یا chat_id:message_id برای پیامی که قبلاً ارسال شده است."
+    )
+    
+    if len(context.args) < 2 or context.args[1] not in POST_ACTIONS:
+        await update.message.reply_text(usage)
+        return
+    
+    try:
+        target, action_type = context.args[0], context.args[1]
+        action = {"type": action_type}
+        
+        if action_type != "pin":
+            if len(context.args) < 3:
+                await update.message.reply_text(usage)
+                return
+            action.update(_parse_action_time(context.args[2]))
+        
+        if action_type == "edit":
+            action["text"] = ' '.join(context.args[3:])
+            if not action["text"]:
+                await update.message.reply_text(usage)
+                return
+        
+        if ":" in target:
+            # An already sent message
+            chat_id, message_id = target.rsplit(":", 1)
+            schedule_action(int(chat_id), int(message_id), action, action_due(action, datetime.now().timestamp()))
+            await update.message.reply_text("✅ عملیات برای پیام ارسال شده زمان‌بندی شد.")
+        elif add_post_action(target, action):
+            await update.message.reply_text("✅ عملیات به پست اضافه شد و پس از هر ارسال اجرا می‌شود.")
+        else:
+            await update.message.reply_text("❌ پستی با این شناسه پیدا نشد.")
+    except ValueError:
+        await update.message.reply_text(usage)
+    except Exception as e:
+        logger.error(f"Error adding post action: {e}")
+        await update.message.reply_text(config.MESSAGES["error"].format(str(e)))
+
+def _find_autopost(post_id):
+    """Return the stored automatic post with the given ID, or None"""
+    for post in load_data().get("auto_posts", []):
+        if post["id"] == post_id:
+            return post
+    return None
+
+@is_admin
+async def queue_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Start appending posts to the rotation queue of an automatic post"""
+    if not context.args:
+        await update.message.reply_text(
+            "لطفاً شناسه پست خودکار را وارد کنید. مثال:\n"
+            "/queueadd <شناسه پست خودکار>"
+        )
+        return
+    
+    post_id = context.args[0]
+    if not _find_autopost(post_id):
+        await update.message.reply_text("❌ پست خودکاری با این شناسه پیدا نشد.")
+        return
+    
+    context.user_data["queue_append"] = {"id": post_id}
+    await update.message.reply_text(
+        "متن پست‌ها را ارسال کنید و پست‌ها را با یک خط شامل --- از هم جدا کنید.\n"
+        "برای افزودن تعداد زیاد، یک فایل .txt (جدا شده با ---) یا .jsonl ارسال کنید."
+    )
+
+@is_admin
+async def queue_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show or change how an automatic post picks items from its queue"""
+    if not context.args:
+        await update.message.reply_text(
+            "نحوه استفاده:\n"
+            "/queuemode <شناسه پست خودکار> [round_robin|shuffle|consume]"
+        )
+        return
+    
+    post_id = context.args[0]
+    if not _find_autopost(post_id):
+        await update.message.reply_text("❌ پست خودکاری با این شناسه پیدا نشد.")
+        return
+    
+    queue = ContentQueue(post_id)
+    
+    if len(context.args) > 1:
+        mode = context.args[1].lower()
+        if mode not in QUEUE_MODES:
+            await update.message.reply_text(f"حالت نامعتبر است. حالت‌های مجاز: {', '.join(QUEUE_MODES)}")
+            return
+        queue.set_mode(mode)
+    
+    await update.message.reply_text(
+        f"📚 صف پست خودکار {post_id}\n"
+        f"تعداد موارد: {len(queue)}\n"
+        f"حالت: {queue.state['mode']}\n"
+        f"موقعیت فعلی: {queue.state['cursor']}"
+    )
+
 @is_admin
 async def set_autopost(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Set up automatic posting at regular intervals"""
@@ -483,8 +732,7 @@ async def set_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             welcome_message = ' '.join(context.args)
             
             # Save the welcome message
-            conf["welcome_messages"][str(group_id)] = welcome_message
-            config.save_config(conf)
+            set_welcome_message(group_id, welcome_message)
             
             # Clear the state
             context.user_data.pop("setting_welcome", None)
@@ -563,6 +811,53 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 "📊 مدیریت نظرسنجی - لطفاً یک گزینه را انتخاب کنید:",
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
+        elif action == "create_new_poll":
+            # Start the same conversation as /poll
+            context.user_data["creating_poll"] = {
+                "state": "title",
+                "options": []
+            }
+            await query.edit_message_text(
+                "Let's create a poll! First, send me the poll question/title."
+            )
+        elif action == "add_poll_option":
+            poll_data = context.user_data.get("creating_poll")
+            if poll_data:
+                poll_data["state"] = "options"
+                await query.edit_message_text("Send me the next option.")
+        elif action == "finish_poll":
+            poll_data = context.user_data.get("creating_poll")
+            if not poll_data or len(poll_data["options"]) < 2:
+                await query.edit_message_text("A poll needs at least two options. Send me another option.")
+            else:
+                await ask_poll_targets(query.edit_message_text, poll_data)
+        elif action == "poll_target_select":
+            poll_data = context.user_data.get("creating_poll")
+            if poll_data and poll_data.get("state") == "target":
+                # Toggle the chat in the selection
+                target_id = data.get("id")
+                if target_id in poll_data["targets"]:
+                    poll_data["targets"].remove(target_id)
+                else:
+                    poll_data["targets"].append(target_id)
+                conf = config.init_config()
+                from bot.poll_keyboards import create_poll_target_keyboard
+                keyboard = create_poll_target_keyboard(conf["channels"], conf["groups"], poll_data["targets"])
+                await query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
+        elif action in ("poll_send", "poll_send_each"):
+            poll_data = context.user_data.get("creating_poll")
+            if poll_data and poll_data.get("targets"):
+                conf = config.init_config()
+                names = dict(conf["channels"], **conf["groups"])
+                poll_data["target_names"] = {str(target_id): names.get(str(target_id), str(target_id)) for target_id in poll_data["targets"]}
+                separate = action == "poll_send_each"
+                sent = await create_and_send_poll(update, context, poll_data["targets"], separate)
+                if sent and separate:
+                    await query.edit_message_text(f"✅ {sent} نظرسنجی جداگانه منتشر شد.")
+                elif sent:
+                    await query.edit_message_text(f"✅ نظرسنجی در {sent} چت منتشر شد.")
+                else:
+                    await query.edit_message_text("ارسال نظرسنجی ناموفق بود. دسترسی ربات در چت‌های انتخاب شده را بررسی کنید.")
         elif action == "poll_templates":
             from bot.poll_keyboards import create_poll_templates_keyboard
             keyboard = create_poll_templates_keyboard()
@@ -570,6 +865,43 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 "📝 قالب‌های نظرسنجی - لطفاً یک قالب را انتخاب کنید:",
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
+        elif action.startswith("poll_template_") and action[len("poll_template_"):] in BUILTIN_TEMPLATES:
+            # Built-in templates only need the question
+            context.user_data["creating_poll"] = {
+                "state": "title",
+                "template": action[len("poll_template_"):],
+                "options": []
+            }
+            await query.edit_message_text("📝 سوال نظرسنجی را ارسال کنید:")
+        elif action == "poll_template_custom":
+            template = get_custom_template()
+            if template:
+                from bot.poll_keyboards import create_custom_template_keyboard
+                keyboard = create_custom_template_keyboard()
+                options = "\n".join(f"• {option}" for option in template["options"])
+                await query.edit_message_text(
+                    f"✏️ قالب سفارشی:\n\n{template['title']}\n{options}",
+                    reply_markup=InlineKeyboardMarkup(keyboard)
+                )
+            else:
+                context.user_data["creating_poll"] = {"state": "template", "options": []}
+                await query.edit_message_text(
+                    "✏️ قالب سفارشی را ارسال کنید: عنوان در خط اول و هر گزینه در یک خط."
+                )
+        elif action == "poll_template_edit_custom":
+            context.user_data["creating_poll"] = {"state": "template", "options": []}
+            await query.edit_message_text(
+                "✏️ قالب سفارشی را ارسال کنید: عنوان در خط اول و هر گزینه در یک خط."
+            )
+        elif action == "poll_template_use_custom":
+            template = get_custom_template()
+            if template:
+                poll_data = context.user_data["creating_poll"] = {
+                    "template": CUSTOM_TEMPLATE,
+                    "title": template["title"],
+                    "options": []
+                }
+                await ask_poll_targets(query.edit_message_text, poll_data)
         elif action == "poll_settings":
             from bot.poll_keyboards import create_poll_settings_keyboard
             keyboard = create_poll_settings_keyboard()
@@ -577,6 +909,80 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 "⚙️ تنظیمات نظرسنجی - لطفاً گزینه مورد نظر را انتخاب کنید:",
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
+        elif action == "poll_setting_multiple_choices":
+            enabled = toggle_poll_setting("multiple_choices")
+            from bot.poll_keyboards import create_poll_settings_keyboard
+            keyboard = create_poll_settings_keyboard()
+            await query.edit_message_text(
+                "📑 انتخاب چندگانه برای نظرسنجی‌های جدید " + ("فعال شد." if enabled else "غیرفعال شد.") + "\n\n"
+                "⚙️ تنظیمات نظرسنجی - لطفاً گزینه مورد نظر را انتخاب کنید:",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        elif action == "poll_setting_anonymous":
+            enabled = toggle_poll_setting("anonymous")
+            from bot.poll_keyboards import create_poll_settings_keyboard
+            keyboard = create_poll_settings_keyboard()
+            await query.edit_message_text(
+                "🕶️ رای‌گیری ناشناس برای نظرسنجی‌های جدید " + ("فعال شد." if enabled else "غیرفعال شد.") + "\n"
+                "در این حالت شناسه رای‌دهندگان ذخیره نمی‌شود و آمار شرکت‌کنندگان تقریبی است.\n\n"
+                "⚙️ تنظیمات نظرسنجی - لطفاً گزینه مورد نظر را انتخاب کنید:",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        elif action == "poll_setting_time_limit":
+            time_limit = cycle_poll_time_limit()
+            from bot.poll_keyboards import create_poll_settings_keyboard
+            keyboard = create_poll_settings_keyboard()
+            await query.edit_message_text(
+                f"⏱️ محدودیت زمانی نظرسنجی‌های جدید: {format_time_limit(time_limit)}\n"
+                "برای تغییر دوباره روی دکمه بزنید.\n\n"
+                "⚙️ تنظیمات نظرسنجی - لطفاً گزینه مورد نظر را انتخاب کنید:",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        elif action == "poll_close":
+            poll_id = data.get("poll_id")
+            closed = await close_polls(context.bot, [poll_id])
+            if not closed:
+                await query.edit_message_text("Poll not found or already closed.")
+            else:
+                # A poll message itself was already replaced by the final results
+                shown = {(message["chat_id"], message["message_id"]) for message in poll_messages(closed[0].poll)}
+                if (query.message.chat_id, query.message.message_id) not in shown:
+                    from bot.poll_keyboards import create_poll_results_keyboard
+                    keyboard = create_poll_results_keyboard(closed[0].poll["id"], active=False)
+                    await query.edit_message_text(closed[0].results()["text"], reply_markup=InlineKeyboardMarkup(keyboard))
+        elif action in ("active_polls", "finished_polls"):
+            finished = action == "finished_polls"
+            tallies, page, pages = list_polls(finished, data.get("page", 0))
+            from bot.poll_keyboards import create_poll_list_keyboard
+            keyboard = create_poll_list_keyboard([tally.poll for tally in tallies], page, pages, finished)
+            title = "📊 نظرسنجی‌های پایان یافته" if finished else "🔄 نظرسنجی‌های فعال"
+            if not tallies:
+                title += "\n\nنظرسنجی‌ای وجود ندارد."
+            elif pages > 1:
+                title += f" (صفحه {page + 1} از {pages})"
+            await query.edit_message_text(title, reply_markup=InlineKeyboardMarkup(keyboard))
+        elif action == "poll_results":
+            tally = get_tally(data.get("poll_id"))
+            if tally is None:
+                await query.edit_message_text("Poll not found.")
+            else:
+                from bot.poll_keyboards import create_poll_results_keyboard
+                keyboard = create_poll_results_keyboard(tally.poll["id"], not tally.closed)
+                try:
+                    await query.edit_message_text(tally.results()["text"], reply_markup=InlineKeyboardMarkup(keyboard))
+                except Exception as e:
+                    # Refreshing unchanged results is not an error
+                    logger.debug(f"Results of poll {tally.poll['id']} unchanged: {e}")
+        elif action == "poll_analytics":
+            poll_id = data.get("poll_id")
+            text = poll_report(poll_id) if poll_id else summary_report()
+            from bot.poll_keyboards import create_poll_analytics_keyboard
+            keyboard = create_poll_analytics_keyboard(poll_id)
+            try:
+                await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+            except Exception as e:
+                # Refreshing an unchanged report is not an error
+                logger.debug(f"Poll analytics unchanged: {e}")
         elif action == "back_to_poll_management":
             from bot.poll_keyboards import create_poll_management_keyboard
             keyboard = create_poll_management_keyboard()
@@ -600,9 +1006,48 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 "📝 قالب‌های پیام خوش‌آمدگویی - لطفاً یک قالب را انتخاب کنید:",
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
+        elif action == "raid_unlock":
+            if await unlock(context.bot, data["chat"]):
+                await query.edit_message_text("🔓 قرنطینه گروه برداشته شد و دسترسی‌های قبلی برگشت.")
+            else:
+                await query.edit_message_text("این گروه در قرنطینه نیست.")
+        elif action == "raid_review":
+            reviewed = review(data["chat"])
+            if reviewed:
+                from bot.welcome_keyboards import create_raid_review_keyboard
+                await query.edit_message_text(
+                    f"👀 {len(reviewed)} عضو تازه‌وارد (قدیمی‌ترین اول):\n\n{id_list(reviewed)}\n\n"
+                    "اخراج یا پذیرش فقط روی همین فهرست انجام می‌شود.",
+                    reply_markup=InlineKeyboardMarkup(create_raid_review_keyboard(data["chat"], len(reviewed)))
+                )
+            else:
+                await query.edit_message_text("عضو تازه‌واردی برای بررسی ثبت نشده است.")
+        elif action in ("raid_kick", "raid_approve"):
+            from bot.welcome_keyboards import create_raid_alert_keyboard
+            if action == "raid_kick":
+                await query.edit_message_text("⏳ در حال اخراج اعضای بررسی‌شده...")
+                count = await kick_reviewed(context.bot, data["chat"])
+                text = f"✅ {count} عضو بررسی‌شده اخراج شدند."
+            else:
+                await query.edit_message_text("⏳ در حال پذیرش اعضای بررسی‌شده...")
+                count = await approve_reviewed(context.bot, data["chat"])
+                text = f"✅ محدودیت {count} عضو بررسی‌شده برداشته شد."
+            await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(create_raid_alert_keyboard(data["chat"])))
         elif action == "welcome_settings":
             from bot.welcome_keyboards import create_welcome_settings_keyboard
-            keyboard = create_welcome_settings_keyboard()
+            keyboard = create_welcome_settings_keyboard(get_welcome_settings())
+            await query.edit_message_text(
+                "⚙️ تنظیمات پیام خوش‌آمدگویی - لطفاً گزینه مورد نظر را انتخاب کنید:",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        elif action in (
+            "welcome_setting_burst_window", "welcome_setting_mention_cap", "welcome_setting_summary_threshold",
+            "welcome_setting_delay", "welcome_setting_auto_delete",
+            "welcome_setting_captcha", "welcome_setting_captcha_timeout", "welcome_setting_raid_threshold"
+        ):
+            cycle_welcome_setting(action[len("welcome_setting_"):])
+            from bot.welcome_keyboards import create_welcome_settings_keyboard
+            keyboard = create_welcome_settings_keyboard(get_welcome_settings())
             await query.edit_message_text(
                 "⚙️ تنظیمات پیام خوش‌آمدگویی - لطفاً گزینه مورد نظر را انتخاب کنید:",
                 reply_markup=InlineKeyboardMarkup(keyboard)
@@ -939,6 +1384,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 channel_name = conf["channels"][str(channel_id)]
                 del conf["channels"][str(channel_id)]
                 config.save_config(conf)
+                forget_managed()
                 await query.edit_message_text(f"Channel '{channel_name}' has been removed.")
             else:
                 await query.edit_message_text("Channel not found.")
@@ -956,6 +1402,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     del conf["welcome_messages"][str(group_id)]
                 
                 config.save_config(conf)
+                forget_welcome(group_id)
+                forget_managed()
                 await query.edit_message_text(f"Group '{group_name}' has been removed.")
             else:
                 await query.edit_message_text("Group not found.")
@@ -1122,6 +1570,17 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     reply_markup=InlineKeyboardMarkup(keyboard)
                 )
         
+        elif action == "finish_album":
+            album = context.user_data.pop("album", None)
+            
+            if not album or not album["items"]:
+                await query.edit_message_text("هیچ آلبومی در حال دریافت نیست.")
+                return
+            
+            await query.edit_message_text(f"🖼️ آلبوم با {len(album['items'])} مورد دریافت شد.")
+            media = {"type": "album", "items": album["items"]}
+            await _use_media_content(update, context, media, album["caption"])
+        
         elif action == "schedule_add_buttons":
             # Start the process of adding buttons for scheduled message
             context.user_data["adding_buttons"] = {
@@ -1229,17 +1688,30 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 chat = await context.bot.get_chat(chat_id)
                 member_count = await context.bot.get_chat_member_count(chat_id)
                 
-                # For privacy and API limitations, we don't get the actual list
-                # But we can provide a count and basic info
+                # The API has no member list; the roster is built from member
+                # updates, and the admin list can be fetched in full
+                try:
+                    sync_admins(chat.id, await context.bot.get_chat_administrators(chat.id))
+                except Exception as e:
+                    logger.error(f"Error getting administrators of {chat.id}: {e}")
+                roster = get_roster(chat.id)
+                week_ago = (datetime.now() - timedelta(days=7)).timestamp()
+                admins = roster.members(ADMINS)
+                joined = roster.joined_since(week_ago)
+                left = roster.left_since(week_ago)
+                
                 chat_info = (
                     f"📊 Chat Information for {chat_type} '{chat_name}'\n\n"
                     f"Title: {chat.title}\n"
                     f"Chat ID: {chat.id}\n"
                     f"Type: {chat.type}\n"
-                    f"Member count: {member_count}\n\n"
-                    "Due to Telegram API limitations, detailed member lists are "
-                    "only available for channels/groups where the bot is an admin "
-                    "and the member count is not too large."
+                    f"Member count: {member_count}\n"
+                    f"Tracked members: {len(roster.members())}\n\n"
+                    f"👮 Admins ({len(admins)}): {id_list(admins)}\n"
+                    f"📥 Joined this week ({len(joined)}): {id_list(joined)}\n"
+                    f"📤 Left this week ({len(left)}): {id_list(left)}\n\n"
+                    "Members are tracked from the moment the bot became an admin, "
+                    "as Telegram only reports joins, leaves and status changes to admins."
                 )
                 
                 await query.edit_message_text(chat_info)
@@ -1249,113 +1721,243 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     f"Error getting members from {chat_type} '{chat_name}'.\n"
                     "Make sure the bot is an admin in the channel/group and has the necessary permissions."
                 )
-        
-        elif action == "poll_vote":
-            # Handle poll vote
-            poll_id = data.get("poll_id")
-            option_id = data.get("option_id")
-            user_id = update.effective_user.id
-            
-            # Load the poll data
-            data = load_data()
-            
-            for poll in data.get("polls", []):
-                if poll["id"] == poll_id:
-                    # Record the vote
-                    if user_id not in poll["votes"]:
-                        poll["votes"][str(user_id)] = option_id
-                        poll["options"][option_id]["count"] += 1
-                        
-                        # Save the updated poll data
-                        save_data(data)
-                        
-                        # Update the poll message with new counts
-                        poll_text = f"📊 Poll: {poll['title']}\n\n"
-                        for i, option in enumerate(poll["options"]):
-                            poll_text += f"{option['text']}: {option['count']} votes\n"
-                        
-                        # Recreate the keyboard
-                        keyboard = []
-                        row = []
-                        for i, option in enumerate(poll["options"]):
-                            row.append({
-                                "text": f"{option['text']} ({option['count']})",
-                                "callback_data": json.dumps({
-                                    "action": "poll_vote",
-                                    "poll_id": poll_id,
-                                    "option_id": i
-                                })
-                            })
-                            
-                            # 2 buttons per row
-                            if len(row) == 2:
-                                keyboard.append(row)
-                                row = []
-                        
-                        # Add any remaining buttons
-                        if row:
-                            keyboard.append(row)
-                        
-                        await query.edit_message_text(
-                            poll_text,
-                            reply_markup=InlineKeyboardMarkup(keyboard)
-                        )
-                    else:
-                        # User already voted
-                        previous_vote = int(poll["votes"][str(user_id)])
-                        if previous_vote != option_id:
-                            # Changed vote
-                            poll["options"][previous_vote]["count"] -= 1
-                            poll["options"][option_id]["count"] += 1
-                            poll["votes"][str(user_id)] = option_id
-                            
-                            # Save the updated poll data
-                            save_data(data)
-                            
-                            # Update the poll message with new counts
-                            poll_text = f"📊 Poll: {poll['title']}\n\n"
-                            for i, option in enumerate(poll["options"]):
-                                poll_text += f"{option['text']}: {option['count']} votes\n"
-                            
-                            # Recreate the keyboard
-                            keyboard = []
-                            row = []
-                            for i, option in enumerate(poll["options"]):
-                                row.append({
-                                    "text": f"{option['text']} ({option['count']})",
-                                    "callback_data": json.dumps({
-                                        "action": "poll_vote",
-                                        "poll_id": poll_id,
-                                        "option_id": i
-                                    })
-                                })
-                                
-                                # 2 buttons per row
-                                if len(row) == 2:
-                                    keyboard.append(row)
-                                    row = []
-                            
-                            # Add any remaining buttons
-                            if row:
-                                keyboard.append(row)
-                            
-                            await query.edit_message_text(
-                                poll_text,
-                                reply_markup=InlineKeyboardMarkup(keyboard)
-                            )
-                        else:
-                            # Same vote as before
-                            await query.answer("You've already voted for this option.")
-                    
-                    return
-            
-            # Poll not found
-            await query.answer("Poll not found or has expired.")
     
     except Exception as e:
         logger.error(f"Error in button callback: {e}")
         await query.edit_message_text(f"An error occurred: {str(e)}")
 
+async def poll_vote_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Count a poll vote; open to every user, results are edited in at most every few seconds"""
+    query = update.callback_query
+    
+    try:
+        data = json.loads(query.data)
+        poll_id = data.get("poll_id")
+        option_id = int(data.get("option_id"))
+    except (ValueError, TypeError):
+        await query.answer()
+        return
+    
+    chat_id = query.message.chat_id if query.message else None
+    result = record_vote(poll_id, update.effective_user.id, option_id, chat_id)
+    if result is None:
+        await query.answer("Poll not found or has expired.")
+        return
+    
+    if result == VOTE_UNCHANGED:
+        await query.answer("You've already voted for this option.")
+        return
+    
+    if result == VOTE_DUPLICATE:
+        await query.answer("You've already voted in this anonymous poll.")
+        return
+    
+    # Polls sent before their messages were stored learn them from the first vote
+    if query.message:
+        set_poll_message(poll_id, query.message.chat_id, query.message.message_id)
+    
+    answers = {VOTE_ADDED: "✅ Vote recorded", VOTE_CHANGED: "✅ Vote changed", VOTE_REMOVED: "❎ Vote removed"}
+    await query.answer(answers[result])
+    request_result_edit(context.bot, poll_id)
+
+async def moderate_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Delete group messages that break the group's anti-spam rules"""
+    message = update.effective_message
+    if message is None or update.effective_user is None:
+        return
+    
+    reason = check_message(message)
+    if reason is None:
+        return
+    
+    # Group administrators may post anything
+    if await is_group_admin(context.bot, message.chat_id, update.effective_user.id):
+        return
+    
+    # Deletions are sent in batches per chat
+    queue_delete(context.bot, message.chat_id, message.message_id)
+    if reason == REASON_FLOOD:
+        rules = get_rules(message.chat_id)
+        if rules["flood_action"] == "mute":
+            await mute(context.bot, message.chat_id, update.effective_user.id, rules["flood_mute_seconds"])
+    else:
+        logger.info(f"Deleting message {message.message_id} in {message.chat_id} ({reason})")
+
+@is_admin
+async def filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show or change the anti-spam rules of a group"""
+    args = list(context.args)
+    
+    # Used inside a group it applies to that group, otherwise the group id comes first
+    if update.effective_chat.type in ("group", "supergroup"):
+        chat_id = update.effective_chat.id
+    elif args and args[0].lstrip("-").isdigit():
+        chat_id = int(args.pop(0))
+    else:
+        await update.message.reply_text(
+            "نحوه استفاده (در گروه، یا با شناسه گروه در ابتدا):\n"
+            "/filter - نمایش قوانین\n"
+            "/filter add <کلمه>، <کلمه>، ...\n"
+            "/filter del <کلمه>، <کلمه>، ...\n"
+            "/filter links|invites|forwards on|off\n"
+            "/filter flood <تعداد> <ثانیه> [mute|delete] (0 برای خاموش)\n"
+            "/filter allow <شناسه کانال>"
+        )
+        return
+    
+    rules = get_rules(chat_id)
+    command = args[0].lower() if args else ""
+    value = " ".join(args[1:])
+    
+    if command in ("add", "del"):
+        words = [word.strip() for word in re.split(r"[,،\n]", value) if word.strip()]
+        if not words:
+            await update.message.reply_text("حداقل یک کلمه وارد کنید.")
+            return
+        keywords = rules["keywords"]
+        if command == "add":
+            known = set(keywords)
+            keywords = keywords + [word for word in words if word not in known]
+        else:
+            removed = set(words)
+            keywords = [word for word in keywords if word not in removed]
+        rules = update_rules(chat_id, keywords=keywords)
+    elif command in ("links", "invites", "forwards") and value in ("on", "off"):
+        rules = update_rules(chat_id, **{f"block_{command}": value == "on"})
+    elif command == "flood" and len(args) >= 3 and args[1].isdigit() and args[2].isdigit() and int(args[2]) > 0:
+        changes = {"flood_limit": int(args[1]), "flood_seconds": int(args[2])}
+        if len(args) > 3 and args[3] in FLOOD_ACTIONS:
+            changes["flood_action"] = args[3]
+        rules = update_rules(chat_id, **changes)
+    elif command == "allow" and value.lstrip("-").isdigit():
+        rules = update_rules(chat_id, allowed_channels=sorted(set(rules["allowed_channels"]) | {int(value)}))
+    elif command:
+        await update.message.reply_text("دستور نامعتبر است. /filter را بدون پارامتر در گروه بفرستید تا راهنما را ببینید.")
+        return
+    
+    state = {True: "✅", False: "❌"}
+    await update.message.reply_text(
+        f"🛡️ قوانین ضد اسپم گروه {chat_id}\n\n"
+        f"{state[rules['block_links']]} مسدود کردن لینک\n"
+        f"{state[rules['block_invites']]} مسدود کردن لینک دعوت\n"
+        f"{state[rules['block_forwards']]} مسدود کردن فوروارد از کانال\n"
+        f"🌊 کنترل ارسال پیاپی: " + (f"{rules['flood_limit']} پیام در {rules['flood_seconds']} ثانیه ({rules['flood_action']})" if rules["flood_limit"] else "خاموش") + "\n"
+        f"📢 کانال‌های مجاز: {', '.join(str(channel) for channel in rules['allowed_channels']) or '-'}\n"
+        f"🚫 کلمات ممنوع: {len(rules['keywords'])}"
+    )
+
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Keep the roster of a managed chat up to date with joins, leaves and status changes"""
+    change = update.chat_member or update.my_chat_member
+    if change is not None:
+        record_update(change)
+
+async def captcha_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Check a captcha answer; pressed by new members, not admins"""
+    query = update.callback_query
+    
+    try:
+        choice = int(json.loads(query.data).get("c"))
+    except (ValueError, TypeError):
+        await query.answer()
+        return
+    
+    passed = await solve(context.bot, query.message.chat, update.effective_user, choice)
+    if passed is None:
+        await query.answer("این پیام برای شما نیست.")
+    elif passed:
+        await query.answer("✅ تأیید شد، خوش آمدید!")
+    else:
+        await query.answer("❌ پاسخ اشتباه بود.")
+
+async def _save_scheduled_post(update: Update, user_data, text, media=None) -> None:
+    """Schedule the post collected in the scheduling conversation"""
+    try:
+        scheduling_data = user_data["scheduling"]
+        target_id = scheduling_data["target"]["id"]
+        target_type = scheduling_data["target"]["type"]
+        scheduled_time = scheduling_data["time"]
+        
+        # Create scheduled message data
+        from bot.utils import generate_unique_id
+        message_data = {
+            "id": generate_unique_id(),
+            "text": text,
+            "time": scheduled_time.strftime("%Y-%m-%d %H:%M:%S"),
+            "target": {
+                "id": target_id,
+                "type": target_type
+            }
+        }
+        if media:
+            message_data["media"] = media
+        
+        # Set up the job in scheduler (this also saves it to storage)
+        schedule_one_time_message(message_data)
+        
+        # Get target name
+        conf = config.init_config()
+        if target_type == "channel":
+            target_dict = conf["channels"]
+        else:
+            target_dict = conf["groups"]
+        
+        target_name = target_dict.get(str(target_id), "Unknown")
+        
+        # Success message
+        time_str = scheduled_time.strftime("%Y-%m-%d %H:%M:%S")
+        await update.effective_message.reply_text(
+            f"✅ پیام با موفقیت برای ارسال به {target_type} «{target_name}» در {time_str} زمان‌بندی شد!",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(
+                    "🔙 بازگشت به مدیریت زمان‌بندی",
+                    callback_data=json.dumps({"action": "schedule_management"})
+                )
+            ]])
+        )
+    except Exception as e:
+        logger.error(f"Error scheduling message: {e}")
+        await update.effective_message.reply_text(
+            config.MESSAGES["error"].format(str(e)),
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(
+                    "🔙 بازگشت به مدیریت زمان‌بندی",
+                    callback_data=json.dumps({"action": "schedule_management"})
+                )
+            ]])
+        )
+    
+    # Clear state
+    user_data.pop("scheduling", None)
+
+async def _save_autopost(update: Update, user_data, text, media=None) -> None:
+    """Set up the automatic post collected in the autopost conversation"""
+    try:
+        post_data = dict(user_data["autopost"])
+        post_data.pop("state", None)
+        post_data["text"] = text
+        if media:
+            post_data["media"] = media
+        
+        if not schedule_recurring_message(post_data):
+            raise RuntimeError("could not register the automatic post")
+        
+        await update.effective_message.reply_text(
+            config.MESSAGES["autopost_added"],
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(
+                    "🔙 بازگشت به پست خودکار",
+                    callback_data=json.dumps({"action": "autopost_management"})
+                )
+            ]])
+        )
+    except Exception as e:
+        logger.error(f"Error setting up autopost: {e}")
+        await update.effective_message.reply_text(config.MESSAGES["error"].format(str(e)))
+    
+    # Clear state
+    user_data.pop("autopost", None)
+
 # Text message handler for various states
 @is_admin
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1383,6 +1985,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             
             # Save config
             config.save_config(conf)
+            forget_managed()
             
             # Clear state
             user_data.pop("adding_channel")
@@ -1428,6 +2031,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             
             # Save config
             config.save_config(conf)
+            forget_managed()
             
             # Clear state
             user_data.pop("adding_group")
@@ -1590,7 +2194,8 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             target_type = target["type"]  # 'channel' or 'group'
             
             # Send message to target
-            await context.bot.send_message(chat_id=target_id, text=text)
+            message = await context.bot.send_message(chat_id=target_id, text=text)
+            record_sent(target_id, message.message_id)
             
             # Get target name
             conf = config.init_config()
@@ -1627,104 +2232,167 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
             user_data.pop("sending_to", None)
     
+    # Handle bulk-appending posts to an autopost queue
+    elif user_data.get("queue_append"):
+        post_id = user_data.pop("queue_append")["id"]
+        added = ContentQueue(post_id).extend(split_items(text))
+        await update.message.reply_text(f"✅ {added} پست به صف اضافه شد.")
+    
+    # Handle a welcome message for the selected group
+    elif user_data.get("setting_welcome"):
+        group_id = user_data.pop("setting_welcome")["group_id"]
+        set_welcome_message(group_id, text)
+        
+        group_name = config.init_config()["groups"].get(str(group_id), "Unknown Group")
+        await update.message.reply_text(f"Welcome message set for {group_name}!")
+    
+    # Handle poll title and options
+    elif user_data.get("creating_poll"):
+        await process_poll_creation(update, context)
+    
     # Handle scheduling message content
     elif user_data.get("scheduling") and user_data["scheduling"].get("state") == "entering_text":
+        await _save_scheduled_post(update, user_data, text)
+    
+    # Handle automatic post content
+    elif user_data.get("autopost") and user_data["autopost"].get("state") == "entering_text":
+        await _save_autopost(update, user_data, text)
+    
+    # No active state, show main menu
+    else:
+        keyboard = create_main_menu_keyboard()
+        await update.message.reply_text(
+            "لطفاً یکی از گزینه‌های منو را انتخاب کنید:",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
+@is_admin
+async def handle_media_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle photos, videos and documents sent as post content"""
+    user_data = context.user_data
+    message = update.message
+    media = extract_media(message)
+    caption = message.caption_html or ""
+    
+    if media is None:
+        return
+    
+    # A CSV/JSONL file of posts to schedule
+    if user_data.get("importing") and media["type"] == "document":
+        user_data.pop("importing")
         try:
-            scheduling_data = user_data["scheduling"]
-            target_id = scheduling_data["target"]["id"]
-            target_type = scheduling_data["target"]["type"]
-            scheduled_time = scheduling_data["time"]
-            
-            # Create scheduled message data
-            from bot.utils import generate_unique_id
-            message_data = {
-                "id": generate_unique_id(),
-                "text": text,
-                "time": scheduled_time.strftime("%Y-%m-%d %H:%M:%S"),
-                "target": {
-                    "id": target_id,
-                    "type": target_type
-                }
+            await _import_document(update, context, media)
+        except Exception as e:
+            logger.error(f"Error importing scheduled posts: {e}")
+            await update.message.reply_text(config.MESSAGES["error"].format(str(e)))
+        return
+    
+    # A file of posts for an autopost queue is streamed from disk, not kept in memory
+    if user_data.get("queue_append") and media["type"] == "document":
+        post_id = user_data.pop("queue_append")["id"]
+        try:
+            suffix = Path(message.document.file_name or "").suffix
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = Path(tmp_dir) / f"queue{suffix}"
+                document = await context.bot.get_file(media["file_id"])
+                await document.download_to_drive(path)
+                added = ContentQueue(post_id).extend(iter_file_items(path))
+            await update.message.reply_text(f"✅ {added} پست به صف اضافه شد.")
+        except Exception as e:
+            logger.error(f"Error appending queue file: {e}")
+            await update.message.reply_text(config.MESSAGES["error"].format(str(e)))
+        return
+    
+    # Album items arrive as separate messages sharing a media_group_id
+    if message.media_group_id and media["type"] in ALBUM_MEDIA_TYPES:
+        album = user_data.get("album")
+        if not album or album["group_id"] != message.media_group_id:
+            album = user_data["album"] = {
+                "group_id": message.media_group_id,
+                "items": [],
+                "caption": ""
             }
-            
-            # Schedule the message
-            from bot.storage import add_scheduled_message
-            add_scheduled_message(message_data)
-            
-            # Set up the job in scheduler
-            schedule_one_time_message(message_data)
-            
-            # Get target name
-            conf = config.init_config()
-            if target_type == "channel":
-                target_dict = conf["channels"]
-            else:
-                target_dict = conf["groups"]
-            
-            target_name = target_dict.get(str(target_id), "Unknown")
-            
-            # Success message
-            time_str = scheduled_time.strftime("%Y-%m-%d %H:%M:%S")
             await update.message.reply_text(
-                f"✅ پیام با موفقیت برای ارسال به {target_type} «{target_name}» در {time_str} زمان‌بندی شد!",
+                "🖼️ آلبوم در حال دریافت است. پس از ارسال همه موارد روی دکمه زیر بزنید.",
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton(
-                        "🔙 بازگشت به مدیریت زمان‌بندی",
-                        callback_data=json.dumps({"action": "schedule_management"})
+                        "✅ پایان آلبوم",
+                        callback_data=json.dumps({"action": "finish_album"})
                     )
                 ]])
             )
-            
-            # Clear state
-            user_data.pop("scheduling", None)
-        except Exception as e:
-            logger.error(f"Error scheduling message: {e}")
-            await update.message.reply_text(
-                config.MESSAGES["error"].format(str(e)),
+        
+        if len(album["items"]) < MAX_ALBUM_ITEMS:
+            album["items"].append(media)
+        if caption and not album["caption"]:
+            album["caption"] = caption
+        return
+    
+    await _use_media_content(update, context, media, caption)
+
+async def _use_media_content(update: Update, context: ContextTypes.DEFAULT_TYPE, media, caption) -> None:
+    """Send, schedule or autopost captured media depending on the conversation state"""
+    user_data = context.user_data
+    
+    # Send right away by copying the admin's message
+    if user_data.get("sending_to"):
+        target = user_data.pop("sending_to")
+        try:
+            media = dict(media, mode="copy")
+            sent = await send_media(context.bot, target["id"], media, caption=caption)
+            for message in sent if isinstance(sent, (list, tuple)) else [sent]:
+                record_sent(target["id"], message.message_id)
+            await update.effective_message.reply_text(
+                "✅ پیام با موفقیت ارسال شد!",
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton(
-                        "🔙 بازگشت به مدیریت زمان‌بندی",
-                        callback_data=json.dumps({"action": "schedule_management"})
+                        "🔙 بازگشت به منوی اصلی",
+                        callback_data=json.dumps({"action": "main_menu"})
                     )
                 ]])
             )
-            user_data.pop("scheduling", None)
+        except Exception as e:
+            logger.error(f"Error sending media message: {e}")
+            await update.effective_message.reply_text(config.MESSAGES["error"].format(str(e)))
+    
+    # Scheduled and automatic posts keep the file_id and resend it later without uploading
+    elif user_data.get("scheduling") and user_data["scheduling"].get("state") == "entering_text":
+        await _save_scheduled_post(update, user_data, caption, media)
+    
+    elif user_data.get("autopost") and user_data["autopost"].get("state") == "entering_text":
+        await _save_autopost(update, user_data, caption, media)
     
-    # No active state, show main menu
     else:
         keyboard = create_main_menu_keyboard()
-        await update.message.reply_text(
+        await update.effective_message.reply_text(
             "لطفاً یکی از گزینه‌های منو را انتخاب کنید:",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
 
 # Message Handlers for conversation states
-@is_admin
 async def new_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send welcome message to new chat members"""
-    # Load welcome messages
-    conf = config.init_config()
+    # Skip the bot itself
+    members = [
+        (member.first_name, member.username)
+        for member in update.message.new_chat_members
+        if member.id != context.bot.id
+    ]
     
-    chat_id = str(update.effective_chat.id)
+    # During a raid the group is locked down and joiners are held muted for review instead
+    if await record_joins(context.bot, update.effective_chat, [
+        member.id for member in update.message.new_chat_members
+        if member.id != context.bot.id
+    ]):
+        return
     
-    # Check if we have a welcome message for this group
-    if chat_id in conf["welcome_messages"]:
-        welcome_message = conf["welcome_messages"][chat_id]
-        
-        # For each new member
-        for member in update.message.new_chat_members:
-            # Skip if the new member is the bot itself
-            if member.id == context.bot.id:
-                continue
-            
-            # Format welcome message with user's information
-            formatted_message = welcome_message.replace("{name}", member.first_name)
-            formatted_message = formatted_message.replace("{username}", f"@{member.username}" if member.username else member.first_name)
-            formatted_message = formatted_message.replace("{chat}", update.effective_chat.title)
-            
-            # Send welcome message
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=formatted_message,
-                parse_mode=ParseMode.HTML
-            )
+    # With captcha on, members are welcomed once they pass it
+    if captcha_enabled():
+        await challenge_members(context.bot, update.effective_chat, [
+            member for member in update.message.new_chat_members
+            if member.id != context.bot.id and not member.is_bot
+        ])
+        return
+    
+    # Joins arriving close together share one welcome
+    await queue_welcome(context.bot, update.effective_chat, members)
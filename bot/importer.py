@@ -0,0 +1,196 @@
+"""
+Bulk import of scheduled posts from CSV or JSONL files
+ورود گروهی پیام‌های زمان‌بندی شده از فایل CSV یا JSONL
+
+Each row has the columns time, target, text and optionally buttons, where
+buttons is a JSON list of button rows, e.g.
+[[{"text": "Site", "url": "https://example.com"}]].
+
+Rows are parsed and validated in batches of IMPORT_BATCH_SIZE. In the bot,
+parsing runs on a worker thread, one batch per hop, and the valid posts are
+stored with a single rewrite of bot_data.json on the event loop, the only
+place it is written, so an import costs one save whatever its size. Their
+jobs are registered afterwards in chunks.
+
+Command line usage (jobs are registered the next time the bot starts):
+    python -m bot.importer posts.csv
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+import uuid
+from datetime import datetime
+from bot.storage import load_data, save_data
+import config
+
+logger = logging.getLogger(__name__)
+
+# Rows parsed per batch
+IMPORT_BATCH_SIZE = 5000
+
+# Jobs registered between two yields to the event loop
+IMPORT_REGISTER_CHUNK = 500
+
+# Only this many row errors are kept for the report
+MAX_REPORTED_ERRORS = 1000
+
+# Accepted formats for the time column
+TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M")
+
+class ImportResult:
+    """Outcome of an import: how many posts were stored and the per-row errors"""
+    
+    def __init__(self):
+        self.imported = 0
+        self.errors = []
+        self.error_count = 0
+    
+    def add_error(self, line, message):
+        """Record a rejected row"""
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+def iter_rows(path):
+    """Stream (line number, row dict) pairs from a .csv or .jsonl file"""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if str(path).endswith('.jsonl'):
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_no, ValueError(f"invalid JSON: {e}")
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+def _parse_time(value):
+    """Parse the time column"""
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), time_format)
+        except ValueError:
+            continue
+    raise ValueError(f"invalid time '{value}', use YYYY-MM-DD HH:MM")
+
+def _parse_target(value, conf):
+    """Resolve the target column against the managed channels and groups"""
+    target = str(value).strip()
+    if target in conf["channels"]:
+        target_type = "channel"
+    elif target in conf["groups"]:
+        target_type = "group"
+    else:
+        raise ValueError(f"target '{target}' is not a managed channel or group")
+    
+    target_id = target if target.startswith('@') else int(target)
+    return {"id": target_id, "type": target_type}
+
+def _parse_buttons(value):
+    """Parse and check the optional buttons column"""
+    if not value:
+        return None
+    
+    rows = json.loads(value) if isinstance(value, str) else value
+    if not isinstance(rows, list):
+        raise ValueError("buttons must be a list of rows")
+    
+    for row in rows:
+        for button in row if isinstance(row, list) else [row]:
+            if not isinstance(button, dict) or "text" not in button:
+                raise ValueError("every button needs a text")
+            if "url" not in button and "callback_data" not in button:
+                raise ValueError(f"button '{button['text']}' needs a url or callback_data")
+    return rows
+
+def parse_row(row, conf, now):
+    """Validate a row and turn it into a scheduled message"""
+    if isinstance(row, Exception):
+        raise row
+    
+    for column in ("time", "target", "text"):
+        if not row.get(column):
+            raise ValueError(f"missing {column}")
+    
+    scheduled_time = _parse_time(row["time"])
+    if scheduled_time <= now:
+        raise ValueError(f"time {row['time']} is in the past")
+    
+    message_data = {
+        "id": str(uuid.uuid4()),
+        "text": row["text"],
+        "time": scheduled_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "target": _parse_target(row["target"], conf)
+    }
+    
+    keyboard = _parse_buttons(row.get("buttons"))
+    if keyboard:
+        message_data["keyboard"] = keyboard
+    return message_data
+
+def parse_batches(path, result, batch_size=IMPORT_BATCH_SIZE):
+    """Yield lists of up to batch_size valid scheduled messages, recording rejected rows in result"""
+    conf = config.init_config()
+    now = datetime.now()
+    batch = []
+    
+    for line_no, row in iter_rows(path):
+        try:
+            batch.append(parse_row(row, conf, now))
+        except (ValueError, TypeError, json.JSONDecodeError) as e:
+            result.add_error(line_no, str(e))
+            continue
+        
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    
+    if batch:
+        yield batch
+
+def store_messages(messages):
+    """Append scheduled messages to storage in one save; returns False if saving failed"""
+    data = load_data()
+    data.setdefault("scheduled_messages", []).extend(messages)
+    return save_data(data)
+
+def import_file(path, batch_size=IMPORT_BATCH_SIZE):
+    """Validate every row of a file and store the valid ones in one save; returns an ImportResult"""
+    result = ImportResult()
+    messages = []
+    for batch in parse_batches(path, result, batch_size):
+        messages.extend(batch)
+    if messages and not store_messages(messages):
+        raise OSError("could not save the scheduled posts")
+    result.imported = len(messages)
+    
+    logger.info(f"Imported {result.imported} scheduled posts from {path}, {result.error_count} rows rejected")
+    return result
+
+def format_errors(result):
+    """Render the per-row errors of an import"""
+    lines = [f"line {line}: {message}" for line, message in result.errors]
+    if result.error_count > len(result.errors):
+        lines.append(f"... and {result.error_count - len(result.errors)} more")
+    return "\n".join(lines)
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Import scheduled posts from a CSV or JSONL file")
+    parser.add_argument("path", help="file with time, target, text and buttons columns")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="rows parsed per batch")
+    args = parser.parse_args()
+    
+    result = import_file(args.path, args.batch_size)
+    print(f"Imported {result.imported} posts, {result.error_count} rows rejected")
+    if result.error_count:
+        print(format_errors(result), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+"""
+Compact vote storage for large polls
+ذخیره‌سازی فشرده آراء برای نظرسنجی‌های بزرگ
+
+A ledger file is only rewritten in full when new voters were merged into it
+or when its changed votes outgrow the merge threshold. Between full writes a
+flush writes a small changes file next to it, holding the votes changed or
+added since, so a flush copies the changes instead of the whole ledger.
+
+Command line benchmark against the {user_id: option} dict ledgers replaced:
+    python -m bot.ledger --voters 1000000
+"""
+import argparse
+import json
+import logging
+import mmap
+import random
+import struct
+import time
+import tracemalloc
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from bot.sketches import BloomFilter, HyperLogLog, voter_hash
+
+logger = logging.getLogger(__name__)
+
+# Directory holding one ledger file per poll
+VOTES_DIR = Path('data') / 'votes'
+
+# File layout: magic, option typecode, voter count, generation, then the voter
+# ids (int64) and the options: an index (uint8) or, for multiple choice, a
+# bitmask (uint64). The generation goes up with every full write
+LEDGER_MAGIC = b'VLG2'
+LEDGER_HEADER = struct.Struct('<4scxxxQQ')
+
+# Changes file layout: magic, generation of the ledger file it applies to,
+# entry count, then the voter ids and their options as in the ledger file
+CHANGES_MAGIC = b'VLC1'
+CHANGES_HEADER = struct.Struct('<4sxxxxQQ')
+
+# Anonymous ledgers: magic, capacity, then the Bloom filter bits and HyperLogLog registers
+SKETCH_MAGIC = b'VSK1'
+SKETCH_HEADER = struct.Struct('<4sxxxxQ')
+
+# False positive rate of anonymous ledgers up to their capacity (the share of
+# new voters wrongly rejected as duplicates) and precision of their 4 KB voter count
+ANONYMOUS_ERROR_RATE = 0.01
+ANONYMOUS_PRECISION = 12
+
+# Vote event log, one record per counted click: time, voter id (0 in anonymous
+# polls), option, previous option (-1 for none) and kind
+VOTE_EVENT = struct.Struct('<IqhhB')
+EVENT_ADDED = 1
+EVENT_CHANGED = 2
+EVENT_REMOVED = 3
+
+# New voters are buffered in a dict and merged into the sorted arrays once
+# the buffer reaches this size or an eighth of the ledger, whichever is larger
+MERGE_MIN_PENDING = 4096
+
+def ledger_path(poll_id):
+    """Path of a poll's ledger file"""
+    return VOTES_DIR / f"{poll_id}.bin"
+
+def changes_path(path):
+    """Path of the changes file of a ledger file"""
+    return path.with_suffix('.changes.bin')
+
+class VoteLedger:
+    """Votes of one poll as a sorted array of voter ids with a parallel array of options.
+    
+    Lookups are a binary search over 9 bytes per voter instead of a dict entry
+    of 100+ bytes. Votes of new voters go to a small dict first and are merged
+    in sorted order in one pass. A ledger loaded from disk is memory-mapped
+    copy-on-write, so pages are only read when touched. Multiple-choice polls
+    use 'Q' options holding a bitmask of the selected options.
+    """
+    
+    def __init__(self, voters=None, options=None, typecode='B', generation=0):
+        self.voters = voters if voters is not None else array('q')
+        self.options = options if options is not None else array(typecode)
+        self.typecode = typecode
+        self.generation = generation
+        self._pending = {}
+        self._mmap = None
+        # Indices of the options changed in place since the last full write
+        self._changed = set()
+        # Whether the arrays differ from the ledger file by more than the changes
+        self._rewrite = True
+    
+    @classmethod
+    def from_dict(cls, votes, typecode='B'):
+        """Build a ledger from a {user_id: option} dict"""
+        ledger = cls(typecode=typecode)
+        for user_id in sorted(votes, key=int):
+            ledger.voters.append(int(user_id))
+            ledger.options.append(int(votes[user_id]))
+        return ledger
+    
+    @classmethod
+    def load(cls, path, typecode='B'):
+        """Map a ledger file, or return an empty ledger of the given typecode if there is none"""
+        try:
+            with open(path, 'rb') as f:
+                size = LEDGER_HEADER.size
+                magic, stored_typecode, count, generation = LEDGER_HEADER.unpack(f.read(size))
+                if magic != LEDGER_MAGIC:
+                    raise ValueError(f"{path} is not a vote ledger")
+                if stored_typecode != b'\x00':
+                    typecode = stored_typecode.decode()
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) if count else None
+        except FileNotFoundError:
+            return cls(typecode=typecode)
+        
+        if mapped is None:
+            ledger = cls(typecode=typecode, generation=generation)
+        else:
+            view = memoryview(mapped)
+            options_start = size + count * 8
+            ledger = cls(
+                view[size:options_start].cast('q'),
+                view[options_start:options_start + count * array(typecode).itemsize].cast(typecode),
+                typecode,
+                generation
+            )
+            ledger._mmap = mapped
+        ledger._rewrite = False
+        ledger._apply_changes(changes_path(path))
+        return ledger
+    
+    def _apply_changes(self, path):
+        """Replay the changes file written after the ledger file, if it belongs to this generation"""
+        try:
+            with open(path, 'rb') as f:
+                magic, generation, count = CHANGES_HEADER.unpack(f.read(CHANGES_HEADER.size))
+                if magic != CHANGES_MAGIC:
+                    raise ValueError(f"{path} is not a vote ledger changes file")
+                if generation != self.generation:
+                    # Left over from before the last full write, which already holds these votes
+                    return
+                voters = array('q')
+                voters.fromfile(f, count)
+                options = array(self.typecode)
+                options.fromfile(f, count)
+        except FileNotFoundError:
+            return
+        
+        for user_id, option in zip(voters, options):
+            self.set(user_id, option)
+    
+    def __len__(self):
+        return len(self.voters) + len(self._pending)
+    
+    def _find(self, user_id):
+        """Index of a voter in the sorted arrays, or -1"""
+        i = bisect_left(self.voters, user_id)
+        if i < len(self.voters) and self.voters[i] == user_id:
+            return i
+        return -1
+    
+    def get(self, user_id, default=None):
+        """The option a user voted for"""
+        if user_id in self._pending:
+            return self._pending[user_id]
+        i = self._find(user_id)
+        return self.options[i] if i >= 0 else default
+    
+    def set(self, user_id, option):
+        """Record or change a user's vote"""
+        i = self._find(user_id)
+        if i >= 0:
+            self.options[i] = option
+            self._changed.add(i)
+            return
+        
+        self._pending[user_id] = option
+        if len(self._pending) >= max(MERGE_MIN_PENDING, len(self.voters) // 8):
+            self.merge()
+    
+    def merge(self):
+        """Merge buffered voters into the sorted arrays"""
+        if not self._pending:
+            return
+        
+        voters = array('q')
+        options = array(self.typecode)
+        itemsize = options.itemsize
+        old_voters = memoryview(self.voters).cast('B')
+        old_options = memoryview(self.options).cast('B')
+        start = 0
+        for user_id in sorted(self._pending):
+            # Copy the run of existing voters below this one in a single slice
+            end = bisect_left(self.voters, user_id, start)
+            voters.frombytes(old_voters[start * 8:end * 8])
+            options.frombytes(old_options[start * itemsize:end * itemsize])
+            voters.append(user_id)
+            options.append(self._pending[user_id])
+            start = end
+        voters.frombytes(old_voters[start * 8:])
+        options.frombytes(old_options[start * itemsize:])
+        old_voters.release()
+        old_options.release()
+        
+        # Replacing the views lets the mapping of a loaded file be collected
+        self._mmap = None
+        self.voters = voters
+        self.options = options
+        self._pending.clear()
+        # Indices moved, so the changes can no longer be written on their own
+        self._changed.clear()
+        self._rewrite = True
+    
+    def items(self):
+        """(user_id, option) pairs in voter order"""
+        self.merge()
+        return zip(self.voters, self.options)
+    
+    def to_bytes(self):
+        """The on-disk form of this ledger"""
+        self.merge()
+        return (
+            LEDGER_HEADER.pack(LEDGER_MAGIC, self.typecode.encode(), len(self.voters), self.generation) +
+            self.voters.tobytes() + self.options.tobytes()
+        )
+    
+    def snapshot(self):
+        """What a flush writes: (full ledger file or None, changes file).
+        
+        The changes file holds every vote changed or added since the last full
+        write. The full file is rebuilt only after a merge or once the changes
+        reach the merge threshold, so most flushes copy just the changes.
+        """
+        if len(self._changed) + len(self._pending) >= max(MERGE_MIN_PENDING, len(self.voters) // 8):
+            self._rewrite = True
+        
+        if self._rewrite:
+            self.merge()
+            self.generation += 1
+            self._rewrite = False
+            self._changed.clear()
+            return self.to_bytes(), CHANGES_HEADER.pack(CHANGES_MAGIC, self.generation, 0)
+        
+        changed = sorted(self._changed)
+        voters = array('q', [self.voters[i] for i in changed])
+        options = array(self.typecode, [self.options[i] for i in changed])
+        voters.extend(self._pending)
+        options.extend(self._pending.values())
+        return None, CHANGES_HEADER.pack(CHANGES_MAGIC, self.generation, len(voters)) + voters.tobytes() + options.tobytes()
+    
+    def mark_unwritten(self):
+        """Make the next snapshot a full write, after a failed one"""
+        self._rewrite = True
+
+class AnonymousLedger:
+    """Votes of an anonymous poll, kept as fixed-size sketches instead of voter ids.
+    
+    A Bloom filter sized for capacity voters rejects repeated votes and a
+    HyperLogLog estimates the number of distinct voters; see bot.sketches for
+    their error bounds and how the filter saturates past its capacity. Voter
+    ids are hashed with the poll id as key and never stored, so votes cannot
+    be changed or exported per user.
+    """
+    
+    def __init__(self, poll_id, capacity, bits=None, registers=None):
+        self.salt = str(poll_id).encode()
+        self.capacity = capacity
+        self.voted = BloomFilter(capacity, ANONYMOUS_ERROR_RATE, bits)
+        self.voters = HyperLogLog(ANONYMOUS_PRECISION, registers)
+    
+    @classmethod
+    def load(cls, path, poll_id, capacity):
+        """Read an anonymous ledger file, or return an empty ledger sized for capacity voters"""
+        try:
+            with open(path, 'rb') as f:
+                magic, capacity = SKETCH_HEADER.unpack(f.read(SKETCH_HEADER.size))
+                if magic != SKETCH_MAGIC:
+                    raise ValueError(f"{path} is not an anonymous vote ledger")
+                # A file keeps the capacity it was created with
+                ledger = cls(poll_id, capacity)
+                f.readinto(ledger.voted.bits)
+                f.readinto(ledger.voters.registers)
+                return ledger
+        except FileNotFoundError:
+            return cls(poll_id, capacity)
+    
+    def add(self, user_id):
+        """Record that a user voted; returns False if they (probably) voted before"""
+        hashes = voter_hash(user_id, self.salt)
+        self.voters.add(hashes)
+        return self.voted.add(hashes)
+    
+    def __len__(self):
+        return len(self.voters)
+    
+    def items(self):
+        """No per-voter records are kept"""
+        return iter(())
+    
+    def to_bytes(self):
+        """The on-disk form of this ledger"""
+        return SKETCH_HEADER.pack(SKETCH_MAGIC, self.capacity) + bytes(self.voted.bits) + bytes(self.voters.registers)
+    
+    def snapshot(self):
+        """What a flush writes: the sketches are fixed-size, so always the full file"""
+        return self.to_bytes(), None
+
+def origins_path(poll_id):
+    """Path of the ledger mapping voters of a multi-target poll to the chat they voted in"""
+    return VOTES_DIR / f"{poll_id}.origins.bin"
+
+def events_path(poll_id):
+    """Path of a poll's vote event log"""
+    return VOTES_DIR / f"{poll_id}.events"
+
+def append_events(poll_id, content):
+    """Append packed VOTE_EVENT records to a poll's event log"""
+    VOTES_DIR.mkdir(parents=True, exist_ok=True)
+    with open(events_path(poll_id), 'ab') as f:
+        f.write(content)
+
+def write_ledger(poll_id, content, path=None):
+    """Atomically replace a poll's ledger file (or another file of the poll)"""
+    VOTES_DIR.mkdir(parents=True, exist_ok=True)
+    path = path or ledger_path(poll_id)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    tmp_path.replace(path)
+
+def write_snapshot(poll_id, snapshot, path=None):
+    """Write a ledger snapshot: the full file if it was rebuilt, then the changes file"""
+    path = path or ledger_path(poll_id)
+    content, changes = snapshot
+    if content is not None:
+        write_ledger(poll_id, content, path)
+    if changes is not None:
+        write_ledger(poll_id, changes, changes_path(path))
+
+def _measure(build):
+    """Run build() once for its time and once under tracemalloc for the memory it keeps; returns (result, seconds, bytes)"""
+    started = time.perf_counter()
+    build()
+    seconds = time.perf_counter() - started
+    
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, seconds, size
+
+def benchmark(voter_count, change_count=10000, option_count=4):
+    """Memory per voter, vote latency and flush cost of a ledger against a {user_id: option} dict"""
+    random.seed(1)
+    user_ids = random.sample(range(1, 10 ** 10), voter_count)
+    changed = random.sample(user_ids, min(change_count, voter_count))
+    results = {}
+    
+    def build_dict():
+        votes = {}
+        for i, user_id in enumerate(user_ids):
+            votes[str(user_id)] = i % option_count
+        return votes
+    
+    def build_ledger():
+        ledger = VoteLedger()
+        for i, user_id in enumerate(user_ids):
+            ledger.set(user_id, i % option_count)
+        ledger.merge()
+        return ledger
+    
+    for name, build in (("dict", build_dict), ("ledger", build_ledger)):
+        votes, seconds, size = _measure(build)
+        results[f"{name} new vote"] = seconds / voter_count
+        results[f"{name} memory"] = size / voter_count
+        if name == "ledger":
+            # The first flush writes the full file, later ones only the changes
+            started = time.perf_counter()
+            content, _ = votes.snapshot()
+            results["ledger full flush"] = time.perf_counter() - started
+            results["ledger full flush bytes"] = len(content)
+        
+        started = time.perf_counter()
+        for user_id in changed:
+            if name == "dict":
+                votes[str(user_id)] = 0
+            else:
+                votes.set(user_id, 0)
+        results[f"{name} changed vote"] = (time.perf_counter() - started) / len(changed)
+        
+        # The dict was saved inside the poll's JSON object on every flush
+        started = time.perf_counter()
+        if name == "dict":
+            written = len(json.dumps(votes))
+        else:
+            written = len(votes.snapshot()[1])
+        results[f"{name} flush"] = time.perf_counter() - started
+        results[f"{name} flush bytes"] = written
+    return results
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Benchmark vote ledgers against a dict of votes")
+    parser.add_argument("--voters", type=int, default=1000000)
+    parser.add_argument("--changes", type=int, default=10000, help="votes changed before the measured flush")
+    args = parser.parse_args()
+    
+    results = benchmark(args.voters, args.changes)
+    print(f"{args.voters} voters, {args.changes} changed votes before a flush")
+    for name in ("dict", "ledger"):
+        print(
+            f"{name}: {results[f'{name} memory']:.1f} bytes/voter, "
+            f"{results[f'{name} new vote'] * 1e6:.2f} µs/new vote, "
+            f"{results[f'{name} changed vote'] * 1e6:.2f} µs/changed vote, "
+            f"flush {results[f'{name} flush'] * 1e3:.1f} ms writing {results[f'{name} flush bytes'] / 1e6:.2f} MB"
+        )
+    print(f"ledger full flush: {results['ledger full flush'] * 1e3:.1f} ms writing {results['ledger full flush bytes'] / 1e6:.2f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Media support for sent, scheduled and automatic posts
+رسانه در پست‌های ارسالی، زمان‌بندی شده و خودکار
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+from telegram import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+from telegram.constants import ParseMode
+import config
+
+logger = logging.getLogger(__name__)
+
+# File for caching Telegram file_ids of uploaded local files
+MEDIA_CACHE_FILE = Path('data') / 'media_cache.json'
+
+# Bot method and argument name for each media type
+MEDIA_SENDERS = {
+    "photo": "send_photo",
+    "video": "send_video",
+    "document": "send_document",
+    "animation": "send_animation",
+    "audio": "send_audio",
+    "voice": "send_voice"
+}
+
+# Media types allowed inside an album and their InputMedia classes
+ALBUM_MEDIA_TYPES = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio
+}
+
+# Telegram accepts at most this many items in one media group
+MAX_ALBUM_ITEMS = 10
+
+# {content sha256: {"type": ..., "file_id": ...}}, loaded on first use
+_file_id_cache = None
+
+def extract_media(message):
+    """Capture the media of a message as a storable dict, or None for plain messages"""
+    for media_type in MEDIA_SENDERS:
+        attachment = getattr(message, media_type, None)
+        if not attachment:
+            continue
+        
+        # Photos come as a list of sizes, the last one is the largest
+        if media_type == "photo":
+            attachment = attachment[-1]
+        
+        return {
+            "type": media_type,
+            "file_id": attachment.file_id,
+            "source": {
+                "chat_id": message.chat_id,
+                "message_id": message.message_id
+            }
+        }
+    
+    return None
+
+def _load_cache():
+    """Load the file_id cache from disk once"""
+    global _file_id_cache
+    
+    if _file_id_cache is None:
+        try:
+            with open(MEDIA_CACHE_FILE, 'r') as f:
+                _file_id_cache = json.load(f)
+        except FileNotFoundError:
+            _file_id_cache = {}
+        except json.JSONDecodeError:
+            logger.warning(f"Error decoding JSON from {MEDIA_CACHE_FILE}. Starting with an empty cache.")
+            _file_id_cache = {}
+    
+    return _file_id_cache
+
+def _save_cache():
+    """Save the file_id cache to disk"""
+    try:
+        with open(MEDIA_CACHE_FILE, 'w') as f:
+            json.dump(_file_id_cache, f, indent=4)
+    except Exception as e:
+        logger.error(f"Error saving media cache: {e}")
+
+def file_digest(path):
+    """Hash a file's content in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _storage_chat_id():
+    """Chat that receives one-off uploads of local files"""
+    conf = config.init_config()
+    return conf.get("media_storage_chat") or conf["admin_ids"][0]
+
+async def upload_local_file(bot, path, media_type):
+    """Upload a local file once and return its file_id, reusing the cached id for known content"""
+    cache = _load_cache()
+    digest = file_digest(path)
+    
+    cached = cache.get(digest)
+    if cached and cached["type"] == media_type:
+        return cached["file_id"]
+    
+    sender = getattr(bot, MEDIA_SENDERS[media_type])
+    with open(path, 'rb') as f:
+        message = await sender(_storage_chat_id(), **{media_type: f})
+    
+    file_id = extract_media(message)["file_id"]
+    cache[digest] = {"type": media_type, "file_id": file_id}
+    _save_cache()
+    
+    logger.info(f"Uploaded {path} as {media_type}, cached file_id for {digest[:12]}")
+    return file_id
+
+async def ensure_file_id(bot, media):
+    """Make sure a media dict refers to an uploaded file, uploading local paths once"""
+    if media["type"] == "album":
+        return await ensure_album_file_ids(bot, media)
+    if not media.get("file_id") and media.get("path"):
+        media["file_id"] = await upload_local_file(bot, media["path"], media["type"])
+    return media
+
+async def ensure_album_file_ids(bot, media):
+    """Upload all local files of an album in a single media group and cache their file_ids"""
+    cache = _load_cache()
+    pending = []
+    
+    for item in media["items"]:
+        if item.get("file_id") or not item.get("path"):
+            continue
+        
+        digest = file_digest(item["path"])
+        cached = cache.get(digest)
+        if cached and cached["type"] == item["type"]:
+            item["file_id"] = cached["file_id"]
+        else:
+            pending.append((item, digest))
+    
+    if not pending:
+        return media
+    
+    files = [open(item["path"], 'rb') for item, _ in pending]
+    try:
+        group = [
+            ALBUM_MEDIA_TYPES[item["type"]](media=f)
+            for (item, _), f in zip(pending, files)
+        ]
+        messages = await bot.send_media_group(_storage_chat_id(), media=group)
+    finally:
+        for f in files:
+            f.close()
+    
+    for (item, digest), message in zip(pending, messages):
+        item["file_id"] = extract_media(message)["file_id"]
+        cache[digest] = {"type": item["type"], "file_id": item["file_id"]}
+    _save_cache()
+    
+    logger.info(f"Uploaded {len(pending)} album items in one media group")
+    return media
+
+async def send_album(bot, chat_id, media, caption=None, parse_mode=ParseMode.HTML):
+    """Send an album as a single media group using cached file_ids"""
+    await ensure_album_file_ids(bot, media)
+    
+    group = []
+    for i, item in enumerate(media["items"][:MAX_ALBUM_ITEMS]):
+        input_class = ALBUM_MEDIA_TYPES[item["type"]]
+        # The album caption is shown under the first item
+        if i == 0 and caption:
+            group.append(input_class(media=item["file_id"], caption=caption, parse_mode=parse_mode))
+        else:
+            group.append(input_class(media=item["file_id"]))
+    
+    return await bot.send_media_group(chat_id, media=group)
+
+async def send_media(bot, chat_id, media, caption=None, reply_markup=None, parse_mode=ParseMode.HTML):
+    """Send a media post by copying the original message or reusing its file_id"""
+    if media["type"] == "album":
+        if reply_markup:
+            # Media groups cannot carry inline keyboards
+            logger.warning(f"Ignoring inline buttons on album sent to {chat_id}")
+        return await send_album(bot, chat_id, media, caption=caption, parse_mode=parse_mode)
+    
+    source = media.get("source")
+    if media.get("mode") == "copy" and source:
+        try:
+            return await bot.copy_message(
+                chat_id=chat_id,
+                from_chat_id=source["chat_id"],
+                message_id=source["message_id"],
+                caption=caption or None,
+                parse_mode=parse_mode,
+                reply_markup=reply_markup
+            )
+        except Exception as e:
+            # The original message may have been deleted, fall back to the file_id
+            logger.warning(f"Error copying message {source['message_id']}, resending by file_id: {e}")
+    
+    await ensure_file_id(bot, media)
+    sender = getattr(bot, MEDIA_SENDERS[media["type"]])
+    return await sender(
+        chat_id,
+        **{media["type"]: media["file_id"]},
+        caption=caption or None,
+        parse_mode=parse_mode,
+        reply_markup=reply_markup
+    )
+
+async def send_payload(bot, payload):
+    """Send a rendered post payload, with or without media"""
+    media = payload.get("media")
+    if media:
+        return await send_media(
+            bot,
+            payload["chat_id"],
+            media,
+            caption=payload["text"],
+            reply_markup=payload["reply_markup"],
+            parse_mode=payload["parse_mode"]
+        )
+    
+    return await bot.send_message(
+        chat_id=payload["chat_id"],
+        text=payload["text"],
+        reply_markup=payload["reply_markup"],
+        parse_mode=payload["parse_mode"]
+    )
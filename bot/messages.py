@@ -4,6 +4,7 @@ Message formatting and display utilities
 """
 import logging
 from datetime import datetime
+from html.parser import HTMLParser
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +56,9 @@ def format_scheduled_list(scheduled_messages):
             else:
                 message_preview = msg["text"]
             
+            if msg.get("media"):
+                message_preview = f"[{msg['media']['type']}] {message_preview}"
+            
             text += f"⏰ زمان: {formatted_time}\n"
             text += f"📨 به: {target_name} (شناسه: {target_id})\n"
             text += f"💬 پیام: {message_preview}\n"
@@ -95,6 +99,9 @@ def format_autopost_list(auto_posts):
             else:
                 message_preview = post["text"]
             
+            if post.get("media"):
+                message_preview = f"[{post['media']['type']}] {message_preview}"
+            
             text += f"🔄 زمان‌بندی: {schedule_info}\n"
             text += f"📨 به: {target_name} (شناسه: {target_id})\n"
             text += f"💬 پیام: {message_preview}\n"
@@ -113,3 +120,38 @@ def format_welcome_message(welcome_text, user_name, username, chat_name):
         .replace("{username}", username)
         .replace("{chat}", chat_name)
     )
+
+# Tags accepted by Telegram's HTML parse mode
+TELEGRAM_HTML_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+    "span", "tg-spoiler", "a", "code", "pre", "blockquote", "tg-emoji"
+}
+
+class _TelegramHTMLChecker(HTMLParser):
+    """Collect problems that would make Telegram reject an HTML message"""
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.errors = []
+    
+    def handle_starttag(self, tag, attrs):
+        if tag not in TELEGRAM_HTML_TAGS:
+            self.errors.append(f"unsupported tag <{tag}>")
+        self.stack.append(tag)
+    
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack[-1] != tag:
+            self.errors.append(f"unexpected </{tag}>")
+        else:
+            self.stack.pop()
+
+def validate_html(text):
+    """Return a list of HTML problems in the text (empty if it is valid for Telegram)"""
+    checker = _TelegramHTMLChecker()
+    checker.feed(text)
+    checker.close()
+    errors = checker.errors
+    for tag in reversed(checker.stack):
+        errors.append(f"unclosed <{tag}>")
+    return errors
@@ -108,8 +108,30 @@ def create_poll_templates_keyboard():
     ]
     return keyboard
 
-def create_poll_target_keyboard(channels, groups):
-    """Create keyboard for selecting poll target"""
+def create_custom_template_keyboard():
+    """Create keyboard for using or redefining the custom poll template"""
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                "✅ استفاده از قالب",
+                callback_data=json.dumps({"action": "poll_template_use_custom"})
+            ),
+            InlineKeyboardButton(
+                "✏️ تعریف دوباره",
+                callback_data=json.dumps({"action": "poll_template_edit_custom"})
+            ),
+        ],
+        [
+            InlineKeyboardButton(
+                "🔙 بازگشت به قالب‌ها",
+                callback_data=json.dumps({"action": "poll_templates"})
+            ),
+        ],
+    ]
+    return keyboard
+
+def create_poll_target_keyboard(channels, groups, selected=()):
+    """Create keyboard for selecting one or more poll targets"""
     keyboard = []
     
     # Channels section
@@ -131,13 +153,13 @@ def create_poll_target_keyboard(channels, groups):
                 except ValueError:
                     channel_id_value = channel_id  # Keep as string if conversion fails
             
+            # The type is looked up from the config, keeping callback data under 64 bytes
             keyboard.append([
                 InlineKeyboardButton(
-                    f"📢 {channel_name}",
+                    f"{'✅' if channel_id_value in selected else '📢'} {channel_name}",
                     callback_data=json.dumps({
                         "action": "poll_target_select",
-                        "id": channel_id_value,
-                        "type": "channel"
+                        "id": channel_id_value
                     })
                 )
             ])
@@ -163,15 +185,31 @@ def create_poll_target_keyboard(channels, groups):
             
             keyboard.append([
                 InlineKeyboardButton(
-                    f"👥 {group_name}",
+                    f"{'✅' if group_id_value in selected else '👥'} {group_name}",
                     callback_data=json.dumps({
                         "action": "poll_target_select",
-                        "id": group_id_value,
-                        "type": "group"
+                        "id": group_id_value
                     })
                 )
             ])
     
+    # Send to the selected chats
+    if selected:
+        keyboard.append([
+            InlineKeyboardButton(
+                f"📤 ارسال به {len(selected)} چت",
+                callback_data=json.dumps({"action": "poll_send"})
+            )
+        ])
+    # Or one poll with its own results per chat
+    if len(selected) > 1:
+        keyboard.append([
+            InlineKeyboardButton(
+                f"🗂️ {len(selected)} نظرسنجی جداگانه",
+                callback_data=json.dumps({"action": "poll_send_each"})
+            )
+        ])
+    
     # Back Button
     keyboard.append([
         InlineKeyboardButton(
@@ -260,4 +298,107 @@ def create_poll_settings_keyboard():
             ),
         ],
     ]
-    return keyboard
\ No newline at end of file
+    return keyboard
+
+def create_poll_list_keyboard(polls, page, pages, finished=False):
+    """Create keyboard listing one page of active or finished polls"""
+    list_action = "finished_polls" if finished else "active_polls"
+    keyboard = []
+    
+    for poll in polls:
+        keyboard.append([
+            InlineKeyboardButton(
+                f"{'🔒' if finished else '🔄'} {poll['title'][:40]}",
+                callback_data=json.dumps({"action": "poll_results", "poll_id": poll["id"]})
+            )
+        ])
+    
+    # Page navigation
+    navigation = []
+    if page > 0:
+        navigation.append(
+            InlineKeyboardButton(
+                "◀️ قبلی",
+                callback_data=json.dumps({"action": list_action, "page": page - 1})
+            )
+        )
+    if page < pages - 1:
+        navigation.append(
+            InlineKeyboardButton(
+                "بعدی ▶️",
+                callback_data=json.dumps({"action": list_action, "page": page + 1})
+            )
+        )
+    if navigation:
+        keyboard.append(navigation)
+    
+    # Back Button
+    keyboard.append([
+        InlineKeyboardButton(
+            "🔙 بازگشت به مدیریت نظرسنجی",
+            callback_data=json.dumps({"action": "back_to_poll_management"})
+        )
+    ])
+    
+    return keyboard
+
+def create_poll_results_keyboard(poll_id, active=True):
+    """Create keyboard shown under a poll's results"""
+    keyboard = []
+    
+    if active:
+        keyboard.append([
+            InlineKeyboardButton(
+                "🔄 به‌روزرسانی",
+                callback_data=json.dumps({"action": "poll_results", "poll_id": poll_id})
+            ),
+            InlineKeyboardButton(
+                "🔒 بستن نظرسنجی",
+                callback_data=json.dumps({"action": "poll_close", "poll_id": poll_id})
+            )
+        ])
+    
+    keyboard.append([
+        InlineKeyboardButton(
+            "📈 تحلیل",
+            callback_data=json.dumps({"action": "poll_analytics", "poll_id": poll_id})
+        )
+    ])
+    
+    # Back Button
+    keyboard.append([
+        InlineKeyboardButton(
+            "🔙 بازگشت به فهرست",
+            callback_data=json.dumps({"action": "active_polls" if active else "finished_polls"})
+        )
+    ])
+    
+    return keyboard
+
+def create_poll_analytics_keyboard(poll_id=None):
+    """Create keyboard shown under poll analytics"""
+    if poll_id:
+        back = InlineKeyboardButton(
+            "🔙 بازگشت به نتایج",
+            callback_data=json.dumps({"action": "poll_results", "poll_id": poll_id})
+        )
+    else:
+        back = InlineKeyboardButton(
+            "🔙 بازگشت به مدیریت نظرسنجی",
+            callback_data=json.dumps({"action": "back_to_poll_management"})
+        )
+    
+    refresh_data = {"action": "poll_analytics"}
+    if poll_id:
+        refresh_data["poll_id"] = poll_id
+    
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                "🔄 به‌روزرسانی",
+                callback_data=json.dumps(refresh_data)
+            ),
+        ],
+        [back],
+    ]
+    return keyboard
@@ -0,0 +1,127 @@
+"""
+Ready-made poll templates, compiled once into a poll payload and keyboard skeleton
+قالب‌های آماده نظرسنجی که یک بار به محتوا و کیبورد آماده تبدیل می‌شوند
+
+A compiled template holds the stored poll fields, the rendered result text
+below the title and the vote buttons with their callback data split around
+the poll id. Creating a poll from it only copies the options, stamps a new
+id and deadline and joins the prepared strings.
+"""
+import logging
+import time
+from datetime import datetime
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from bot.polls import (
+    get_poll_settings, new_poll_id, poll_body, deadline_line, vote_button_rows, vote_callback_data,
+    MAX_MULTIPLE_CHOICE_OPTIONS
+)
+import config
+
+logger = logging.getLogger(__name__)
+
+# Templates behind the buttons of the templates menu. Built-in templates have
+# no title; it is asked for when the template is used
+BUILTIN_TEMPLATES = {
+    "yesno": {
+        "options": ["👍 بله", "👎 خیر"]
+    },
+    "rating": {
+        "options": ["⭐", "⭐⭐", "⭐⭐⭐", "⭐⭐⭐⭐", "⭐⭐⭐⭐⭐"]
+    },
+    "multiplechoice": {
+        "options": ["گزینه ۱", "گزینه ۲", "گزینه ۳", "گزینه ۴"],
+        "settings": {"multiple_choices": True, "anonymous": False}
+    },
+    "feedback": {
+        "options": ["😍 عالی", "🙂 خوب", "😐 متوسط", "🙁 ضعیف"]
+    }
+}
+
+# Name of the template admins define themselves, stored in the config
+CUSTOM_TEMPLATE = "custom"
+
+# Stands in for the poll id while the vote buttons are compiled
+_ID_PLACEHOLDER = "{poll_id}"
+
+class CompiledTemplate:
+    """A template rendered once, ready to be stamped into new polls"""
+    
+    def __init__(self, name, template, settings):
+        self.name = name
+        self.title = template.get("title")
+        settings = dict(settings, **template.get("settings", {}))
+        self.time_limit = settings["time_limit"]
+        
+        options = [{"text": text, "count": 0} for text in template["options"]]
+        self.payload = {
+            "title": self.title,
+            "options": options,
+            "anonymous": settings["anonymous"],
+            # Anonymous votes cannot be changed, so they are always single choice
+            "multiple_choices": settings["multiple_choices"] and not settings["anonymous"] and len(options) <= MAX_MULTIPLE_CHOICE_OPTIONS
+        }
+        if name:
+            self.payload["template"] = name
+        
+        zeros = [0] * len(options)
+        self.body = poll_body(self.payload, zeros)
+        rows = vote_button_rows(options, zeros, lambda i: vote_callback_data(_ID_PLACEHOLDER, i))
+        # (label, callback data before the id, callback data after the id) per button
+        self.skeleton = [
+            [(button.text, *button.callback_data.split(_ID_PLACEHOLDER)) for button in row]
+            for row in rows
+        ]
+    
+    def instantiate(self, title=None, now=None):
+        """A new poll from this template: (poll, text, keyboard)"""
+        poll_id = new_poll_id()
+        now = now or time.time()
+        
+        poll = dict(self.payload)
+        poll["id"] = poll_id
+        poll["title"] = title or self.title
+        poll["options"] = [dict(option) for option in self.payload["options"]]
+        poll["closes_at"] = int(now) + self.time_limit if self.time_limit else None
+        poll["created_at"] = datetime.fromtimestamp(now).isoformat()
+        
+        text = f"📊 Poll: {poll['title']}\n\n" + self.body + deadline_line(poll["closes_at"])
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton(text=label, callback_data=head + poll_id + tail) for label, head, tail in row]
+            for row in self.skeleton
+        ])
+        return poll, text, keyboard
+    
+    def instantiate_many(self, count, title=None):
+        """Several new polls from this template, stamped with one creation time"""
+        now = time.time()
+        return [self.instantiate(title, now) for _ in range(count)]
+
+# (template name, poll settings) -> CompiledTemplate
+_compiled = {}
+
+def get_custom_template():
+    """The admin-defined template, or None"""
+    return config.init_config().get("poll_templates", {}).get(CUSTOM_TEMPLATE)
+
+def save_custom_template(title, options):
+    """Store the admin-defined template and drop its compiled form"""
+    conf = config.init_config()
+    conf.setdefault("poll_templates", {})[CUSTOM_TEMPLATE] = {"title": title, "options": options}
+    config.save_config(conf)
+    
+    for key in [key for key in _compiled if key[0] == CUSTOM_TEMPLATE]:
+        del _compiled[key]
+
+def get_template(name):
+    """The compiled template of the given name, or None"""
+    settings = get_poll_settings()
+    # Compiled forms are kept per settings, so changing a default compiles anew
+    key = (name, tuple(sorted(settings.items())))
+    compiled = _compiled.get(key)
+    if compiled is None:
+        template = get_custom_template() if name == CUSTOM_TEMPLATE else BUILTIN_TEMPLATES.get(name)
+        if template is None:
+            return None
+        compiled = _compiled[key] = CompiledTemplate(name, template, settings)
+        logger.info(f"Compiled poll template {name}")
+    return compiled
@@ -0,0 +1,594 @@
+"""
+In-memory poll tallies with batched persistence and coalesced result edits
+شمارش آراء در حافظه با ذخیره‌سازی دسته‌ای و به‌روزرسانی تجمیعی نتایج
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from bot.storage import load_data, save_data
+from bot.ledger import (
+    VoteLedger, AnonymousLedger, ledger_path, origins_path, write_snapshot, append_events,
+    VOTE_EVENT, EVENT_ADDED, EVENT_CHANGED, EVENT_REMOVED
+)
+from bot.timers import timers
+import config
+
+logger = logging.getLogger(__name__)
+
+# Vote results
+VOTE_ADDED = "added"
+VOTE_CHANGED = "changed"
+VOTE_UNCHANGED = "unchanged"
+VOTE_REMOVED = "removed"
+VOTE_DUPLICATE = "duplicate"
+
+# Event log kind of each counted vote result
+EVENT_KINDS = {VOTE_ADDED: EVENT_ADDED, VOTE_CHANGED: EVENT_CHANGED, VOTE_REMOVED: EVENT_REMOVED}
+
+# Chats a single poll can be sent to; voters' chats are stored as one byte
+MAX_POLL_TARGETS = 255
+
+# Polls per page in the active/finished listings
+POLLS_PAGE_SIZE = 8
+
+# Multiple-choice selections are 64-bit masks, one bit per option
+MAX_MULTIPLE_CHOICE_OPTIONS = 64
+
+# Defaults for new polls, overridable in config.json under "poll_settings"
+DEFAULT_POLL_SETTINGS = {
+    "multiple_choices": False,
+    "time_limit": None,
+    "anonymous": False
+}
+
+# Time limits cycled through by the settings button, in seconds (None: no limit)
+POLL_TIME_LIMITS = (None, 3600, 6 * 3600, 24 * 3600, 3 * 24 * 3600, 7 * 24 * 3600)
+
+def poll_messages(poll):
+    """Messages showing a poll, one per target chat"""
+    if "messages" in poll:
+        return poll["messages"]
+    # Polls sent before multi-target support kept a single message
+    return [poll["message"]] if poll.get("message") else []
+
+def voter_key(user_id):
+    """Canonical voter key: the integer user id (JSON keys are converted on load)"""
+    return int(user_id)
+
+class PollTally:
+    """Live counts of one poll, updated in place on every vote"""
+    
+    def __init__(self, poll):
+        self.poll = {key: value for key, value in poll.items() if key != "votes"}
+        self.multiple_choices = poll.get("multiple_choices", False)
+        self.closed = poll.get("closed", False)
+        self.anonymous = poll.get("anonymous", False)
+        
+        # Chats a multi-target poll was sent to, and its per-chat counts
+        self.targets = poll.get("targets", [])
+        self.chat_counts = {int(chat_id): counts for chat_id, counts in poll.get("chat_counts", {}).items()}
+        
+        # Bumped on every counted vote; the results snapshot is rebuilt when it falls behind
+        self.version = 0
+        self._results = None
+        self._results_version = -1
+        
+        if self.closed and not poll.get("votes"):
+            # Closed polls only need their final counts, the ledger stays on disk
+            self.ledger = None
+            self.counts = [option.get("count", 0) for option in poll["options"]]
+            self.migrated = False
+        elif poll.get("votes"):
+            # Votes still stored inside the poll object: move them to a ledger and
+            # rebuild the counts, which also repairs counts inflated by repeated clicks
+            self.ledger = VoteLedger.from_dict(poll["votes"])
+            self.counts = [0] * len(poll["options"])
+            for option_id in self.ledger.options:
+                self.counts[option_id] += 1
+            self.migrated = True
+        elif self.anonymous:
+            self.ledger = AnonymousLedger.load(ledger_path(poll["id"]), poll["id"], config.ANONYMOUS_POLL_VOTERS)
+            self.counts = [option.get("count", 0) for option in poll["options"]]
+            self.migrated = False
+        else:
+            self.ledger = VoteLedger.load(ledger_path(poll["id"]), 'Q' if self.multiple_choices else 'B')
+            self.counts = [option.get("count", 0) for option in poll["options"]]
+            self.migrated = False
+        
+        # Chat index of every voter, so a changed vote leaves the chat it was counted in
+        if len(self.targets) > 1 and not self.anonymous and self.ledger is not None:
+            self.origins = VoteLedger.load(origins_path(poll["id"]))
+        else:
+            self.origins = None
+    
+    def _chat_row(self, chat_id):
+        """Per-chat counts of a target chat"""
+        return self.chat_counts.setdefault(chat_id, [0] * len(self.counts))
+    
+    def vote(self, user_key, option_id, chat_id=None):
+        """Apply a vote made in chat_id and return one of the VOTE_* results"""
+        # Only chats the poll was sent to get a breakdown
+        if len(self.targets) < 2 or chat_id not in self.targets:
+            chat_id = None
+        
+        if self.anonymous:
+            # Only whether someone voted is known, so anonymous votes are final
+            if not self.ledger.add(user_key):
+                return VOTE_DUPLICATE
+            self.counts[option_id] += 1
+            if chat_id is not None:
+                self._chat_row(chat_id)[option_id] += 1
+            return VOTE_ADDED
+        
+        if self.multiple_choices:
+            return self._toggle(user_key, option_id, chat_id)
+        
+        previous = self.ledger.get(user_key)
+        
+        if previous == option_id:
+            return VOTE_UNCHANGED
+        
+        if previous is not None:
+            self.counts[previous] -= 1
+        self.counts[option_id] += 1
+        self.ledger.set(user_key, option_id)
+        
+        if chat_id is not None:
+            # The vote moves to the chat it was last cast in
+            if previous is not None:
+                origin = self.origins.get(user_key)
+                if origin is not None:
+                    self._chat_row(self.targets[origin])[previous] -= 1
+            self._chat_row(chat_id)[option_id] += 1
+            self.origins.set(user_key, self.targets.index(chat_id))
+        return VOTE_ADDED if previous is None else VOTE_CHANGED
+    
+    def voter_count(self):
+        """Number of users with a vote in this poll (an estimate for anonymous polls)"""
+        if self.multiple_choices:
+            # Voters who deselected everything keep an empty mask
+            return sum(1 for user_id, selection in self.ledger.items() if selection)
+        return len(self.ledger)
+    
+    def _toggle(self, user_key, option_id, chat_id=None):
+        """Flip one option in a multiple-choice selection"""
+        bit = 1 << option_id
+        selection = self.ledger.get(user_key, 0) ^ bit
+        self.ledger.set(user_key, selection)
+        change = 1 if selection & bit else -1
+        self.counts[option_id] += change
+        
+        if chat_id is not None:
+            # All selections of a voter count for the chat of their first vote
+            origin = self.origins.get(user_key)
+            if origin is None:
+                origin = self.targets.index(chat_id)
+                self.origins.set(user_key, origin)
+            self._chat_row(self.targets[origin])[option_id] += change
+        return VOTE_ADDED if change > 0 else VOTE_REMOVED
+    
+    def results(self):
+        """Counts, percentages and rendered text, rebuilt only after votes changed them"""
+        if self._results is not None and self._results_version == self.version:
+            return self._results
+        
+        total = sum(self.counts)
+        percentages = [round(100 * count / total, 1) if total else 0.0 for count in self.counts]
+        
+        text = f"📊 {self.poll['title']}\n\n"
+        for option, count, percentage in zip(self.poll["options"], self.counts, percentages):
+            filled = round(percentage / 10)
+            text += f"{option['text']}\n{'▓' * filled}{'░' * (10 - filled)} {count} ({percentage}%)\n"
+        
+        if self.closed:
+            text += f"\n🔒 بسته شده - {self.poll.get('voter_count', 0)} شرکت‌کننده"
+        else:
+            text += f"\n🔄 فعال - {'≈' if self.anonymous else ''}{len(self.ledger)} شرکت‌کننده"
+            if self.poll.get("closes_at"):
+                text += f"\n⏱️ پایان: {datetime.fromtimestamp(self.poll['closes_at']).strftime('%Y-%m-%d %H:%M')}"
+        
+        if self.chat_counts:
+            names = self.poll.get("target_names", {})
+            text += "\n\n📍 به تفکیک چت:"
+            for chat_id in self.targets:
+                counts = self.chat_counts.get(chat_id, [0] * len(self.counts))
+                text += f"\n{names.get(str(chat_id), chat_id)}: " + " | ".join(str(count) for count in counts)
+        
+        self._results = {"counts": list(self.counts), "chat_counts": {chat_id: list(counts) for chat_id, counts in self.chat_counts.items()}, "total": total, "percentages": percentages, "text": text}
+        self._results_version = self.version
+        return self._results
+    
+    def to_dict(self):
+        """A copy of the poll as stored, with current counts; votes live in the ledger file"""
+        poll = dict(self.poll)
+        poll["options"] = [dict(option, count=count) for option, count in zip(self.poll["options"], self.counts)]
+        if self.chat_counts:
+            poll["chat_counts"] = {str(chat_id): list(counts) for chat_id, counts in self.chat_counts.items()}
+        return poll
+
+# poll id -> PollTally, loaded from storage on first use
+_tallies = None
+
+# Poll ids by state, oldest first, as lists so a page is a slice
+_active = []
+_finished = []
+
+# Polls changed since the last flush
+_dirty = set()
+
+# Packed vote events per poll, appended to the event logs on the next flush
+_events = {}
+
+# Held by the flush that is writing poll data
+_flush_lock = asyncio.Lock()
+
+# poll id -> pending edit handle, and the time of the last edit
+_pending_edits = {}
+_last_edit = {}
+
+def _load():
+    """Load all polls into memory once"""
+    global _tallies
+    
+    if _tallies is None:
+        _tallies = {poll["id"]: PollTally(poll) for poll in load_data().get("polls", [])}
+        for poll_id, tally in _tallies.items():
+            if tally.closed:
+                _finished.append(poll_id)
+            else:
+                _active.append(poll_id)
+        # Polls with votes in the data file are rewritten with a ledger on the next flush
+        _dirty.update(poll_id for poll_id, tally in _tallies.items() if tally.migrated)
+    return _tallies
+
+def get_tally(poll_id):
+    """The live tally of a poll, or None"""
+    return _load().get(poll_id)
+
+def new_poll_id():
+    """Short random poll id, keeping vote callback data within Telegram's 64-byte limit"""
+    while True:
+        poll_id = uuid.uuid4().hex[:8]
+        if poll_id not in _load():
+            return poll_id
+
+def list_polls(finished=False, page=0, page_size=POLLS_PAGE_SIZE):
+    """One page of active or finished polls, newest first; returns (tallies, page, page count)"""
+    _load()
+    poll_ids = _finished if finished else _active
+    pages = max(1, -(-len(poll_ids) // page_size))
+    page = min(max(page, 0), pages - 1)
+    start = page * page_size
+    
+    end = len(poll_ids) - start
+    chunk = reversed(poll_ids[max(0, end - page_size):end])
+    return [_tallies[poll_id] for poll_id in chunk], page, pages
+
+async def register_poll(poll):
+    """Add a new poll to memory and storage"""
+    return await register_polls([poll])
+
+async def register_polls(polls):
+    """Add new polls to memory and write them to storage in a single save"""
+    tallies = _load()
+    for poll in polls:
+        tallies[poll["id"]] = PollTally(poll)
+        _active.append(poll["id"])
+        _dirty.add(poll["id"])
+        
+        if poll.get("closes_at"):
+            timers.schedule(poll["closes_at"], "close_poll", {"poll_id": poll["id"]})
+    # New polls are appended to the data file by the flush
+    return await flush() > 0
+
+def get_poll_settings():
+    """Settings applied to new polls"""
+    return dict(DEFAULT_POLL_SETTINGS, **config.init_config().get("poll_settings", {}))
+
+def toggle_poll_setting(name):
+    """Flip an on/off poll setting and return its new value"""
+    conf = config.init_config()
+    settings = dict(DEFAULT_POLL_SETTINGS, **conf.get("poll_settings", {}))
+    settings[name] = not settings[name]
+    conf["poll_settings"] = settings
+    config.save_config(conf)
+    return settings[name]
+
+def cycle_poll_time_limit():
+    """Switch the default time limit to the next choice and return it"""
+    conf = config.init_config()
+    settings = dict(DEFAULT_POLL_SETTINGS, **conf.get("poll_settings", {}))
+    current = settings["time_limit"]
+    position = POLL_TIME_LIMITS.index(current) if current in POLL_TIME_LIMITS else 0
+    settings["time_limit"] = POLL_TIME_LIMITS[(position + 1) % len(POLL_TIME_LIMITS)]
+    conf["poll_settings"] = settings
+    config.save_config(conf)
+    return settings["time_limit"]
+
+def format_time_limit(seconds):
+    """Human readable time limit"""
+    if not seconds:
+        return "بدون محدودیت"
+    if seconds % 86400 == 0:
+        return f"{seconds // 86400} روز"
+    return f"{seconds // 3600} ساعت"
+
+def set_poll_message(poll_id, chat_id, message_id):
+    """Remember a message showing a poll, for live result edits"""
+    tally = get_tally(poll_id)
+    if tally is None:
+        return
+    
+    messages = poll_messages(tally.poll)
+    if not any(message["chat_id"] == chat_id for message in messages):
+        tally.poll["messages"] = messages + [{"chat_id": chat_id, "message_id": message_id}]
+        tally.poll.pop("message", None)
+        _dirty.add(poll_id)
+
+def record_vote(poll_id, user_id, option_id, chat_id=None):
+    """Count a click made in chat_id exactly once; returns the vote result or None if the poll or option is unknown.
+    
+    Votes are applied on the event loop without an await between reading the
+    previous vote and storing the new one, so concurrent clicks cannot
+    interleave and need no lock.
+    """
+    tally = get_tally(poll_id)
+    if tally is None or tally.closed or not 0 <= option_id < len(tally.counts):
+        return None
+    
+    user_key = voter_key(user_id)
+    previous = None if tally.anonymous or tally.multiple_choices else tally.ledger.get(user_key)
+    result = tally.vote(user_key, option_id, chat_id)
+    
+    if result not in (VOTE_UNCHANGED, VOTE_DUPLICATE):
+        tally.version += 1
+        _dirty.add(poll_id)
+        _events.setdefault(poll_id, []).append(VOTE_EVENT.pack(
+            int(time.time()),
+            0 if tally.anonymous else user_key,
+            option_id,
+            -1 if previous is None else previous,
+            EVENT_KINDS[result]
+        ))
+    return result
+
+def _snapshot():
+    """Copies of all changed polls and their ledgers, taken without an await so no vote lands halfway"""
+    changed = {}
+    for poll_id in _dirty:
+        tally = _tallies[poll_id]
+        changed[poll_id] = (
+            tally.to_dict(),
+            tally.ledger.snapshot() if tally.ledger is not None else None,
+            tally.origins.snapshot() if tally.origins is not None else None,
+            b"".join(_events.pop(poll_id, ()))
+        )
+    _dirty.clear()
+    return changed
+
+def _release_closed(poll_ids):
+    """Drop the ledgers of closed polls once their final state is written"""
+    for poll_id in poll_ids:
+        tally = _tallies[poll_id]
+        # A poll changed again since the snapshot (e.g. closed meanwhile) waits for the next flush
+        if tally.closed and poll_id not in _dirty:
+            tally.ledger = None
+            tally.origins = None
+
+def _write_files(changed):
+    """Write the ledgers and event logs of changed polls; returns the ids that failed.
+    
+    Runs on a worker thread: these files belong to the flusher alone.
+    """
+    failed = []
+    for poll_id, (poll, ledger, origins, events) in changed.items():
+        try:
+            if ledger is not None:
+                write_snapshot(poll_id, ledger)
+            if origins is not None:
+                write_snapshot(poll_id, origins, origins_path(poll_id))
+            if events:
+                append_events(poll_id, events)
+        except Exception as e:
+            logger.error(f"Error writing the votes of poll {poll_id}: {e}")
+            failed.append(poll_id)
+    return failed
+
+def _save_polls(changed):
+    """Merge changed polls into the data file in one save; returns whether it was saved.
+    
+    Runs on the event loop, like every other writer of the data file, so no
+    other load/modify/save can interleave with it.
+    """
+    polls = {poll_id: entry[0] for poll_id, entry in changed.items()}
+    data = load_data()
+    data["polls"] = [polls.pop(poll["id"], poll) for poll in data.get("polls", [])]
+    # New polls are appended
+    data["polls"].extend(polls.values())
+    return save_data(data)
+
+async def flush():
+    """Write all changed polls now; returns how many were saved.
+    
+    The flush loop and explicit flushes share one lock, so ledger files are
+    never written by two flushes at once.
+    """
+    async with _flush_lock:
+        if not _dirty:
+            return 0
+        
+        changed = _snapshot()
+        failed = await asyncio.to_thread(_write_files, changed)
+        for poll_id in failed:
+            # Retried next round in full, with their events queued again in order
+            _dirty.add(poll_id)
+            tally = _tallies[poll_id]
+            for ledger in (tally.ledger, tally.origins):
+                if isinstance(ledger, VoteLedger):
+                    ledger.mark_unwritten()
+            if changed[poll_id][3]:
+                _events.setdefault(poll_id, []).insert(0, changed[poll_id][3])
+        
+        if not _save_polls(changed):
+            logger.error(f"Error saving {len(changed)} polls, retrying in the next flush")
+            # The ledgers and events are written; only the poll objects are saved again
+            _dirty.update(changed)
+            return 0
+        
+        _release_closed(changed)
+        return len(changed) - len(failed)
+
+async def flush_loop():
+    """Persist votes in batches every POLL_FLUSH_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(config.POLL_FLUSH_INTERVAL)
+        try:
+            await flush()
+        except Exception as e:
+            logger.error(f"Error saving poll votes: {e}")
+
+def poll_body(poll, counts):
+    """Result lines of a poll below its title, without the deadline"""
+    poll_text = ""
+    if poll.get("anonymous"):
+        poll_text += "🕶️ ناشناس - هر نفر یک رای، بدون امکان تغییر\n\n"
+    if poll.get("multiple_choices"):
+        poll_text += "☑️ چند انتخابی - با کلیک دوباره انتخاب لغو می‌شود\n\n"
+    for option, count in zip(poll["options"], counts):
+        poll_text += f"{option['text']}: {count} votes\n"
+    return poll_text
+
+def deadline_line(closes_at):
+    """Closing time line of a poll with a deadline"""
+    if not closes_at:
+        return ""
+    return f"\n⏱️ پایان: {datetime.fromtimestamp(closes_at).strftime('%Y-%m-%d %H:%M')}\n"
+
+def vote_button_rows(options, counts, callback_data):
+    """Vote button rows, 2 buttons per row; callback_data(i) gives each option's data"""
+    keyboard = []
+    row = []
+    for i, (option, count) in enumerate(zip(options, counts)):
+        row.append(InlineKeyboardButton(
+            text=f"{option['text']} ({count})",
+            callback_data=callback_data(i)
+        ))
+        
+        # 2 buttons per row
+        if len(row) == 2:
+            keyboard.append(row)
+            row = []
+    
+    # Add any remaining buttons
+    if row:
+        keyboard.append(row)
+    
+    return keyboard
+
+def vote_callback_data(poll_id, option_id):
+    """Callback data of a vote button"""
+    return json.dumps({
+        "action": "poll_vote",
+        "poll_id": poll_id,
+        "option_id": option_id
+    })
+
+def render_poll(poll, counts):
+    """Text and keyboard showing a poll's current results"""
+    poll_text = f"📊 Poll: {poll['title']}\n\n" + poll_body(poll, counts) + deadline_line(poll.get("closes_at"))
+    keyboard = vote_button_rows(poll["options"], counts, lambda i: vote_callback_data(poll["id"], i))
+    return poll_text, InlineKeyboardMarkup(keyboard)
+
+def request_result_edit(bot, poll_id):
+    """Schedule a live-result edit, at most one per poll every POLL_EDIT_INTERVAL seconds"""
+    if poll_id in _pending_edits:
+        # An edit is already queued and will show the latest counts
+        return
+    
+    delay = max(0, _last_edit.get(poll_id, 0) + config.POLL_EDIT_INTERVAL - time.monotonic())
+    loop = asyncio.get_running_loop()
+    _pending_edits[poll_id] = loop.call_later(
+        delay, lambda: asyncio.ensure_future(_edit_results(bot, poll_id))
+    )
+
+async def _edit_results(bot, poll_id):
+    """Edit every message of the poll to the counts as they are now"""
+    _pending_edits.pop(poll_id, None)
+    _last_edit[poll_id] = time.monotonic()
+    
+    tally = get_tally(poll_id)
+    if tally is None or tally.closed:
+        return
+    
+    # One rendering shared by all target chats
+    text, keyboard = render_poll(tally.poll, tally.counts)
+    for message in poll_messages(tally.poll):
+        try:
+            await bot.edit_message_text(
+                text,
+                chat_id=message["chat_id"],
+                message_id=message["message_id"],
+                reply_markup=keyboard
+            )
+        except Exception as e:
+            logger.warning(f"Error updating results of poll {poll_id} in {message['chat_id']}: {e}")
+
+def _finalize(poll_ids):
+    """Freeze polls and cache their final results; returns the closed tallies"""
+    closed = []
+    for poll_id in poll_ids:
+        tally = get_tally(poll_id)
+        if tally is None or tally.closed:
+            continue
+        
+        tally.closed = True
+        tally.version += 1
+        tally.poll["closed"] = True
+        tally.poll["closed_at"] = int(time.time())
+        tally.poll["voter_count"] = tally.voter_count()
+        
+        text, keyboard = render_poll(dict(tally.poll, closes_at=None), tally.counts)
+        tally.poll["final_text"] = text + f"\n🔒 نظرسنجی بسته شد - {tally.poll['voter_count']} شرکت‌کننده"
+        
+        handle = _pending_edits.pop(poll_id, None)
+        if handle:
+            handle.cancel()
+        # The flusher writes the final ledger and then releases it
+        _dirty.add(poll_id)
+        _finished.append(poll_id)
+        closed.append(tally)
+    
+    if closed:
+        # One pass over the active list for the whole batch
+        closed_ids = {tally.poll["id"] for tally in closed}
+        _active[:] = [poll_id for poll_id in _active if poll_id not in closed_ids]
+    return closed
+
+async def close_polls(bot, poll_ids):
+    """Close polls and replace their messages with the cached final results"""
+    closed = _finalize(poll_ids)
+    
+    for tally in closed:
+        for message in poll_messages(tally.poll):
+            try:
+                await bot.edit_message_text(
+                    tally.poll["final_text"],
+                    chat_id=message["chat_id"],
+                    message_id=message["message_id"]
+                )
+            except Exception as e:
+                logger.warning(f"Error showing final results of poll {tally.poll['id']} in {message['chat_id']}: {e}")
+    
+    if closed:
+        logger.info(f"Closed {len(closed)} polls")
+    return closed
+
+async def _close_expired_polls(bot, payloads):
+    """Timer handler closing every poll whose deadline passed, in one batch"""
+    await close_polls(bot, [payload["poll_id"] for payload in payloads])
+
+timers.register("close_poll", _close_expired_polls, batch=True)
@@ -0,0 +1,210 @@
+"""
+Content rotation queues for automatic posts
+صف محتوا برای پست‌های خودکار
+"""
+import json
+import logging
+import math
+import os
+import random
+from array import array
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Directory holding one queue per automatic post
+QUEUES_DIR = Path('data') / 'queues'
+
+# Ways of picking the next item
+QUEUE_MODES = ("round_robin", "shuffle", "consume")
+
+# Separator between posts when appending several in one text message
+ITEM_SEPARATOR = "\n---\n"
+
+# Consumed items are dropped from disk once this many have piled up
+COMPACT_MIN_CONSUMED = 1000
+
+class ContentQueue:
+    """Posts of one automatic post slot, stored on disk and read one at a time.
+    
+    Items are JSON lines in <id>.jsonl; <id>.idx holds the byte offset of each
+    line as 8-byte integers, so item i is read with two seeks and the queue is
+    never loaded into memory. The cursor and mode live in <id>.state.
+    """
+    
+    def __init__(self, post_id):
+        self.post_id = post_id
+        self.items_path = QUEUES_DIR / f"{post_id}.jsonl"
+        self.index_path = QUEUES_DIR / f"{post_id}.idx"
+        self.state_path = QUEUES_DIR / f"{post_id}.state"
+        self._state = None
+    
+    def exists(self):
+        """Whether any item was ever added to this queue"""
+        return self.index_path.exists()
+    
+    def __len__(self):
+        if not self.index_path.exists():
+            return 0
+        return os.path.getsize(self.index_path) // 8
+    
+    @property
+    def state(self):
+        """Cursor and mode, loaded lazily"""
+        if self._state is None:
+            try:
+                with open(self.state_path, 'r') as f:
+                    self._state = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._state = {"mode": "round_robin", "cursor": 0}
+        return self._state
+    
+    def _save_state(self):
+        """Save cursor and mode"""
+        with open(self.state_path, 'w') as f:
+            json.dump(self.state, f)
+    
+    def set_mode(self, mode):
+        """Switch the picking mode and restart from the first item"""
+        if mode not in QUEUE_MODES:
+            raise ValueError(f"Unknown queue mode: {mode}")
+        self._state = {"mode": mode, "cursor": 0}
+        self._save_state()
+    
+    def extend(self, items):
+        """Append items (text strings or post dicts) and return how many were added"""
+        QUEUES_DIR.mkdir(parents=True, exist_ok=True)
+        offsets = array('Q')
+        
+        with open(self.items_path, 'ab') as f:
+            for item in items:
+                offsets.append(f.tell())
+                f.write(json.dumps(item, ensure_ascii=False).encode('utf-8') + b"\n")
+        
+        with open(self.index_path, 'ab') as f:
+            offsets.tofile(f)
+        
+        logger.info(f"Appended {len(offsets)} items to queue {self.post_id}")
+        return len(offsets)
+    
+    def get(self, i):
+        """Read item i from disk"""
+        with open(self.items_path, 'rb') as f:
+            f.seek(self._offset(i))
+            return json.loads(f.readline())
+    
+    def _shuffled_position(self, position, size):
+        """Map a position in the current cycle to an item through a random affine permutation"""
+        state = self.state
+        if position == 0 or state.get("size") != size:
+            # New cycle: pick a step coprime with the size, which visits every item once
+            step = random.randrange(1, size) if size > 1 else 1
+            while math.gcd(step, size) != 1:
+                step = random.randrange(1, size)
+            state.update(size=size, step=step, offset=random.randrange(size))
+        return (state["offset"] + position * state["step"]) % size
+    
+    def next_item(self):
+        """Pick the next item and advance the cursor, or None when there is nothing to send"""
+        size = len(self)
+        if size == 0:
+            return None
+        
+        state = self.state
+        cursor = state["cursor"]
+        
+        if state["mode"] == "consume":
+            if cursor >= size:
+                return None
+            index = cursor
+        elif state["mode"] == "shuffle":
+            index = self._shuffled_position(cursor % size, size)
+        else:
+            index = cursor % size
+        
+        item = self.get(index)
+        state["cursor"] = cursor + 1
+        if state["mode"] != "consume":
+            # Keep the cursor bounded for cycling modes
+            state["cursor"] %= size
+        
+        self._save_state()
+        
+        if state["mode"] == "consume" and state["cursor"] >= COMPACT_MIN_CONSUMED and state["cursor"] * 2 >= size:
+            self.compact()
+        return item
+    
+    def compact(self):
+        """Drop consumed items from disk"""
+        consumed = self.state["cursor"]
+        size = len(self)
+        if consumed == 0:
+            return
+        
+        tmp_items = self.items_path.with_suffix('.tmp')
+        offsets = array('Q')
+        with open(self.items_path, 'rb') as src, open(tmp_items, 'wb') as dst:
+            if consumed < size:
+                src.seek(self._offset(consumed))
+                for line in src:
+                    offsets.append(dst.tell())
+                    dst.write(line)
+        
+        tmp_items.replace(self.items_path)
+        with open(self.index_path, 'wb') as f:
+            offsets.tofile(f)
+        
+        self.state["cursor"] = 0
+        self._save_state()
+        logger.info(f"Compacted queue {self.post_id}, dropped {consumed} consumed items")
+    
+    def _offset(self, i):
+        """Byte offset of item i"""
+        with open(self.index_path, 'rb') as f:
+            f.seek(i * 8)
+            return array('Q', f.read(8))[0]
+    
+    def delete(self):
+        """Remove the queue files"""
+        for path in (self.items_path, self.index_path, self.state_path):
+            if path.exists():
+                path.unlink()
+
+def split_items(text):
+    """Split a bulk text message into separate posts"""
+    return [item.strip() for item in text.split(ITEM_SEPARATOR) if item.strip()]
+
+def iter_file_items(path):
+    """Stream posts from an uploaded file: JSON lines for .jsonl, separated text otherwise"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if str(path).endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        
+        block = []
+        for line in f:
+            if line.strip() == "---":
+                if ''.join(block).strip():
+                    yield ''.join(block).strip()
+                block = []
+            else:
+                block.append(line)
+        if ''.join(block).strip():
+            yield ''.join(block).strip()
+
+def resolve_queued_post(post_data):
+    """Return the post to send for an automatic post, taking the next item from its queue"""
+    queue = ContentQueue(post_data["id"])
+    if not queue.exists():
+        return post_data
+    
+    item = queue.next_item()
+    if item is None:
+        # Queue empty or fully consumed, fall back to the post's own content
+        return post_data if post_data.get("text") or post_data.get("media") else None
+    
+    if isinstance(item, str):
+        item = {"text": item}
+    return dict(post_data, **item)
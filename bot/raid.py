@@ -0,0 +1,217 @@
+"""
+Raid detection on joins: automatic lockdown and bulk review of recent joiners
+تشخیص هجوم اعضا: قرنطینه خودکار گروه و بررسی گروهی اعضای تازه‌وارد
+
+The join rate of a group is an exponentially weighted moving average kept as
+two numbers (rate and time of the last update): every join adds 1 and the
+sum decays by e^(-dt/RAID_WINDOW), so with a 60 second window it reads as
+joins per minute. When it reaches the raid threshold the group's default
+permissions are replaced by read-only ones, welcomes and captchas are
+skipped, and every bot admin gets one alert. The lockdown is lifted by an
+admin or by a persisted timer after RAID_LOCKDOWN_SECONDS.
+
+Members who join during a lockdown are muted one by one until
+RAID_HOLD_SECONDS after it ends, so they do not get the group's rights when
+it lifts. Admins review the recent joiners as a list before removing them
+or letting them in; Telegram lifts holds nobody reviewed on its own.
+"""
+import logging
+import math
+import time
+from collections import deque
+from telegram import ChatPermissions, InlineKeyboardMarkup
+from bot.timers import timers
+from bot.welcome import get_welcome_settings
+from bot.welcome_keyboards import create_raid_alert_keyboard
+import config
+
+logger = logging.getLogger(__name__)
+
+# Time constant of the join rate average, in seconds
+RAID_WINDOW = 60
+
+# Seconds a group stays locked down unless an admin lifts it earlier
+RAID_LOCKDOWN_SECONDS = 1800
+
+# Recent joiners remembered per group for review
+RAID_REVIEW_SIZE = 200
+
+# Seconds members who joined during a lockdown stay muted after it ends,
+# unless an admin lets them in or removes them earlier
+RAID_HOLD_SECONDS = 86400
+
+# Permissions of every member during a lockdown
+LOCKED = ChatPermissions(can_send_messages=False)
+
+# chat id -> [join rate, monotonic time of the last update]
+_rates = {}
+
+# chat id -> recent joiner ids, oldest first
+_recent = {}
+
+# chat id -> joiner ids shown to an admin, which removal or approval acts on
+_reviews = {}
+
+# chat id -> (unlock timer id, permissions to restore), rebuilt from the
+# pending unlock timers on first use
+_lockdowns = None
+
+def _load():
+    """Pick up lockdowns that were running before a restart"""
+    global _lockdowns
+    
+    if _lockdowns is None:
+        _lockdowns = {
+            payload["chat_id"]: (timer_id, payload["permissions"])
+            for timer_id, payload in timers.pending("raid_unlock")
+        }
+    return _lockdowns
+
+def join_rate(chat_id, now=None):
+    """Current join rate of a group, per RAID_WINDOW seconds"""
+    state = _rates.get(chat_id)
+    if state is None:
+        return 0.0
+    now = time.monotonic() if now is None else now
+    return state[0] * math.exp(-(now - state[1]) / RAID_WINDOW)
+
+def is_locked(chat_id):
+    """Whether a group is locked down"""
+    return chat_id in _load()
+
+async def record_joins(bot, chat, user_ids):
+    """Count joins and lock the group down if they add up to a raid; returns True while locked"""
+    now = time.monotonic()
+    state = _rates.get(chat.id)
+    if state is None:
+        state = _rates[chat.id] = [0.0, now]
+    state[0] = state[0] * math.exp(-(now - state[1]) / RAID_WINDOW) + len(user_ids)
+    state[1] = now
+    
+    recent = _recent.get(chat.id)
+    if recent is None:
+        recent = _recent[chat.id] = deque(maxlen=RAID_REVIEW_SIZE)
+    recent.extend(user_ids)
+    
+    if chat.id in _load():
+        await hold(bot, chat.id, user_ids)
+        return True
+    
+    threshold = get_welcome_settings()["raid_threshold"]
+    if threshold and state[0] >= threshold and await lock(bot, chat, state[0]):
+        # The members whose joins set it off are held like later ones
+        await hold(bot, chat.id, user_ids)
+        return True
+    return False
+
+async def hold(bot, chat_id, user_ids):
+    """Mute members who joined during a lockdown until well after it ends"""
+    until = int(time.time()) + RAID_LOCKDOWN_SECONDS + RAID_HOLD_SECONDS
+    for user_id in user_ids:
+        try:
+            await bot.restrict_chat_member(chat_id, user_id, LOCKED, until_date=until)
+        except Exception as e:
+            logger.error(f"Error holding {user_id} in {chat_id}: {e}")
+
+async def lock(bot, chat, rate):
+    """Make the group read-only and alert the admins once; returns False if it could not be locked"""
+    try:
+        permissions = (await bot.get_chat(chat.id)).permissions or ChatPermissions.all_permissions()
+        await bot.set_chat_permissions(chat.id, LOCKED)
+    except Exception as e:
+        logger.error(f"Error locking down {chat.id}: {e}")
+        return False
+    
+    # The saved permissions travel with the unlock timer, so a restart still restores them
+    saved = permissions.to_dict()
+    timer_id = timers.schedule(time.time() + RAID_LOCKDOWN_SECONDS, "raid_unlock", {"chat_id": chat.id, "permissions": saved})
+    _load()[chat.id] = (timer_id, saved)
+    logger.warning(f"Raid detected in {chat.id} at {rate:.0f} joins per minute, group locked down")
+    
+    keyboard = create_raid_alert_keyboard(chat.id)
+    text = (
+        f"🚨 هجوم اعضا در گروه {chat.title or chat.id}\n\n"
+        f"نرخ ورود: حدود {rate:.0f} عضو در دقیقه\n"
+        f"گروه تا {RAID_LOCKDOWN_SECONDS // 60} دقیقه فقط‌خواندنی شد و پیام خوش‌آمد ارسال نمی‌شود.\n"
+        f"اعضایی که در این مدت وارد شوند تا {RAID_HOLD_SECONDS // 3600} ساعت پس از قرنطینه بی‌صدا می‌مانند.\n"
+        f"{len(_recent.get(chat.id, ()))} عضو تازه‌وارد برای بررسی ثبت شده‌اند."
+    )
+    for admin_id in config.init_config()["admin_ids"]:
+        try:
+            await bot.send_message(chat_id=admin_id, text=text, reply_markup=InlineKeyboardMarkup(keyboard))
+        except Exception as e:
+            logger.error(f"Error sending raid alert to {admin_id}: {e}")
+    return True
+
+async def unlock(bot, chat_id):
+    """Lift a lockdown now; returns False if the group was not locked"""
+    lockdown = _load().pop(chat_id, None)
+    if lockdown is None:
+        return False
+    timers.cancel(lockdown[0])
+    await _restore(bot, chat_id, lockdown[1])
+    return True
+
+async def _restore(bot, chat_id, permissions):
+    """Put the group's own permissions back"""
+    try:
+        await bot.set_chat_permissions(chat_id, ChatPermissions(**permissions))
+        logger.info(f"Lockdown of {chat_id} lifted")
+    except Exception as e:
+        logger.error(f"Error lifting lockdown of {chat_id}: {e}")
+
+async def _unlock_expired(bot, payloads):
+    """Lift lockdowns whose time is up"""
+    for payload in payloads:
+        _load().pop(payload["chat_id"], None)
+        await _restore(bot, payload["chat_id"], payload["permissions"])
+
+def review(chat_id):
+    """Ids of the recent joiners, kept as the list the next removal or approval acts on"""
+    reviewed = _reviews[chat_id] = list(_recent.get(chat_id, ()))
+    return reviewed
+
+def _take_review(chat_id):
+    """The reviewed ids, dropped from the recent joiners"""
+    reviewed = _reviews.pop(chat_id, [])
+    recent = _recent.get(chat_id)
+    if recent is not None and reviewed:
+        done = set(reviewed)
+        _recent[chat_id] = deque((user_id for user_id in recent if user_id not in done), maxlen=RAID_REVIEW_SIZE)
+    return reviewed
+
+async def kick_reviewed(bot, chat_id):
+    """Remove the joiners of the last review; returns how many were removed"""
+    removed = 0
+    for user_id in _take_review(chat_id):
+        try:
+            await bot.ban_chat_member(chat_id, user_id)
+            await bot.unban_chat_member(chat_id, user_id, only_if_banned=True)
+            removed += 1
+        except Exception as e:
+            logger.error(f"Error removing {user_id} from {chat_id}: {e}")
+    logger.info(f"Removed {removed} reviewed joiners from {chat_id}")
+    return removed
+
+async def approve_reviewed(bot, chat_id):
+    """Lift the holds of the joiners of the last review; returns how many were let in"""
+    lockdown = _load().get(chat_id)
+    try:
+        # Members get the group's own permissions, which a lockdown has replaced
+        permissions = ChatPermissions(**lockdown[1]) if lockdown else (await bot.get_chat(chat_id)).permissions
+    except Exception as e:
+        logger.error(f"Error reading the permissions of {chat_id}: {e}")
+        return 0
+    permissions = permissions or ChatPermissions.all_permissions()
+    
+    approved = 0
+    for user_id in _take_review(chat_id):
+        try:
+            await bot.restrict_chat_member(chat_id, user_id, permissions)
+            approved += 1
+        except Exception as e:
+            logger.error(f"Error letting {user_id} into {chat_id}: {e}")
+    logger.info(f"Let {approved} reviewed joiners into {chat_id}")
+    return approved
+
+timers.register("raid_unlock", _unlock_expired, batch=True)
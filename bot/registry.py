@@ -0,0 +1,190 @@
+"""
+Registry of sent posts and delayed actions on them (delete, edit, pin)
+ثبت پیام‌های ارسال شده و عملیات تأخیری روی آن‌ها
+
+Sent posts are appended to a binary file of fixed 32-byte records in the
+order they were sent. Records older than SENT_RETENTION are dropped by
+cutting the start of the file, every SENT_COMPACT_EVERY appends.
+"""
+import logging
+import struct
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from telegram.constants import ParseMode
+from bot.timers import timers
+
+logger = logging.getLogger(__name__)
+
+# Sent posts: chat_id (int64), message_id (int32), sent_at (uint32 unix time)
+# and the source schedule/autopost id as 16 UUID bytes, zero for none
+SENT_FILE = Path('data') / 'sent_messages.bin'
+SENT_RECORD = struct.Struct('<qiI16s')
+
+# Seconds a sent post stays in the registry
+SENT_RETENTION = 30 * 86400
+
+# Appends between two compactions of the registry
+SENT_COMPACT_EVERY = 10000
+
+# Telegram deletes at most this many messages per delete_messages call
+DELETE_BATCH_SIZE = 100
+
+# Supported post actions and the timer kind that runs each
+POST_ACTIONS = {
+    "delete": "delete_message",
+    "edit": "edit_message",
+    "pin": "pin_message",
+    "unpin": "unpin_message"
+}
+
+# Appends since the registry was last compacted; None until the first append
+_appends = None
+
+def _pack(chat_id, message_id, source_id, sent_at):
+    """One registry record"""
+    try:
+        source = uuid.UUID(source_id).bytes if source_id else bytes(16)
+    except ValueError:
+        logger.warning(f"Source id {source_id} is not a UUID, recording the post without it")
+        source = bytes(16)
+    return SENT_RECORD.pack(chat_id, message_id, sent_at, source)
+
+def compact_sent(now=None):
+    """Drop records older than SENT_RETENTION; returns how many were dropped"""
+    if not SENT_FILE.exists():
+        return 0
+
+    size = SENT_RECORD.size
+    content = SENT_FILE.read_bytes()
+    count = len(content) // size
+    cutoff = (now or time.time()) - SENT_RETENTION
+    # Records are in sending order, so the expired ones are a prefix found by binary search
+    start, end = 0, count
+    while start < end:
+        middle = (start + end) // 2
+        if SENT_RECORD.unpack_from(content, middle * size)[2] < cutoff:
+            start = middle + 1
+        else:
+            end = middle
+    if start == 0:
+        return 0
+
+    tmp_path = SENT_FILE.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(content[start * size:count * size])
+    tmp_path.replace(SENT_FILE)
+    logger.info(f"Dropped {start} sent posts older than {SENT_RETENTION // 86400} days")
+    return start
+
+def record_sent(chat_id, message_id, source_id=None):
+    """Remember a post sent to chat_id, the target it was sent to"""
+    global _appends
+
+    sent_at = int(time.time())
+    try:
+        chat_id = int(chat_id)
+    except ValueError:
+        # Targets saved by @username have no numeric id to record
+        logger.warning(f"Not recording message {message_id} sent to {chat_id}: the registry keeps numeric chat ids")
+        return sent_at
+    try:
+        if _appends is None or _appends >= SENT_COMPACT_EVERY:
+            compact_sent(sent_at)
+            _appends = 0
+        with open(SENT_FILE, 'ab') as f:
+            f.write(_pack(chat_id, message_id, source_id, sent_at))
+        _appends += 1
+    except Exception as e:
+        logger.error(f"Error recording sent message: {e}")
+    return sent_at
+
+def schedule_action(chat_id, message_id, action, due):
+    """Schedule a delete/edit/pin/unpin action on a sent message at unix time due"""
+    payload = {"chat_id": chat_id, "message_id": message_id}
+    if action["type"] == "edit":
+        payload["text"] = action["text"]
+    return timers.schedule(due, POST_ACTIONS[action["type"]], payload)
+
+def action_due(action, sent_at):
+    """Unix time at which an action runs: the first "time" of day (HH:MM) after sending, or "after" seconds from sending"""
+    if "time" in action:
+        hour, minute = map(int, action["time"].split(':'))
+    else:
+        return sent_at + action.get("after", 0)
+
+    sent = datetime.fromtimestamp(sent_at)
+    due = sent.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if due <= sent:
+        due += timedelta(days=1)
+    return due.timestamp()
+
+def after_send(post_data, chat_id, messages):
+    """Register messages sent to chat_id and schedule the post's follow-up actions.
+
+    Copied posts come back as MessageId objects, which carry no chat, so only
+    the message ids are read from what was sent.
+    """
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+
+    for message in messages:
+        sent_at = record_sent(chat_id, message.message_id, post_data.get("id"))
+
+        for action in post_data.get("actions", []):
+            # Albums are edited and pinned through their first message only
+            if action["type"] != "delete" and message is not messages[0]:
+                continue
+            schedule_action(chat_id, message.message_id, action, action_due(action, sent_at))
+
+async def _delete_messages(bot, payloads):
+    """Delete due messages, batched per chat"""
+    by_chat = {}
+    for payload in payloads:
+        by_chat.setdefault(payload["chat_id"], []).append(payload["message_id"])
+
+    for chat_id, message_ids in by_chat.items():
+        for i in range(0, len(message_ids), DELETE_BATCH_SIZE):
+            chunk = message_ids[i:i + DELETE_BATCH_SIZE]
+            try:
+                if hasattr(bot, "delete_messages"):
+                    await bot.delete_messages(chat_id, chunk)
+                else:
+                    for message_id in chunk:
+                        await bot.delete_message(chat_id, message_id)
+            except Exception as e:
+                logger.error(f"Error deleting {len(chunk)} messages in {chat_id}: {e}")
+        logger.info(f"Deleted {len(message_ids)} expired messages in {chat_id}")
+
+async def _edit_message(bot, payload):
+    """Replace the text of a sent message"""
+    try:
+        await bot.edit_message_text(
+            payload["text"],
+            chat_id=payload["chat_id"],
+            message_id=payload["message_id"],
+            parse_mode=ParseMode.HTML
+        )
+    except Exception as e:
+        # Media posts have a caption instead of text
+        logger.warning(f"Error editing message text, trying caption: {e}")
+        await bot.edit_message_caption(
+            chat_id=payload["chat_id"],
+            message_id=payload["message_id"],
+            caption=payload["text"],
+            parse_mode=ParseMode.HTML
+        )
+
+async def _pin_message(bot, payload):
+    """Pin a sent message"""
+    await bot.pin_chat_message(payload["chat_id"], payload["message_id"], disable_notification=True)
+
+async def _unpin_message(bot, payload):
+    """Unpin a sent message"""
+    await bot.unpin_chat_message(payload["chat_id"], message_id=payload["message_id"])
+
+timers.register("delete_message", _delete_messages, batch=True)
+timers.register("edit_message", _edit_message)
+timers.register("pin_message", _pin_message)
+timers.register("unpin_message", _unpin_message)
@@ -0,0 +1,297 @@
+"""
+Member rosters of managed chats, kept up to date from chat_member updates
+فهرست اعضای چت‌های مدیریت‌شده که با رویدادهای عضویت به‌روز می‌شود
+
+The Bot API cannot list the members of a chat, so each roster is built
+incrementally from joins, leaves and status changes. A roster is a sorted
+array of user ids with parallel arrays of status bytes and join and leave
+times, 17 bytes a member. Lookups are a binary search, and set queries
+(admins, who joined or left since a time) are one pass over the arrays.
+Members seen for the first time go to a small dict and are merged in sorted
+order in one pass, like vote ledgers. Changed rosters are written every
+ROSTER_FLUSH_INTERVAL seconds, one file per chat.
+"""
+import asyncio
+import logging
+import struct
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+import config
+
+logger = logging.getLogger(__name__)
+
+# Directory holding one roster file per chat
+ROSTERS_DIR = Path('data') / 'rosters'
+
+# File layout: magic, member count, then the user ids (int64), statuses
+# (uint8), join times and leave times (uint32 unix times, 0 for unknown)
+ROSTER_MAGIC = b'RST1'
+ROSTER_HEADER = struct.Struct('<4sxxxxQ')
+
+# Seconds between saves of changed rosters
+ROSTER_FLUSH_INTERVAL = 30
+
+# New members are buffered and merged into the sorted arrays once the buffer
+# reaches this size or an eighth of the roster, whichever is larger
+MERGE_MIN_PENDING = 1024
+
+# Status bytes, from the ChatMember status names
+STATUS_CREATOR = 1
+STATUS_ADMINISTRATOR = 2
+STATUS_MEMBER = 3
+STATUS_RESTRICTED = 4
+STATUS_LEFT = 5
+STATUS_KICKED = 6
+STATUS_CODES = {
+    "creator": STATUS_CREATOR,
+    "administrator": STATUS_ADMINISTRATOR,
+    "member": STATUS_MEMBER,
+    "restricted": STATUS_RESTRICTED,
+    "left": STATUS_LEFT,
+    "kicked": STATUS_KICKED
+}
+
+# Ids listed per query in a member report
+ROSTER_LIST_LIMIT = 20
+
+ADMINS = frozenset((STATUS_CREATOR, STATUS_ADMINISTRATOR))
+PRESENT = frozenset((STATUS_CREATOR, STATUS_ADMINISTRATOR, STATUS_MEMBER, STATUS_RESTRICTED))
+
+def roster_path(chat_id):
+    """Path of a chat's roster file"""
+    return ROSTERS_DIR / f"{chat_id}.bin"
+
+class Roster:
+    """Members of one chat as a sorted array of user ids with parallel status and time arrays"""
+    
+    def __init__(self):
+        self.users = array('q')
+        self.statuses = array('B')
+        self.joined = array('I')
+        self.left = array('I')
+        # user id -> [status, joined, left] of members not merged yet
+        self._pending = {}
+    
+    @classmethod
+    def load(cls, path):
+        """Read a roster file, or return an empty roster if there is none"""
+        roster = cls()
+        try:
+            with open(path, 'rb') as f:
+                magic, count = ROSTER_HEADER.unpack(f.read(ROSTER_HEADER.size))
+                if magic != ROSTER_MAGIC:
+                    raise ValueError(f"{path} is not a roster")
+                roster.users.frombytes(f.read(count * 8))
+                roster.statuses.frombytes(f.read(count))
+                roster.joined.frombytes(f.read(count * 4))
+                roster.left.frombytes(f.read(count * 4))
+        except FileNotFoundError:
+            pass
+        return roster
+    
+    def __len__(self):
+        return len(self.users) + len(self._pending)
+    
+    def _find(self, user_id):
+        """Index of a member in the sorted arrays, or -1"""
+        i = bisect_left(self.users, user_id)
+        if i < len(self.users) and self.users[i] == user_id:
+            return i
+        return -1
+    
+    def status(self, user_id):
+        """A member's status byte, or 0 if they were never seen"""
+        if user_id in self._pending:
+            return self._pending[user_id][0]
+        i = self._find(user_id)
+        return self.statuses[i] if i >= 0 else 0
+    
+    def record(self, user_id, status, when):
+        """Record a member's new status at a unix time; returns True if it changed"""
+        i = self._find(user_id)
+        if i >= 0:
+            entry = [self.statuses[i], self.joined[i], self.left[i]]
+        else:
+            entry = self._pending.get(user_id) or [0, 0, 0]
+        if entry[0] == status:
+            return False
+        
+        # Join and leave times only move when a member crosses in or out of the chat
+        if status in PRESENT and entry[0] not in PRESENT:
+            entry[1] = when
+        elif status not in PRESENT and (entry[0] in PRESENT or not entry[0]):
+            entry[2] = when
+        entry[0] = status
+        
+        if i >= 0:
+            self.statuses[i], self.joined[i], self.left[i] = entry
+            return True
+        self._pending[user_id] = entry
+        if len(self._pending) >= max(MERGE_MIN_PENDING, len(self.users) // 8):
+            self.merge()
+        return True
+    
+    def merge(self):
+        """Merge buffered members into the sorted arrays"""
+        if not self._pending:
+            return
+        
+        users, statuses, joined, left = array('q'), array('B'), array('I'), array('I')
+        start = 0
+        for user_id in sorted(self._pending):
+            # Copy the run of existing members below this one in a single slice
+            end = bisect_left(self.users, user_id, start)
+            users.extend(self.users[start:end])
+            statuses.extend(self.statuses[start:end])
+            joined.extend(self.joined[start:end])
+            left.extend(self.left[start:end])
+            status, joined_at, left_at = self._pending[user_id]
+            users.append(user_id)
+            statuses.append(status)
+            joined.append(joined_at)
+            left.append(left_at)
+            start = end
+        users.extend(self.users[start:])
+        statuses.extend(self.statuses[start:])
+        joined.extend(self.joined[start:])
+        left.extend(self.left[start:])
+        
+        self.users, self.statuses, self.joined, self.left = users, statuses, joined, left
+        self._pending.clear()
+    
+    def members(self, statuses=PRESENT):
+        """Ids of the members with one of the given statuses"""
+        self.merge()
+        return [user_id for user_id, status in zip(self.users, self.statuses) if status in statuses]
+    
+    def joined_since(self, since):
+        """Ids of members still in the chat who joined at or after a unix time"""
+        self.merge()
+        return [
+            user_id for user_id, status, joined_at in zip(self.users, self.statuses, self.joined)
+            if joined_at >= since and status in PRESENT
+        ]
+    
+    def left_since(self, since):
+        """Ids of members who left or were removed at or after a unix time"""
+        self.merge()
+        return [
+            user_id for user_id, status, left_at in zip(self.users, self.statuses, self.left)
+            if left_at >= since and status not in PRESENT
+        ]
+    
+    def to_bytes(self):
+        """The on-disk form of this roster"""
+        self.merge()
+        return (
+            ROSTER_HEADER.pack(ROSTER_MAGIC, len(self.users)) + self.users.tobytes() +
+            self.statuses.tobytes() + self.joined.tobytes() + self.left.tobytes()
+        )
+
+def id_list(user_ids, limit=ROSTER_LIST_LIMIT):
+    """Up to limit user ids for a report, with a count of the rest"""
+    if not user_ids:
+        return "-"
+    more = f" and {len(user_ids) - limit} more" if len(user_ids) > limit else ""
+    return ", ".join(str(user_id) for user_id in user_ids[:limit]) + more
+
+# chat id -> Roster, loaded on first use
+_rosters = {}
+
+# Chats whose rosters changed since the last save
+_dirty = set()
+
+# Ids and @usernames of the configured channels and groups, read from the
+# config on first use and dropped whenever one is added or removed
+_managed = None
+
+def get_roster(chat_id):
+    """A chat's roster, read from disk on first use"""
+    roster = _rosters.get(chat_id)
+    if roster is None:
+        roster = _rosters[chat_id] = Roster.load(roster_path(chat_id))
+    return roster
+
+def forget_managed():
+    """Drop the cached managed chats after a channel or group was added or removed"""
+    global _managed
+    _managed = None
+
+def is_managed(chat):
+    """Whether a chat is one of the configured channels or groups"""
+    global _managed
+    
+    if _managed is None:
+        conf = config.init_config()
+        _managed = frozenset(conf["channels"]) | frozenset(conf["groups"])
+    keys = (str(chat.id), f"@{chat.username}" if chat.username else None)
+    return any(key in _managed for key in keys if key)
+
+def record_member(chat_id, user_id, status, when):
+    """Record a member's status (a ChatMember status name) at a unix time"""
+    if get_roster(chat_id).record(user_id, STATUS_CODES[status], int(when)):
+        _dirty.add(chat_id)
+
+def record_update(change):
+    """Record a ChatMemberUpdated of a managed chat"""
+    if not is_managed(change.chat):
+        return
+    member = change.new_chat_member
+    status = member.status
+    # Restricted users who left keep their restrictions but are no longer in the chat
+    if status == "restricted" and not getattr(member, "is_member", True):
+        status = "left"
+    record_member(change.chat.id, member.user.id, status, change.date.timestamp())
+
+def sync_admins(chat_id, administrators):
+    """Match the roster's admins to a fetched administrator list"""
+    roster = get_roster(chat_id)
+    current = {member.user.id for member in administrators}
+    # Admins seen only here get an unknown join time, so they do not count as new
+    changed = False
+    for member in administrators:
+        changed |= roster.record(member.user.id, STATUS_CODES[member.status], 0)
+    for user_id in roster.members(ADMINS):
+        if user_id not in current:
+            changed |= roster.record(user_id, STATUS_MEMBER, 0)
+    if changed:
+        _dirty.add(chat_id)
+
+def _write(changed):
+    """Atomically replace the files of changed rosters"""
+    ROSTERS_DIR.mkdir(parents=True, exist_ok=True)
+    for chat_id, content in changed.items():
+        path = roster_path(chat_id)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        tmp_path.replace(path)
+    return len(changed)
+
+def _snapshot():
+    """The on-disk form of every changed roster"""
+    changed = {chat_id: _rosters[chat_id].to_bytes() for chat_id in _dirty}
+    _dirty.clear()
+    return changed
+
+def flush():
+    """Write all changed rosters now"""
+    if not _dirty:
+        return 0
+    return _write(_snapshot())
+
+async def flush_loop():
+    """Save changed rosters every ROSTER_FLUSH_INTERVAL seconds, writing off the event loop"""
+    while True:
+        await asyncio.sleep(ROSTER_FLUSH_INTERVAL)
+        if not _dirty:
+            continue
+        
+        changed = _snapshot()
+        try:
+            await asyncio.to_thread(_write, changed)
+        except Exception as e:
+            logger.error(f"Error saving member rosters: {e}")
+            # Keep the rosters dirty so the next round retries
+            _dirty.update(changed)
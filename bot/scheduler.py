@@ -3,32 +3,57 @@ Scheduler module for handling timed tasks
 """
 import logging
 import uuid
-from datetime import datetime
-import pytz
-from apscheduler.schedulers.background import BackgroundScheduler
+from collections import deque
+from datetime import datetime, timedelta
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.jobstores.memory import MemoryJobStore
 from telegram import InlineKeyboardMarkup
+from telegram.constants import ParseMode
 from bot.storage import load_data, save_data
 from bot.keyboards import build_inline_keyboard
+from bot.messages import validate_html
+from bot.media import ensure_file_id, send_payload
+from bot.registry import after_send
+from bot.queues import ContentQueue, resolve_queued_post
+import config
 
 logger = logging.getLogger(__name__)
 
 # Global scheduler instance
 scheduler = None
 
+# Bot instance used by jobs created after startup
+_bot = None
+
+# Seconds before the send time at which a job is warmed up
+warmup_seconds = config.SCHEDULE_WARMUP_SECONDS
+
+# Payloads rendered by the warm-up phase, keyed by job id
+_prepared_payloads = {}
+
+# Numeric chat ids resolved from @username targets
+_resolved_chats = {}
+
+# Recent (job id, scheduled time, delay in seconds) measurements
+send_latencies = deque(maxlen=1000)
+
 def setup_scheduler(bot):
     """Initialize and configure the scheduler"""
-    global scheduler
+    global scheduler, _bot, warmup_seconds
     
     if scheduler is None:
+        _bot = bot
+        warmup_seconds = config.init_config().get("schedule_warmup_seconds", config.SCHEDULE_WARMUP_SECONDS)
+        
         # Create scheduler
         jobstores = {
             'default': MemoryJobStore()
         }
         
-        scheduler = BackgroundScheduler(jobstores=jobstores)
+        # AsyncIOScheduler runs the coroutine jobs on the bot's event loop
+        scheduler = AsyncIOScheduler(jobstores=jobstores)
         scheduler.start()
         
         # Load and reschedule saved jobs
@@ -36,19 +61,38 @@ def setup_scheduler(bot):
     
     return scheduler
 
+def _parse_time(value):
+    """Convert a stored schedule time to a datetime"""
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+def _now_like(moment):
+    """Current time, naive or aware to match the given datetime"""
+    return datetime.now(moment.tzinfo)
+
+def _autopost_trigger(post_data):
+    """Build the cron trigger for an automatic post"""
+    if post_data["type"] == "daily":
+        # Daily post at specific time
+        return CronTrigger(hour=post_data["hour"], minute=post_data["minute"])
+    elif post_data["type"] == "weekly":
+        # Weekly post on specific day at specific time
+        return CronTrigger(day_of_week=post_data["day"], hour=post_data["hour"], minute=post_data["minute"])
+    return None
+
 def load_scheduled_jobs(bot):
     """Load and schedule saved jobs from storage"""
     data = load_data()
-    current_time = datetime.now(pytz.utc)
     
     # Filter out expired scheduled messages
     valid_messages = []
     
     for msg in data.get("scheduled_messages", []):
-        scheduled_time = datetime.fromisoformat(msg["time"])
+        scheduled_time = _parse_time(msg["time"])
         
         # If the message is still in the future, reschedule it
-        if scheduled_time > current_time:
+        if scheduled_time > _now_like(scheduled_time):
             job_id = msg["id"]
             
             # Create a job to send the message
@@ -59,6 +103,7 @@ def load_scheduled_jobs(bot):
                 id=job_id,
                 replace_existing=True
             )
+            _schedule_warmup(bot, msg, scheduled_time)
             
             valid_messages.append(msg)
     
@@ -68,96 +113,177 @@ def load_scheduled_jobs(bot):
     # Reschedule automatic posts
     for autopost in data.get("auto_posts", []):
         job_id = autopost["id"]
+        trigger = _autopost_trigger(autopost)
         
-        if autopost["type"] == "daily":
-            # Daily post at specific time
-            scheduler.add_job(
-                send_auto_post,
-                trigger=CronTrigger(hour=autopost["hour"], minute=autopost["minute"]),
-                args=[bot, autopost],
-                id=job_id,
-                replace_existing=True
-            )
-        elif autopost["type"] == "weekly":
-            # Weekly post on specific day at specific time
-            scheduler.add_job(
-                send_auto_post,
-                trigger=CronTrigger(day_of_week=autopost["day"], hour=autopost["hour"], minute=autopost["minute"]),
-                args=[bot, autopost],
-                id=job_id,
-                replace_existing=True
-            )
+        if trigger is None:
+            continue
+        
+        job = scheduler.add_job(
+            send_auto_post,
+            trigger=trigger,
+            args=[bot, autopost],
+            id=job_id,
+            replace_existing=True
+        )
+        _schedule_warmup(bot, autopost, job.next_run_time)
     
     save_data(data)
 
-async def send_scheduled_message(bot, message_data):
-    """Send a scheduled message"""
+def _schedule_warmup(bot, post_data, run_time):
+    """Add a job that prepares a post shortly before its send time"""
+    if run_time is None or warmup_seconds <= 0:
+        return
+    
+    warmup_time = run_time - timedelta(seconds=warmup_seconds)
+    now = _now_like(warmup_time)
+    if warmup_time < now:
+        # Already inside the warm-up window, prepare right away
+        warmup_time = now
+    
+    scheduler.add_job(
+        prepare_post,
+        trigger=DateTrigger(run_date=warmup_time),
+        args=[bot, post_data, run_time],
+        id=f"{post_data['id']}:warmup",
+        replace_existing=True
+    )
+
+async def _resolve_chat_id(bot, target_id):
+    """Resolve an @username target to its numeric chat id"""
+    if not isinstance(target_id, str) or not target_id.startswith('@'):
+        return target_id
+    
+    if target_id not in _resolved_chats:
+        chat = await bot.get_chat(target_id)
+        _resolved_chats[target_id] = chat.id
+    return _resolved_chats[target_id]
+
+def _build_payload(post_data, chat_id):
+    """Render the send arguments for a scheduled or automatic post"""
+    text = post_data.get("text", "")
+    
+    # Check if there are inline buttons
+    keyboard = None
+    if "keyboard" in post_data and post_data["keyboard"]:
+        parsed_keyboard = []
+        for row in post_data["keyboard"]:
+            keyboard_row = []
+            for button in row:
+                keyboard_row.append(button)
+            parsed_keyboard.append(keyboard_row)
+        keyboard = InlineKeyboardMarkup(build_inline_keyboard(parsed_keyboard))
+    
+    # Invalid HTML would make Telegram reject the message, send it as plain text instead
+    parse_mode = ParseMode.HTML
+    html_errors = validate_html(text)
+    if html_errors:
+        logger.warning(f"Post {post_data['id']} has invalid HTML ({', '.join(html_errors)}), sending as plain text")
+        parse_mode = None
+    
+    return {
+        "chat_id": chat_id,
+        "text": text,
+        "reply_markup": keyboard,
+        "parse_mode": parse_mode,
+        "media": post_data.get("media")
+    }
+
+async def _render_post(bot, post_data):
+    """Pick the post's content (next queue item for rotating autoposts) and build its payload"""
+    post = resolve_queued_post(post_data)
+    if post is None:
+        return None
+    
+    chat_id = await _resolve_chat_id(bot, post["target"]["id"])
+    return _build_payload(post, chat_id)
+
+async def prepare_post(bot, post_data, run_time=None):
+    """Warm-up phase: pick and render the payload, resolve the target and warm the connection"""
     try:
-        target_id = message_data["target"]["id"]
-        text = message_data["text"]
+        payload = await _render_post(bot, post_data)
         
-        # Check if the target ID is a username (starts with @)
-        chat_id = target_id
+        # Local media files are uploaded now so the send only references a file_id
+        if payload and payload["media"]:
+            await ensure_file_id(bot, payload["media"])
         
-        # Check if there are inline buttons
-        keyboard = None
-        if "keyboard" in message_data and message_data["keyboard"]:
-            parsed_keyboard = []
-            for row in message_data["keyboard"]:
-                keyboard_row = []
-                for button in row:
-                    keyboard_row.append(button)
-                parsed_keyboard.append(keyboard_row)
-            keyboard = InlineKeyboardMarkup(build_inline_keyboard(parsed_keyboard))
+        # A cheap request keeps the HTTP connection to the Bot API open
+        await bot.get_me()
+        
+        _prepared_payloads[post_data["id"]] = {"payload": payload, "due": run_time}
+        logger.info(f"Prepared post {post_data['id']} for {run_time}")
+    except Exception as e:
+        logger.error(f"Error preparing post {post_data.get('id')}: {e}")
+
+async def _take_payload(bot, post_data):
+    """Return the prepared payload for a post, rendering it now if warm-up did not run"""
+    prepared = _prepared_payloads.pop(post_data["id"], None)
+    if prepared:
+        return prepared["payload"], prepared["due"]
+    
+    return await _render_post(bot, post_data), None
+
+def _record_latency(job_id, scheduled_time):
+    """Record how far after its scheduled time a post actually went out"""
+    if scheduled_time is None:
+        return
+    
+    delay = (_now_like(scheduled_time) - scheduled_time).total_seconds()
+    send_latencies.append((job_id, scheduled_time.isoformat(), delay))
+    logger.info(f"Post {job_id} sent {delay:.3f}s after its scheduled time")
+
+def get_send_latency_stats():
+    """Summarize recorded scheduled-vs-actual send delays"""
+    delays = sorted(delay for _, _, delay in send_latencies)
+    if not delays:
+        return None
+    
+    return {
+        "count": len(delays),
+        "average": sum(delays) / len(delays),
+        "p95": delays[min(len(delays) - 1, int(len(delays) * 0.95))],
+        "max": delays[-1]
+    }
+
+async def send_scheduled_message(bot, message_data):
+    """Send a scheduled message"""
+    try:
+        payload, _ = await _take_payload(bot, message_data)
         
         # Send the message
-        await bot.send_message(
-            chat_id=chat_id,
-            text=text,
-            reply_markup=keyboard,
-            parse_mode='HTML'
-        )
+        sent = await send_payload(bot, payload)
+        _record_latency(message_data["id"], _parse_time(message_data["time"]))
+        after_send(message_data, payload["chat_id"], sent)
         
         # Remove this scheduled message from storage
         data = load_data()
         data["scheduled_messages"] = [msg for msg in data["scheduled_messages"] if msg["id"] != message_data["id"]]
         save_data(data)
         
-        logger.info(f"Sent scheduled message {message_data['id']} to {chat_id}")
+        logger.info(f"Sent scheduled message {message_data['id']} to {payload['chat_id']}")
     except Exception as e:
         logger.error(f"Error sending scheduled message: {e}")
 
 async def send_auto_post(bot, post_data):
     """Send an automatic post"""
     try:
-        target_id = post_data["target"]["id"]
-        text = post_data["text"]
-        
-        # Check if the target ID is a username (starts with @)
-        chat_id = target_id
-        
-        # Check if there are inline buttons
-        keyboard = None
-        if "keyboard" in post_data and post_data["keyboard"]:
-            parsed_keyboard = []
-            for row in post_data["keyboard"]:
-                keyboard_row = []
-                for button in row:
-                    keyboard_row.append(button)
-                parsed_keyboard.append(keyboard_row)
-            keyboard = InlineKeyboardMarkup(build_inline_keyboard(parsed_keyboard))
+        payload, due = await _take_payload(bot, post_data)
+        if payload is None:
+            logger.info(f"Automatic post {post_data['id']} has no content left to send")
+            return
         
         # Send the message
-        await bot.send_message(
-            chat_id=chat_id,
-            text=text,
-            reply_markup=keyboard,
-            parse_mode='HTML'
-        )
+        sent = await send_payload(bot, payload)
+        _record_latency(post_data["id"], due)
+        after_send(post_data, payload["chat_id"], sent)
         
-        logger.info(f"Sent automatic post {post_data['id']} to {chat_id}")
+        logger.info(f"Sent automatic post {post_data['id']} to {payload['chat_id']}")
     except Exception as e:
         logger.error(f"Error sending automatic post: {e}")
+    finally:
+        # Warm up the next occurrence of this recurring post
+        job = scheduler.get_job(post_data["id"])
+        if job:
+            _schedule_warmup(bot, post_data, job.next_run_time)
 
 def schedule_one_time_message(message_data):
     """Add a one-time scheduled message to the scheduler"""
@@ -179,10 +305,11 @@ def schedule_one_time_message(message_data):
         scheduler.add_job(
             send_scheduled_message,
             trigger=DateTrigger(run_date=scheduled_time),
-            args=[scheduler._executors['default']._scheduler._bot, message_data],
+            args=[_bot, message_data],
             id=job_id,
             replace_existing=True
         )
+        _schedule_warmup(_bot, message_data, scheduled_time)
         
         # Save to storage
         data = load_data()
@@ -195,6 +322,35 @@ def schedule_one_time_message(message_data):
         logger.error(f"Error scheduling message: {e}")
         return None
 
+def register_scheduled_messages(messages):
+    """Add jobs for many already stored scheduled messages (used by bulk import)"""
+    global scheduler
+    
+    count = 0
+    for message_data in messages:
+        try:
+            scheduled_time = _parse_time(message_data["time"])
+            scheduler.add_job(
+                send_scheduled_message,
+                trigger=DateTrigger(run_date=scheduled_time),
+                args=[_bot, message_data],
+                id=message_data["id"],
+                replace_existing=True
+            )
+            _schedule_warmup(_bot, message_data, scheduled_time)
+            count += 1
+        except Exception as e:
+            logger.error(f"Error registering scheduled message {message_data.get('id')}: {e}")
+    
+    logger.info(f"Registered {count} imported scheduled messages")
+    return count
+
+def _remove_warmup(job_id):
+    """Drop the warm-up job and any prepared payload for a job"""
+    _prepared_payloads.pop(job_id, None)
+    if scheduler.get_job(f"{job_id}:warmup"):
+        scheduler.remove_job(f"{job_id}:warmup")
+
 def cancel_scheduled_job(job_id):
     """Cancel a scheduled message by its ID"""
     global scheduler
@@ -202,6 +358,7 @@ def cancel_scheduled_job(job_id):
     try:
         # Remove from scheduler
         scheduler.remove_job(job_id)
+        _remove_warmup(job_id)
         
         # Remove from storage
         data = load_data()
@@ -223,24 +380,16 @@ def schedule_recurring_message(post_data):
         job_id = str(uuid.uuid4())
         post_data["id"] = job_id
         
-        if post_data["type"] == "daily":
-            # Daily post at specific time
-            scheduler.add_job(
+        trigger = _autopost_trigger(post_data)
+        if trigger is not None:
+            job = scheduler.add_job(
                 send_auto_post,
-                trigger=CronTrigger(hour=post_data["hour"], minute=post_data["minute"]),
-                args=[scheduler._executors['default']._scheduler._bot, post_data],
-                id=job_id,
-                replace_existing=True
-            )
-        elif post_data["type"] == "weekly":
-            # Weekly post on specific day at specific time
-            scheduler.add_job(
-                send_auto_post,
-                trigger=CronTrigger(day_of_week=post_data["day"], hour=post_data["hour"], minute=post_data["minute"]),
-                args=[scheduler._executors['default']._scheduler._bot, post_data],
+                trigger=trigger,
+                args=[_bot, post_data],
                 id=job_id,
                 replace_existing=True
             )
+            _schedule_warmup(_bot, post_data, job.next_run_time)
         
         # Save to storage
         data = load_data()
@@ -260,14 +409,42 @@ def cancel_autopost(job_id):
     try:
         # Remove from scheduler
         scheduler.remove_job(job_id)
+        _remove_warmup(job_id)
         
         # Remove from storage
         data = load_data()
         data["auto_posts"] = [post for post in data["auto_posts"] if post["id"] != job_id]
         save_data(data)
+        ContentQueue(job_id).delete()
         
         logger.info(f"Cancelled automatic post {job_id}")
         return True
     except Exception as e:
         logger.error(f"Error cancelling automatic post: {e}")
         return False
+
+def add_post_action(post_id, action):
+    """Attach a follow-up action to every future send of a scheduled or automatic post"""
+    global scheduler
+    
+    try:
+        data = load_data()
+        for key in ("scheduled_messages", "auto_posts"):
+            for post in data.get(key, []):
+                if post["id"] != post_id:
+                    continue
+                
+                post.setdefault("actions", []).append(action)
+                save_data(data)
+                
+                # The job holds its own copy of the post, update it as well
+                job = scheduler.get_job(post_id)
+                if job:
+                    job.modify(args=[job.args[0], post])
+                
+                logger.info(f"Added {action['type']} action to post {post_id}")
+                return True
+        return False
+    except Exception as e:
+        logger.error(f"Error adding post action: {e}")
+        return False
@@ -1,9 +1,11 @@
 """
 Storage module for saving and loading bot data
 """
+import copy
 import json
 import logging
 import os
+import re
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -24,8 +26,9 @@ DEFAULT_DATA = {
 
 def load_data():
     """Load data from storage file"""
+    # Callers modify and save what they get, so the defaults are always a fresh copy
     if not DATA_FILE.exists():
-        return DEFAULT_DATA
+        return copy.deepcopy(DEFAULT_DATA)
     
     try:
         with open(DATA_FILE, 'r') as f:
@@ -33,16 +36,23 @@ def load_data():
         return data
     except json.JSONDecodeError:
         logger.warning(f"Error decoding JSON from {DATA_FILE}. Using default data.")
-        return DEFAULT_DATA
+        return copy.deepcopy(DEFAULT_DATA)
     except Exception as e:
         logger.error(f"Error loading data: {e}")
-        return DEFAULT_DATA
+        return copy.deepcopy(DEFAULT_DATA)
 
 def save_data(data):
-    """Save data to storage file"""
+    """Save data to storage file.
+    
+    The data is written to a temporary file that then replaces the old one, so
+    readers (including streaming exports on worker threads) always see either
+    the old or the new file, never a partly written one.
+    """
+    tmp_path = DATA_FILE.with_suffix('.tmp')
     try:
-        with open(DATA_FILE, 'w') as f:
+        with open(tmp_path, 'w') as f:
             json.dump(data, f, indent=4)
+        os.replace(tmp_path, DATA_FILE)
         return True
     except Exception as e:
         logger.error(f"Error saving data: {e}")
@@ -95,3 +105,146 @@ def update_poll(poll_data):
             save_data(data)
             return True
     return False
+
+# Characters that matter when looking for the end of a JSON value, inside
+# and outside of strings
+_STRING_SPECIAL = re.compile(r'["\\]')
+_STRUCTURE = re.compile(r'["\[\]{}]')
+_SCALAR_END = re.compile(r'[\s,\]}]')
+
+class _JSONStream:
+    """Incremental reader over a JSON file that decodes one value at a time.
+    
+    Strings, arrays and objects are first scanned for their end, chunk by
+    chunk and resuming where the previous chunk stopped, and decoded once they
+    are complete, so a large item costs linear time however many chunks it
+    spans.
+    """
+    
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+    
+    def _fill(self):
+        """Read the next chunk, dropping the consumed part of the buffer"""
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+    
+    def peek(self):
+        """Next non-whitespace character, or '' at the end of the file"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+    
+    def expect(self, char):
+        """Consume an expected structural character"""
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expected '{char}'", self.buf, self.pos)
+        self.pos += 1
+    
+    def _buffer_value(self):
+        """Read until the string, array or object at pos is complete in the buffer"""
+        parts = [self.buf[self.pos:]]
+        part = parts[0]
+        depth = 0
+        in_string = False
+        # Characters at the start of the next part already consumed by an escape
+        skip = 0
+        while True:
+            i = skip
+            while True:
+                match = (_STRING_SPECIAL if in_string else _STRUCTURE).search(part, i)
+                if match is None:
+                    break
+                char = match.group()
+                i = match.end()
+                if in_string:
+                    if char == "\\":
+                        i += 1
+                        continue
+                    in_string = False
+                elif char == '"':
+                    in_string = True
+                    continue
+                elif char in "[{":
+                    depth += 1
+                    continue
+                else:
+                    depth -= 1
+                if depth == 0:
+                    # The value is complete
+                    self.buf = "".join(parts)
+                    self.pos = 0
+                    return
+            
+            skip = max(0, i - len(part))
+            part = self.f.read(self.chunk_size)
+            if not part:
+                self.eof = True
+                raise json.JSONDecodeError("Unterminated value", "".join(parts), 0)
+            parts.append(part)
+    
+    def decode(self):
+        """Decode the next complete value, reading more of the file as needed"""
+        if self.peek() in ('"', "[", "{"):
+            self._buffer_value()
+            value, self.pos = self.decoder.raw_decode(self.buf, self.pos)
+            return value
+        
+        # Numbers and literals are short; they are complete once a delimiter follows
+        while not self.eof and _SCALAR_END.search(self.buf, self.pos) is None:
+            self._fill()
+        value, self.pos = self.decoder.raw_decode(self.buf, self.pos)
+        return value
+    
+    def iter_array(self):
+        """Decode the elements of an array one by one"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("]")
+                return
+
+def iter_data_items(key, chunk_size=1 << 16):
+    """Stream the items of one top-level list of the data file without loading the whole file"""
+    if not DATA_FILE.exists():
+        return
+    
+    with open(DATA_FILE, 'r') as f:
+        stream = _JSONStream(f, chunk_size)
+        stream.expect("{")
+        
+        while stream.peek() not in ("}", ""):
+            name = stream.decode()
+            stream.expect(":")
+            
+            if name == key:
+                yield from stream.iter_array()
+                return
+            
+            # Skip other sections element by element so they are never held in memory
+            if stream.peek() == "[":
+                for _ in stream.iter_array():
+                    pass
+            else:
+                stream.decode()
+            
+            if stream.peek() == ",":
+                stream.pos += 1
@@ -0,0 +1,218 @@
+"""
+Persistent timer heap for delayed bot actions
+صف زمان‌بندی ماندگار برای عملیات تأخیری
+"""
+import asyncio
+import heapq
+import json
+import logging
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Journal of pending timers, one JSON array per line
+TIMERS_FILE = Path('data') / 'timers.jsonl'
+
+# Rewrite the journal once this many finished entries have accumulated
+COMPACT_THRESHOLD = 10000
+
+class TimerHeap:
+    """A single wake-up loop over a binary heap of due times.
+
+    Every timer is appended to a journal as ["a", seq, due, kind, payload] and
+    marked finished with ["d", seq] once its handler has returned, so
+    scheduling and completing a timer are one small append each and pending
+    timers survive a restart; a timer interrupted by a restart runs again.
+    Inserts are O(log n) and all timers that are due together are handed to
+    their handlers in one batch.
+    """
+
+    def __init__(self, path=TIMERS_FILE):
+        self.path = Path(path)
+        self._heap = []       # (due, seq)
+        self._entries = {}    # seq -> (kind, payload)
+        self._handlers = {}   # kind -> (handler, batch)
+        self._seq = 0
+        self._finished = 0
+        self._journal = None
+        self._wakeup = asyncio.Event()
+        self._loaded = False
+
+    def register(self, kind, handler, batch=False):
+        """Register the coroutine run for timers of a kind.
+
+        Handlers are called as handler(bot, payload), or handler(bot, payloads)
+        with every due payload of that kind when batch is True.
+        """
+        self._handlers[kind] = (handler, batch)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        """Replay the journal and rewrite it with only the pending timers"""
+        if self._loaded:
+            return
+        self._loaded = True
+
+        if self.path.exists():
+            try:
+                with open(self.path, 'r') as f:
+                    for line in f:
+                        record = json.loads(line)
+                        if record[0] == "a":
+                            _, seq, due, kind, payload = record
+                            self._entries[seq] = (kind, payload)
+                            self._heap.append((due, seq))
+                            self._seq = max(self._seq, seq)
+                        else:
+                            self._entries.pop(record[1], None)
+            except (json.JSONDecodeError, ValueError) as e:
+                # A crash can leave a partial last line, keep what was read
+                logger.warning(f"Error reading {self.path}: {e}")
+
+        self._heap = [(due, seq) for due, seq in self._heap if seq in self._entries]
+        heapq.heapify(self._heap)
+        self._compact()
+        logger.info(f"Loaded {len(self._entries)} pending timers")
+
+    def _compact(self):
+        """Rewrite the journal with the pending timers only"""
+        if self._journal:
+            self._journal.close()
+
+        self.path.parent.mkdir(exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            for due, seq in self._heap:
+                kind, payload = self._entries[seq]
+                f.write(json.dumps(["a", seq, due, kind, payload]) + "\n")
+        tmp_path.replace(self.path)
+
+        self._journal = open(self.path, 'a')
+        self._finished = 0
+
+    def _write(self, record):
+        """Append a record to the journal"""
+        self._journal.write(json.dumps(record) + "\n")
+
+    def schedule(self, due, kind, payload):
+        """Run the handler for kind with payload at the unix time due; returns the timer id"""
+        self._load()
+        self._seq += 1
+        seq = self._seq
+
+        self._entries[seq] = (kind, payload)
+        heapq.heappush(self._heap, (due, seq))
+        self._write(["a", seq, due, kind, payload])
+        self._journal.flush()
+
+        # Wake the loop if this timer is now the earliest one
+        if self._heap[0][1] == seq:
+            self._wakeup.set()
+        return seq
+
+    def schedule_many(self, items):
+        """Schedule several (due, kind, payload) timers with a single journal flush"""
+        self._load()
+        ids = []
+        for due, kind, payload in items:
+            self._seq += 1
+            self._entries[self._seq] = (kind, payload)
+            heapq.heappush(self._heap, (due, self._seq))
+            self._write(["a", self._seq, due, kind, payload])
+            ids.append(self._seq)
+        self._journal.flush()
+        self._wakeup.set()
+        return ids
+
+    def cancel(self, seq):
+        """Cancel a pending timer; its heap slot is skipped when it comes up"""
+        self._load()
+        if self._entries.pop(seq, None) is None:
+            return False
+        self._write(["d", seq])
+        self._journal.flush()
+        self._finished += 1
+        return True
+
+    def pending(self, kind):
+        """(timer id, payload) of every pending timer of a kind"""
+        self._load()
+        return [(seq, payload) for seq, (entry_kind, payload) in self._entries.items() if entry_kind == kind]
+
+    def _pop_due(self, now):
+        """Remove and return all timers due at now as (timer id, payload) pairs, grouped by kind"""
+        due_by_kind = {}
+        while self._heap and self._heap[0][0] <= now:
+            _, seq = heapq.heappop(self._heap)
+            entry = self._entries.pop(seq, None)
+            if entry is None:
+                # Cancelled
+                continue
+            kind, payload = entry
+            due_by_kind.setdefault(kind, []).append((seq, payload))
+        return due_by_kind
+
+    def _finish(self, seqs):
+        """Mark timers finished in the journal"""
+        for seq in seqs:
+            self._write(["d", seq])
+            self._finished += 1
+        self._journal.flush()
+
+    async def _dispatch(self, bot, kind, due):
+        """Run the handler for a batch of due timers, marking each finished once it has run.
+
+        A timer whose handler fails is logged and finished, not retried; the
+        other timers of the batch still run.
+        """
+        handler, batch = self._handlers.get(kind, (None, False))
+        if handler is None:
+            logger.warning(f"No handler for {len(due)} due timers of kind {kind}")
+            self._finish(seq for seq, payload in due)
+            return
+
+        if batch:
+            try:
+                await handler(bot, [payload for seq, payload in due])
+            except Exception as e:
+                logger.error(f"Error running {len(due)} {kind} timers: {e}")
+            self._finish(seq for seq, payload in due)
+            return
+
+        for seq, payload in due:
+            try:
+                await handler(bot, payload)
+            except Exception as e:
+                logger.error(f"Error running {kind} timer {seq}: {e}")
+            self._finish([seq])
+
+    async def run(self, bot):
+        """Wake up for the earliest timer, run everything due, and sleep again"""
+        self._load()
+
+        while True:
+            self._wakeup.clear()
+            if self._heap:
+                timeout = self._heap[0][0] - time.time()
+            else:
+                timeout = None
+
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due_by_kind = self._pop_due(time.time())
+            for kind, due in due_by_kind.items():
+                await self._dispatch(bot, kind, due)
+
+            if self._finished > COMPACT_THRESHOLD and self._finished > len(self._entries):
+                self._compact()
+
+# Shared timer heap for the whole bot
+timers = TimerHeap()
@@ -4,11 +4,13 @@ Utility functions for the bot
 import logging
 import uuid
 import json
-from datetime import datetime
-from telegram import InlineKeyboardMarkup, Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
-from bot.storage import add_poll, save_data, load_data
-from bot.keyboards import create_poll_keyboard
+from bot.storage import save_data, load_data
+from bot.polls import register_polls, get_poll_settings, MAX_POLL_TARGETS
+from bot.poll_templates import CompiledTemplate, get_template, save_custom_template, CUSTOM_TEMPLATE
+from bot.poll_keyboards import create_poll_target_keyboard
+import config
 
 logger = logging.getLogger(__name__)
 
@@ -144,7 +146,26 @@ async def process_poll_creation(update: Update, context: ContextTypes.DEFAULT_TY
     if "creating_poll" in user_data:
         poll_data = user_data["creating_poll"]
         
-        if poll_data["state"] == "title":
+        if poll_data["state"] == "title" and poll_data.get("template"):
+            # Templates bring their options, so the poll goes straight to its targets
+            poll_data["title"] = message_text
+            await ask_poll_targets(update.message.reply_text, poll_data)
+            return True
+        
+        elif poll_data["state"] == "template":
+            # Custom template: the title on the first line, one option per line after it
+            lines = [line.strip() for line in message_text.splitlines() if line.strip()]
+            if len(lines) < 3:
+                await update.message.reply_text("Send the title on the first line and at least two options, one per line.")
+                return True
+            
+            save_custom_template(lines[0], lines[1:])
+            poll_data["template"] = CUSTOM_TEMPLATE
+            poll_data["title"] = lines[0]
+            await ask_poll_targets(update.message.reply_text, poll_data)
+            return True
+        
+        elif poll_data["state"] == "title":
             # Set poll title
             poll_data["title"] = message_text
             poll_data["state"] = "options"
@@ -161,8 +182,8 @@ async def process_poll_creation(update: Update, context: ContextTypes.DEFAULT_TY
             
             keyboard = [
                 [
-                    {"text": "Add Another Option", "callback_data": json.dumps({"action": "add_poll_option"})},
-                    {"text": "Finish Poll", "callback_data": json.dumps({"action": "finish_poll"})}
+                    InlineKeyboardButton("Add Another Option", callback_data=json.dumps({"action": "add_poll_option"})),
+                    InlineKeyboardButton("Finish Poll", callback_data=json.dumps({"action": "finish_poll"}))
                 ]
             ]
             
@@ -185,53 +206,85 @@ async def process_poll_creation(update: Update, context: ContextTypes.DEFAULT_TY
     
     return False
 
-async def create_and_send_poll(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id):
-    """Create and send a poll to the specified chat"""
+async def ask_poll_targets(reply, poll_data):
+    """Move poll creation to the target step and show the chats to choose from"""
+    poll_data["state"] = "target"
+    poll_data["targets"] = []
+    conf = config.init_config()
+    keyboard = create_poll_target_keyboard(conf["channels"], conf["groups"])
+    await reply(
+        "📤 کانال‌ها و گروه‌هایی که نظرسنجی در آن‌ها منتشر شود را انتخاب کنید:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def _send_poll(context, poll, poll_text, keyboard, chat_ids, names):
+    """Send one poll to its chats and record where it was shown; returns the number of chats reached"""
+    messages = []
+    target_names = {}
+    for chat_id in chat_ids[:MAX_POLL_TARGETS]:
+        try:
+            message = await context.bot.send_message(
+                chat_id=chat_id,
+                text=poll_text,
+                reply_markup=keyboard
+            )
+        except Exception as e:
+            logger.error(f"Error sending poll {poll['id']} to {chat_id}: {e}")
+            continue
+        messages.append(message)
+        target_names[str(message.chat_id)] = names.get(str(chat_id), str(chat_id))
+    
+    # Remember the messages so live results can be edited into all of them;
+    # targets are the resolved chat ids that votes arrive from
+    poll["messages"] = [{"chat_id": message.chat_id, "message_id": message.message_id} for message in messages]
+    poll["targets"] = [message.chat_id for message in messages]
+    poll["target_names"] = target_names
+    return len(messages)
+
+async def create_and_send_poll(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_ids, separate=False):
+    """Create a poll and send it to one chat or a list of chats; returns the number of chats reached.
+    
+    With separate=True every chat gets its own poll with its own results.
+    """
     user_data = context.user_data
     
     if "creating_poll" in user_data:
         poll_data = user_data["creating_poll"]
+        if not isinstance(chat_ids, (list, tuple)):
+            chat_ids = [chat_ids]
         
-        # Generate a unique ID for this poll
-        poll_id = generate_unique_id()
-        
-        # Format options with initial count of 0
-        formatted_options = []
-        for option_text in poll_data["options"]:
-            formatted_options.append({
-                "text": option_text,
-                "count": 0
-            })
-        
-        # Create poll object
-        poll = {
-            "id": poll_id,
-            "title": poll_data["title"],
-            "options": formatted_options,
-            "votes": {},
-            "created_at": datetime.now().isoformat()
-        }
-        
-        # Create keyboard with poll options
-        keyboard = create_poll_keyboard(formatted_options, poll_id)
-        
-        # Send the poll
-        poll_text = f"📊 Poll: {poll['title']}\n\n"
-        for option in poll["options"]:
-            poll_text += f"{option['text']}: {option['count']} votes\n"
-        
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=poll_text,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        # Polls from the conversation are compiled like an unnamed template
+        if poll_data.get("template"):
+            template = get_template(poll_data["template"])
+        else:
+            template = CompiledTemplate(None, poll_data, get_poll_settings())
+        if template is None:
+            return 0
+        
+        names = poll_data.get("target_names", {})
+        if separate:
+            chat_ids = chat_ids[:MAX_POLL_TARGETS]
+            batches = zip(template.instantiate_many(len(chat_ids), poll_data.get("title")), ([chat_id] for chat_id in chat_ids))
+        else:
+            batches = [(template.instantiate(poll_data.get("title")), chat_ids)]
         
-        # Save the poll
-        add_poll(poll)
+        sent = 0
+        polls = []
+        for (poll, poll_text, keyboard), targets in batches:
+            reached = await _send_poll(context, poll, poll_text, keyboard, targets, names)
+            if reached:
+                sent += reached
+                polls.append(poll)
+        
+        if not polls:
+            return 0
+        
+        # Save the polls
+        await register_polls(polls)
         
         # Clear the state
         del user_data["creating_poll"]
         
-        return True
+        return sent
     
-    return False
+    return 0
@@ -0,0 +1,224 @@
+"""
+Welcome messages compiled once per group and rendered for each new member
+پیام‌های خوش‌آمد که برای هر گروه یک بار آماده و برای هر عضو جدید ساخته می‌شوند
+"""
+import asyncio
+import html
+import logging
+import re
+import time
+from telegram.constants import ParseMode
+from bot.messages import validate_html
+from bot.registry import schedule_action
+from bot.timers import timers
+import config
+
+logger = logging.getLogger(__name__)
+
+# Placeholders a welcome message may contain
+WELCOME_FIELDS = ("name", "username", "chat")
+_FIELD_PATTERN = re.compile(r"\{(" + "|".join(WELCOME_FIELDS) + r")\}")
+
+# Join bursts: joins within burst_window seconds share one welcome naming up to
+# mention_cap members; bursts larger than summary_threshold get a short summary.
+# Welcomes are sent delay seconds after the burst and deleted auto_delete
+# seconds after sending (0 turns either off), through the shared timer heap.
+# With captcha on, members are welcomed once they pass it (see bot.captcha).
+# A join rate of raid_threshold members a minute locks the group down (see
+# bot.raid; 0 is off)
+DEFAULT_WELCOME_SETTINGS = {
+    "burst_window": 10,
+    "mention_cap": 20,
+    "summary_threshold": 50,
+    "delay": 0,
+    "auto_delete": 0,
+    "captcha": False,
+    "captcha_timeout": 120,
+    "raid_threshold": 0
+}
+
+# Values the settings keyboard cycles through
+WELCOME_SETTING_CHOICES = {
+    "burst_window": (0, 5, 10, 30, 60),
+    "mention_cap": (5, 10, 20, 50),
+    "summary_threshold": (10, 25, 50, 100, 200),
+    "delay": (0, 5, 15, 30, 60),
+    "auto_delete": (0, 30, 60, 300, 900, 3600),
+    "captcha": (False, True),
+    "captcha_timeout": (60, 120, 300),
+    "raid_threshold": (0, 20, 50, 100, 200)
+}
+
+WELCOME_SUMMARY = "👋 {count} عضو جدید به {chat} پیوستند. خوش آمدید!"
+
+class WelcomeTemplate:
+    """A welcome message split into literal text and placeholders.
+    
+    Segments alternate literal, field, literal, ...; rendering fills the odd
+    positions. Messages that are not valid Telegram HTML are sent as plain
+    text, like scheduled posts, so member names are only escaped for HTML.
+    """
+    
+    def __init__(self, text):
+        self.text = text
+        errors = validate_html(text)
+        if errors:
+            logger.warning(f"Welcome message has invalid HTML ({', '.join(errors)}), sending as plain text")
+        self.parse_mode = None if errors else ParseMode.HTML
+        self.segments = _FIELD_PATTERN.split(text)
+        self.fields = frozenset(self.segments[1::2])
+    
+    def render(self, members, chat_title, more=0):
+        """The message for one or more (first name, username) members; more counts unnamed ones"""
+        if not self.fields:
+            return self.text
+        
+        escape = html.escape if self.parse_mode else str
+        others = f" و {more} نفر دیگر" if more else ""
+        values = {}
+        if "name" in self.fields:
+            values["name"] = "، ".join(escape(first_name) for first_name, username in members) + others
+        if "username" in self.fields:
+            values["username"] = "، ".join(f"@{username}" if username else escape(first_name) for first_name, username in members) + others
+        if "chat" in self.fields:
+            values["chat"] = escape(chat_title or "")
+        
+        parts = self.segments.copy()
+        for i in range(1, len(parts), 2):
+            parts[i] = values[parts[i]]
+        return "".join(parts)
+
+# group id (str) -> WelcomeTemplate, loaded from the config on first use
+_templates = None
+
+# Welcome settings, loaded from the config on first use
+_settings = None
+
+# chat id -> [chat title, [(first name, username), ...]] of the joins waiting for their welcome
+_bursts = {}
+
+def _load():
+    """Compile the welcome messages of all groups once"""
+    global _templates
+    
+    if _templates is None:
+        _templates = {
+            group_id: WelcomeTemplate(text)
+            for group_id, text in config.init_config().get("welcome_messages", {}).items()
+            if text
+        }
+    return _templates
+
+def get_welcome(chat_id):
+    """The compiled welcome message of a group, or None"""
+    return _load().get(str(chat_id))
+
+def set_welcome_message(chat_id, text):
+    """Store a group's welcome message and recompile it"""
+    conf = config.init_config()
+    conf["welcome_messages"][str(chat_id)] = text
+    config.save_config(conf)
+    _load()[str(chat_id)] = WelcomeTemplate(text)
+
+def forget_welcome(chat_id):
+    """Drop a group's compiled welcome message after it was removed from the config"""
+    _load().pop(str(chat_id), None)
+
+def get_welcome_settings():
+    """Current welcome settings"""
+    global _settings
+    
+    if _settings is None:
+        _settings = dict(DEFAULT_WELCOME_SETTINGS, **config.init_config().get("welcome_settings", {}))
+    return _settings
+
+def cycle_welcome_setting(name):
+    """Switch a welcome setting to its next choice and return it"""
+    global _settings
+    
+    conf = config.init_config()
+    settings = dict(DEFAULT_WELCOME_SETTINGS, **conf.get("welcome_settings", {}))
+    choices = WELCOME_SETTING_CHOICES[name]
+    position = choices.index(settings[name]) if settings[name] in choices else 0
+    settings[name] = choices[(position + 1) % len(choices)]
+    conf["welcome_settings"] = settings
+    config.save_config(conf)
+    _settings = settings
+    return settings[name]
+
+def welcome_text(welcome, members, chat_title):
+    """One welcome for a burst of members: named up to the cap, or a summary for large bursts"""
+    settings = get_welcome_settings()
+    if len(members) > settings["summary_threshold"]:
+        chat = html.escape(chat_title or "") if welcome.parse_mode else chat_title or ""
+        return WELCOME_SUMMARY.format(count=len(members), chat=chat)
+    
+    cap = settings["mention_cap"]
+    return welcome.render(members[:cap], chat_title, max(0, len(members) - cap))
+
+async def queue_welcome(bot, chat, members):
+    """Welcome new members, coalescing joins that arrive within the burst window"""
+    welcome = get_welcome(chat.id)
+    if welcome is None or not members:
+        return
+    
+    window = get_welcome_settings()["burst_window"]
+    if not window:
+        await _send_welcome(bot, chat.id, welcome_text(welcome, members, chat.title), welcome.parse_mode)
+        return
+    
+    burst = _bursts.get(chat.id)
+    if burst is None:
+        # The first join of a burst opens the window; later ones only add names
+        burst = _bursts[chat.id] = [chat.title, []]
+        asyncio.get_running_loop().call_later(
+            window, lambda: asyncio.ensure_future(_flush_burst(bot, chat.id))
+        )
+    burst[1].extend(members)
+
+async def _flush_burst(bot, chat_id):
+    """Send the welcome of a finished burst"""
+    chat_title, members = _bursts.pop(chat_id)
+    welcome = get_welcome(chat_id)
+    if welcome is None:
+        return
+    
+    if len(members) > 1:
+        logger.info(f"Coalesced {len(members)} joins in {chat_id} into one welcome")
+    await _send_welcome(bot, chat_id, welcome_text(welcome, members, chat_title), welcome.parse_mode)
+
+async def _send_welcome(bot, chat_id, text, parse_mode):
+    """Send a welcome message now, or queue it on the timer heap when a delay is set"""
+    delay = get_welcome_settings()["delay"]
+    if delay:
+        timers.schedule(time.time() + delay, "welcome_send", {"chat_id": chat_id, "text": text, "parse_mode": parse_mode})
+        return
+    
+    try:
+        message = await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+    except Exception as e:
+        logger.error(f"Error sending welcome message to {chat_id}: {e}")
+        return
+    
+    auto_delete = get_welcome_settings()["auto_delete"]
+    if auto_delete:
+        # Deletions are batched per chat with those of scheduled posts
+        schedule_action(chat_id, message.message_id, {"type": "delete"}, time.time() + auto_delete)
+
+async def _send_delayed_welcomes(bot, payloads):
+    """Send welcomes whose delay is over, scheduling their deletions in one journal flush"""
+    auto_delete = get_welcome_settings()["auto_delete"]
+    deletions = []
+    for payload in payloads:
+        try:
+            message = await bot.send_message(chat_id=payload["chat_id"], text=payload["text"], parse_mode=payload["parse_mode"])
+        except Exception as e:
+            logger.error(f"Error sending welcome message to {payload['chat_id']}: {e}")
+            continue
+        if auto_delete:
+            deletions.append((time.time() + auto_delete, "delete_message", {"chat_id": payload["chat_id"], "message_id": message.message_id}))
+    
+    if deletions:
+        timers.schedule_many(deletions)
+
+timers.register("welcome_send", _send_delayed_welcomes, batch=True)
@@ -115,13 +115,21 @@ def create_welcome_templates_keyboard():
     ]
     return keyboard
 
-def create_welcome_settings_keyboard():
-    """Create keyboard for welcome message settings"""
+def create_welcome_settings_keyboard(settings):
+    """Create keyboard for welcome message settings, showing the current values"""
+    burst_window = f"{settings['burst_window']} ثانیه" if settings["burst_window"] else "خاموش"
+    delay = f"{settings['delay']} ثانیه" if settings["delay"] else "خاموش"
+    if not settings["auto_delete"]:
+        auto_delete = "خاموش"
+    elif settings["auto_delete"] % 60:
+        auto_delete = f"{settings['auto_delete']} ثانیه"
+    else:
+        auto_delete = f"{settings['auto_delete'] // 60} دقیقه"
     keyboard = [
         # Auto Delete
         [
             InlineKeyboardButton(
-                "🗑️ حذف خودکار",
+                f"🗑️ حذف خودکار: {auto_delete}",
                 callback_data=json.dumps({"action": "welcome_setting_auto_delete"})
             ),
         ],
@@ -142,16 +150,46 @@ def create_welcome_settings_keyboard():
         # Welcome Delay
         [
             InlineKeyboardButton(
-                "⏱️ تاخیر پیام خوش‌آمد",
+                f"⏱️ تاخیر پیام خوش‌آمد: {delay}",
                 callback_data=json.dumps({"action": "welcome_setting_delay"})
             ),
         ],
+        # Join Bursts
+        [
+            InlineKeyboardButton(
+                f"👥 تجمیع ورودها: {burst_window}",
+                callback_data=json.dumps({"action": "welcome_setting_burst_window"})
+            ),
+        ],
+        [
+            InlineKeyboardButton(
+                f"🏷️ حداکثر نام در هر پیام: {settings['mention_cap']}",
+                callback_data=json.dumps({"action": "welcome_setting_mention_cap"})
+            ),
+        ],
+        [
+            InlineKeyboardButton(
+                f"📋 پیام خلاصه از {settings['summary_threshold']} عضو",
+                callback_data=json.dumps({"action": "welcome_setting_summary_threshold"})
+            ),
+        ],
         # Captcha Verification
         [
             InlineKeyboardButton(
-                "🔐 تأیید هویت کاربر",
+                f"🔐 تأیید هویت کاربر: {'روشن' if settings['captcha'] else 'خاموش'}",
                 callback_data=json.dumps({"action": "welcome_setting_captcha"})
             ),
+            InlineKeyboardButton(
+                f"⏳ مهلت: {settings['captcha_timeout']} ثانیه",
+                callback_data=json.dumps({"action": "welcome_setting_captcha_timeout"})
+            ),
+        ],
+        # Raid Lockdown
+        [
+            InlineKeyboardButton(
+                f"🚨 قرنطینه خودکار از {settings['raid_threshold']} ورود در دقیقه" if settings["raid_threshold"] else "🚨 قرنطینه خودکار: خاموش",
+                callback_data=json.dumps({"action": "welcome_setting_raid_threshold"})
+            ),
         ],
         # Back Button
         [
@@ -163,6 +201,46 @@ def create_welcome_settings_keyboard():
     ]
     return keyboard
 
+def create_raid_alert_keyboard(chat_id):
+    """Create keyboard for a raid alert: lift the lockdown or review the recent joiners"""
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                "🔓 پایان قرنطینه",
+                callback_data=json.dumps({"action": "raid_unlock", "chat": chat_id})
+            ),
+        ],
+        [
+            InlineKeyboardButton(
+                "👀 بررسی اعضای تازه‌وارد",
+                callback_data=json.dumps({"action": "raid_review", "chat": chat_id})
+            ),
+        ],
+    ]
+    return keyboard
+
+def create_raid_review_keyboard(chat_id, count):
+    """Create keyboard for the reviewed joiners of a raid: remove them all or let them all in"""
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                f"👢 اخراج {count} عضو",
+                callback_data=json.dumps({"action": "raid_kick", "chat": chat_id})
+            ),
+            InlineKeyboardButton(
+                f"✅ پذیرش {count} عضو",
+                callback_data=json.dumps({"action": "raid_approve", "chat": chat_id})
+            ),
+        ],
+        [
+            InlineKeyboardButton(
+                "🔓 پایان قرنطینه",
+                callback_data=json.dumps({"action": "raid_unlock", "chat": chat_id})
+            ),
+        ],
+    ]
+    return keyboard
+
 def create_welcome_buttons_keyboard():
     """Create keyboard for adding buttons to welcome messages"""
     keyboard = [
@@ -50,9 +50,25 @@ ADMIN_COMMANDS = [
     "start", "help", "addadmin", "addchannel", "delchannel", "channels", 
     "addgroup", "delgroup", "groups", "send", "schedule", 
     "schedulelist", "cancelschedule", "autopost", "autopostlist", 
-    "delautopost", "welcome", "poll", "getmembers"
+    "delautopost", "welcome", "poll", "getmembers", "sendstats",
+    "postaction", "queueadd", "queuemode", "import",
+    "export", "filter"
 ]
 
+# Scheduler settings
+# Seconds before a scheduled/automatic post is due at which its payload is prepared
+SCHEDULE_WARMUP_SECONDS = 30
+
+# Poll settings
+# Minimum seconds between two edits of a poll message with live results
+POLL_EDIT_INTERVAL = 3
+# Seconds between batched saves of poll votes
+POLL_FLUSH_INTERVAL = 5
+# Voters the duplicate filter of an anonymous poll is sized for: 117 KB at a
+# 1% false positive rate. Past it the filter saturates and turns away a
+# growing share of new voters (16% at twice as many, see bot.sketches)
+ANONYMOUS_POLL_VOTERS = 100000
+
 # Messages
 MESSAGES = {
     "start": "👋 به ربات مدیریت کانال خوش آمدید!\nبرای دیدن دستورات موجود از /help استفاده کنید.",
@@ -69,12 +85,19 @@ MESSAGES = {
             "/schedule - زمان‌بندی پیام\n"
             "/schedulelist - نمایش پیام‌های زمان‌بندی شده\n"
             "/cancelschedule - لغو پیام زمان‌بندی شده\n"
+            "/import - زمان‌بندی گروهی پیام‌ها از فایل CSV/JSONL\n"
+            "/export - خروجی نظرسنجی‌ها، آراء، زمان‌بندی‌ها و پست‌های خودکار\n"
             "/autopost - تنظیم ارسال خودکار\n"
             "/autopostlist - نمایش پست‌های خودکار\n"
             "/delautopost - حذف پست خودکار\n"
             "/welcome - تنظیم پیام خوش‌آمدگویی برای گروه‌ها\n"
             "/poll - ایجاد نظرسنجی با دکمه‌های شیشه‌ای\n"
-            "/getmembers - دریافت لیست اعضای کانال/گروه",
+            "/getmembers - دریافت لیست اعضای کانال/گروه\n"
+            "/sendstats - آمار تأخیر ارسال پیام‌های زمان‌بندی شده\n"
+            "/postaction - حذف، ویرایش یا سنجاق خودکار پست‌ها\n"
+            "/queueadd - افزودن پست به صف چرخشی پست خودکار\n"
+            "/queuemode - تغییر حالت صف (چرخشی، تصادفی، یک‌بار مصرف)\n"
+            "/filter - قوانین ضد اسپم گروه (کلمات ممنوع، لینک، فوروارد)",
     "not_admin": "⛔ شما مجوز استفاده از این ربات را ندارید.",
     "channel_added": "✅ کانال با موفقیت اضافه شد!",
     "channel_removed": "✅ کانال با موفقیت حذف شد!",
@@ -0,0 +1,87 @@
+"""
+Captcha deadlines that survive a restart
+مهلت کپچا که پس از راه‌اندازی مجدد باقی می‌ماند
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from bot import captcha
+from bot.timers import TimerHeap
+
+class _FakeBot:
+    """Records kicks and permission changes"""
+    
+    def __init__(self):
+        self.kicked = []
+        self.restricted = []
+    
+    async def get_chat(self, chat_id):
+        return SimpleNamespace(permissions=None)
+    
+    async def send_message(self, chat_id, text, reply_markup=None):
+        return SimpleNamespace(chat_id=chat_id, message_id=1)
+    
+    async def restrict_chat_member(self, chat_id, user_id, permissions):
+        self.restricted.append((user_id, permissions is captcha.RESTRICTED))
+    
+    async def ban_chat_member(self, chat_id, user_id):
+        self.kicked.append(user_id)
+    
+    async def unban_chat_member(self, chat_id, user_id, only_if_banned=False):
+        pass
+
+def _restart(monkeypatch, path):
+    """Fresh captcha state over the timer journal at path, as after a restart"""
+    monkeypatch.setattr(captcha, "timers", TimerHeap(path))
+    monkeypatch.setattr(captcha, "_pending", captcha.PendingTable(100))
+    monkeypatch.setattr(captcha, "_wheel", captcha.ExpiryWheel())
+    monkeypatch.setattr(captcha, "_loaded", False)
+    monkeypatch.setattr(captcha, "_overflow", set())
+    monkeypatch.setattr(captcha, "_challenges", {})
+
+@pytest.fixture(autouse=True)
+def fresh_captcha(tmp_path, monkeypatch):
+    """Captcha state with its timers in a temporary directory"""
+    _restart(monkeypatch, tmp_path / "timers.jsonl")
+    monkeypatch.setattr(captcha, "get_welcome_settings", lambda: {"captcha_timeout": 60})
+    monkeypatch.setattr(captcha, "schedule_action", lambda *args: None)
+    
+    async def no_welcome(bot, chat, members):
+        pass
+    
+    monkeypatch.setattr(captcha, "queue_welcome", no_welcome)
+
+def test_pending_members_survive_a_restart(tmp_path, monkeypatch):
+    bot = _FakeBot()
+    chat = SimpleNamespace(id=-100)
+    members = [SimpleNamespace(id=user_id, first_name="m", username=None) for user_id in (1, 2, 3)]
+    
+    asyncio.run(captcha.challenge_members(bot, chat, members))
+    answer = captcha._challenges[chat.id][0]
+    assert asyncio.run(captcha.solve(bot, chat, members[0], answer)) is True
+    
+    _restart(monkeypatch, tmp_path / "timers.jsonl")
+    assert len(captcha.timers.pending("captcha_expire")) == 2
+    
+    # The answer is still known after the restart
+    assert asyncio.run(captcha.solve(bot, chat, members[1], answer)) is True
+    assert bot.restricted[-1] == (2, False)
+    
+    # Only the member who never answered is removed once the deadline passes
+    assert asyncio.run(captcha.expire(bot, time.time() + 60 + captcha.CAPTCHA_TICK)) == 1
+    assert bot.kicked == [3]
+    assert captcha.timers.pending("captcha_expire") == []
+
+def test_timer_removes_members_the_wheel_missed(monkeypatch):
+    bot = _FakeBot()
+    chat = SimpleNamespace(id=-100)
+    members = [SimpleNamespace(id=user_id, first_name="m", username=None) for user_id in (1, 2)]
+    asyncio.run(captcha.challenge_members(bot, chat, members))
+    asyncio.run(captcha.solve(bot, chat, members[0], captcha._challenges[chat.id][0]))
+    
+    # Both timers come due, but the member who passed is left alone
+    payloads = [payload for timer_id, payload in captcha.timers.pending("captcha_expire")]
+    payloads.append({"chat_id": chat.id, "user_id": 1, "deadline": payloads[0]["deadline"], "answer": 0})
+    asyncio.run(captcha._expire_timers(bot, payloads))
+    assert bot.kicked == [2]
@@ -0,0 +1,251 @@
+"""
+Properties of vote counting under interleaved clicks and concurrent flushes
+ویژگی‌های شمارش آراء با کلیک‌های هم‌زمان و ذخیره‌سازی موازی
+"""
+import asyncio
+import random
+from collections import Counter
+import pytest
+from bot import ledger, polls, storage
+
+SEEDS = range(20)
+
+@pytest.fixture(autouse=True)
+def fresh_polls(tmp_path, monkeypatch):
+    """Empty poll state with the data file and ledgers in a temporary directory"""
+    monkeypatch.setattr(storage, "DATA_FILE", tmp_path / "bot_data.json")
+    monkeypatch.setattr(ledger, "VOTES_DIR", tmp_path / "votes")
+    monkeypatch.setattr(polls, "_flush_lock", asyncio.Lock())
+    _reset(monkeypatch)
+
+def _reset(monkeypatch):
+    """Forget everything held in memory, as after a restart"""
+    monkeypatch.setattr(polls, "_tallies", None)
+    monkeypatch.setattr(polls, "_active", [])
+    monkeypatch.setattr(polls, "_finished", [])
+    monkeypatch.setattr(polls, "_dirty", set())
+    monkeypatch.setattr(polls, "_events", {})
+    monkeypatch.setattr(polls, "_pending_edits", {})
+    monkeypatch.setattr(polls, "_last_edit", {})
+
+def _poll(poll_id, options=4, **settings):
+    """A new poll with no votes"""
+    return dict(
+        {"id": poll_id, "title": "t", "options": [{"text": str(i), "count": 0} for i in range(options)]},
+        **settings
+    )
+
+async def _click_concurrently(poll_id, clicks, rng):
+    """Apply (user, option) clicks from separate tasks in a random order while flushes run; returns the applied order"""
+    applied = []
+    
+    async def click(user_id, option_id):
+        await asyncio.sleep(rng.random() * 0.01)
+        if polls.record_vote(poll_id, user_id, option_id) is not None:
+            applied.append((user_id, option_id))
+    
+    async def flush_repeatedly():
+        for _ in range(5):
+            await asyncio.sleep(0.002)
+            await polls.flush()
+    
+    await asyncio.gather(*(click(user_id, option_id) for user_id, option_id in clicks), flush_repeatedly())
+    await polls.flush()
+    return applied
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_single_choice_counts_equal_distinct_voters(seed, monkeypatch):
+    rng = random.Random(seed)
+    clicks = [(rng.randrange(60), rng.randrange(4)) for _ in range(400)]
+    
+    async def scenario():
+        await polls.register_polls([_poll("single")])
+        return await _click_concurrently("single", clicks, rng)
+    
+    applied = asyncio.run(scenario())
+    final = dict(applied)
+    expected = Counter(final.values())
+    
+    tally = polls.get_tally("single")
+    assert tally.counts == [expected[i] for i in range(4)]
+    assert sum(tally.counts) == len(final) == tally.voter_count()
+    
+    # The same state comes back from disk
+    _reset(monkeypatch)
+    reloaded = polls.get_tally("single")
+    assert reloaded.counts == tally.counts
+    assert dict(reloaded.ledger.items()) == final
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_multiple_choice_counts_follow_selections(seed, monkeypatch):
+    rng = random.Random(seed)
+    clicks = [(rng.randrange(40), rng.randrange(5)) for _ in range(400)]
+    
+    async def scenario():
+        await polls.register_polls([_poll("multi", 5, multiple_choices=True)])
+        return await _click_concurrently("multi", clicks, rng)
+    
+    selections = Counter()
+    for user_id, option_id in asyncio.run(scenario()):
+        selections[user_id] ^= 1 << option_id
+    
+    tally = polls.get_tally("multi")
+    assert tally.counts == [sum(1 for mask in selections.values() if mask >> i & 1) for i in range(5)]
+    assert tally.voter_count() == sum(1 for mask in selections.values() if mask)
+    
+    _reset(monkeypatch)
+    assert polls.get_tally("multi").counts == tally.counts
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_anonymous_votes_count_each_voter_once(seed):
+    rng = random.Random(seed)
+    clicks = [(rng.randrange(80), rng.randrange(3)) for _ in range(400)]
+    
+    async def scenario():
+        await polls.register_polls([_poll("anon", 3, anonymous=True)])
+        return await _click_concurrently("anon", clicks, rng)
+    
+    applied = asyncio.run(scenario())
+    tally = polls.get_tally("anon")
+    assert sum(tally.counts) == len({user_id for user_id, option_id in applied}) == len({user_id for user_id, option_id in clicks})
+
+# Each round writes files, so fewer seeds keep the run short
+@pytest.mark.parametrize("seed", range(5))
+def test_ledger_reloads_from_full_writes_and_changes(seed, monkeypatch):
+    # A small merge threshold makes flushes alternate between full writes and changes files
+    monkeypatch.setattr(ledger, "MERGE_MIN_PENDING", 8)
+    rng = random.Random(seed)
+    
+    async def scenario():
+        await polls.register_polls([_poll("big")])
+        votes = {}
+        for _ in range(30):
+            for _ in range(rng.randrange(1, 40)):
+                user_id, option_id = rng.randrange(300), rng.randrange(4)
+                if polls.record_vote("big", user_id, option_id) is not None:
+                    votes[user_id] = option_id
+            await polls.flush()
+            reloaded = ledger.VoteLedger.load(ledger.ledger_path("big"))
+            assert dict(reloaded.items()) == votes
+        return votes
+    
+    votes = asyncio.run(scenario())
+    _reset(monkeypatch)
+    assert dict(polls.get_tally("big").ledger.items()) == votes
+
+def test_changes_of_an_older_generation_are_ignored(tmp_path):
+    path = tmp_path / "poll.bin"
+    votes = ledger.VoteLedger()
+    votes.set(1, 0)
+    ledger.write_snapshot("poll", votes.snapshot(), path)
+    votes.set(1, 2)
+    ledger.write_snapshot("poll", votes.snapshot(), path)
+    stale = ledger.changes_path(path).read_bytes()
+    
+    # A full write that crashed before its changes file was replaced
+    votes.set(1, 3)
+    votes.mark_unwritten()
+    content, changes = votes.snapshot()
+    ledger.write_ledger("poll", content, path)
+    assert ledger.changes_path(path).read_bytes() == stale
+    assert dict(ledger.VoteLedger.load(path).items()) == {1: 3}
+
+def test_failed_save_keeps_polls_dirty(monkeypatch):
+    async def scenario():
+        await polls.register_polls([_poll("retry")])
+        polls.record_vote("retry", 1, 2)
+        monkeypatch.setattr(polls, "save_data", lambda data: False)
+        saved = await polls.flush()
+        return saved
+    
+    assert asyncio.run(scenario()) == 0
+    assert "retry" in polls._dirty
+
+class _FakeBot:
+    """Records message edits"""
+    
+    def __init__(self):
+        self.edits = []
+    
+    async def edit_message_text(self, text, chat_id=None, message_id=None, reply_markup=None):
+        self.edits.append((asyncio.get_running_loop().time(), chat_id, text))
+
+def test_result_edits_coalesce_under_load(monkeypatch):
+    # 10k votes a minute, with time compressed 50 times: a minute takes 1.2 s
+    # and the 3 s edit interval becomes 0.06 s
+    scale = 50
+    votes = 10000
+    duration = 60 / scale
+    interval = 3 / scale
+    monkeypatch.setattr(polls.config, "POLL_EDIT_INTERVAL", interval)
+    bot = _FakeBot()
+    
+    async def scenario():
+        await polls.register_polls([_poll("load", targets=[-1, -2])])
+        polls.set_poll_message("load", -1, 10)
+        polls.set_poll_message("load", -2, 20)
+        
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for i in range(votes):
+            # Sleep until this vote's arrival time, so the rate stays even
+            delay = started + i * duration / votes - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            polls.record_vote("load", i, i % 4, -1 if i % 2 else -2)
+            polls.request_result_edit(bot, "load")
+        await asyncio.sleep(interval * 2)
+        return loop.time() - started
+    
+    elapsed = asyncio.run(scenario())
+    rounds = [edit for edit in bot.edits if edit[1] == -1]
+    
+    # At most one edit per message per interval, instead of one per vote
+    assert len(bot.edits) == 2 * len(rounds)
+    assert len(rounds) <= elapsed / interval + 1
+    gaps = [later[0] - earlier[0] for earlier, later in zip(rounds, rounds[1:])]
+    assert min(gaps) >= interval * 0.9
+    
+    # The last edit shows every vote
+    text, keyboard = polls.render_poll(polls.get_tally("load").poll, polls.get_tally("load").counts)
+    assert rounds[-1][2] == text
+    assert sum(polls.get_tally("load").counts) == votes
+
+def test_poll_pages_are_newest_first():
+    async def scenario():
+        await polls.register_polls([_poll(f"p{i}") for i in range(25)])
+    
+    asyncio.run(scenario())
+    polls._finalize(["p3", "p24"])
+    
+    active = [f"p{i}" for i in range(25) if i not in (3, 24)]
+    pages = []
+    page, count = 0, 1
+    while page < count:
+        tallies, page, count = polls.list_polls(page=page, page_size=10)
+        pages.extend(tally.poll["id"] for tally in tallies)
+        page += 1
+    assert pages == active[::-1]
+    
+    tallies, page, count = polls.list_polls(finished=True, page=5, page_size=10)
+    assert [tally.poll["id"] for tally in tallies] == ["p24", "p3"] and (page, count) == (0, 1)
+
+def test_anonymous_ledger_keeps_its_size_and_reloads(tmp_path):
+    path = tmp_path / "anon.bin"
+    votes = ledger.AnonymousLedger("anon", 1000)
+    size = len(votes.to_bytes())
+    added = sum(votes.add(user_id) for user_id in range(1000))
+    # Up to its capacity the filter keeps to its false positive rate
+    assert added >= 1000 * (1 - 3 * ledger.ANONYMOUS_ERROR_RATE)
+    
+    # Past it the memory stays the same and the filter saturates
+    for user_id in range(1000, 5000):
+        votes.add(user_id)
+    assert len(votes.to_bytes()) == size
+    assert votes.voted.error_rate_at(5000) > 0.5
+    
+    ledger.write_snapshot("anon", votes.snapshot(), path)
+    reloaded = ledger.AnonymousLedger.load(path, "anon", 100)
+    assert reloaded.capacity == 1000
+    assert not any(reloaded.add(user_id) for user_id in range(1000))
+    assert reloaded.to_bytes() == votes.to_bytes()
@@ -0,0 +1,73 @@
+"""
+Members who join during a raid lockdown, and their review
+اعضایی که هنگام قرنطینه هجوم وارد می‌شوند و بررسی آن‌ها
+"""
+import asyncio
+from types import SimpleNamespace
+import pytest
+from telegram import ChatPermissions
+from bot import raid
+from bot.timers import TimerHeap
+
+class _FakeBot:
+    """Records permission changes and kicks"""
+    
+    def __init__(self):
+        self.restricted = {}
+        self.kicked = []
+    
+    async def get_chat(self, chat_id):
+        return SimpleNamespace(permissions=ChatPermissions(can_send_messages=True, can_invite_users=False))
+    
+    async def set_chat_permissions(self, chat_id, permissions):
+        pass
+    
+    async def send_message(self, chat_id, text, reply_markup=None):
+        pass
+    
+    async def restrict_chat_member(self, chat_id, user_id, permissions, until_date=None):
+        self.restricted[user_id] = (permissions.to_dict(), until_date)
+    
+    async def ban_chat_member(self, chat_id, user_id):
+        self.kicked.append(user_id)
+    
+    async def unban_chat_member(self, chat_id, user_id, only_if_banned=False):
+        pass
+
+@pytest.fixture(autouse=True)
+def fresh_raid(tmp_path, monkeypatch):
+    """No lockdowns, with a threshold of 5 joins a minute and timers in a temporary directory"""
+    monkeypatch.setattr(raid, "timers", TimerHeap(tmp_path / "timers.jsonl"))
+    monkeypatch.setattr(raid, "_lockdowns", None)
+    monkeypatch.setattr(raid, "_rates", {})
+    monkeypatch.setattr(raid, "_recent", {})
+    monkeypatch.setattr(raid, "_reviews", {})
+    monkeypatch.setattr(raid, "get_welcome_settings", lambda: {"raid_threshold": 5})
+    monkeypatch.setattr(raid.config, "init_config", lambda: {"admin_ids": [1]})
+
+def test_joiners_during_a_lockdown_are_held_and_reviewed():
+    bot = _FakeBot()
+    chat = SimpleNamespace(id=-100, title="g")
+    
+    async def scenario():
+        assert not await raid.record_joins(bot, chat, [1, 2, 3])
+        # This batch sets off the lockdown and is held with every later one
+        assert await raid.record_joins(bot, chat, [4, 5, 6])
+        assert await raid.record_joins(bot, chat, [7])
+        assert sorted(bot.restricted) == [4, 5, 6, 7]
+        assert all(until for permissions, until in bot.restricted.values())
+        
+        reviewed = raid.review(chat.id)
+        assert reviewed == [1, 2, 3, 4, 5, 6, 7]
+        # Joins after the review are not part of it
+        await raid.record_joins(bot, chat, [8])
+        assert await raid.kick_reviewed(bot, chat.id) == 7
+        assert bot.kicked == [1, 2, 3, 4, 5, 6, 7]
+        
+        assert raid.review(chat.id) == [8]
+        assert await raid.approve_reviewed(bot, chat.id) == 1
+        # Let in with the group's own permissions, not the lockdown's
+        assert bot.restricted[8] == ({"can_send_messages": True, "can_invite_users": False}, None)
+        assert raid.review(chat.id) == []
+    
+    asyncio.run(scenario())
@@ -0,0 +1,45 @@
+"""
+Registration of sent posts and their follow-up actions
+ثبت پیام‌های ارسال شده و عملیات بعدی آن‌ها
+"""
+import asyncio
+import uuid
+from types import SimpleNamespace
+import pytest
+from bot import registry
+from bot.media import send_payload
+from bot.timers import TimerHeap
+
+class _FakeBot:
+    """Copies messages like the Bot API, returning only the new message id"""
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        return SimpleNamespace(message_id=42)
+
+@pytest.fixture(autouse=True)
+def fresh_registry(tmp_path, monkeypatch):
+    """An empty registry with its timers in a temporary directory"""
+    monkeypatch.setattr(registry, "SENT_FILE", tmp_path / "sent_messages.bin")
+    monkeypatch.setattr(registry, "timers", TimerHeap(tmp_path / "timers.jsonl"))
+    monkeypatch.setattr(registry, "_appends", None)
+
+def test_copied_post_is_registered_under_its_target():
+    payload = {
+        "chat_id": "-100123",
+        "text": "caption",
+        "reply_markup": None,
+        "parse_mode": None,
+        "media": {"type": "photo", "mode": "copy", "source": {"chat_id": 1, "message_id": 7}}
+    }
+    post = {"id": "0f8fad5b-d9cb-469f-a165-70867728950e", "actions": [{"type": "delete", "after": 60}]}
+
+    sent = asyncio.run(send_payload(_FakeBot(), payload))
+    registry.after_send(post, payload["chat_id"], sent)
+
+    records = list(registry.SENT_RECORD.iter_unpack(registry.SENT_FILE.read_bytes()))
+    assert [(chat_id, message_id, str(uuid.UUID(bytes=source))) for chat_id, message_id, sent_at, source in records] == [
+        (-100123, 42, post["id"])
+    ]
+    assert [payload for timer_id, payload in registry.timers.pending("delete_message")] == [
+        {"chat_id": "-100123", "message_id": 42}
+    ]
@@ -0,0 +1,55 @@
+"""
+Delivery of persisted timers across failures and restarts
+اجرای زمان‌بندهای ماندگار با وجود خطا و راه‌اندازی مجدد
+"""
+import asyncio
+import json
+import time
+from bot.timers import TimerHeap
+
+def _records(path):
+    """Journal records as lists"""
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+def test_failing_payload_does_not_stop_the_others(tmp_path):
+    heap = TimerHeap(tmp_path / "timers.jsonl")
+    ran = []
+
+    async def handler(bot, payload):
+        if payload == 2:
+            raise RuntimeError("boom")
+        ran.append(payload)
+
+    heap.register("job", handler)
+    seqs = heap.schedule_many([(time.time() - 1, "job", i) for i in range(5)])
+
+    async def scenario():
+        for kind, due in heap._pop_due(time.time()).items():
+            await heap._dispatch(None, kind, due)
+
+    asyncio.run(scenario())
+    assert ran == [0, 1, 3, 4]
+    assert {record[1] for record in _records(heap.path) if record[0] == "d"} == set(seqs)
+
+def test_timers_are_finished_only_after_their_handler(tmp_path):
+    path = tmp_path / "timers.jsonl"
+    heap = TimerHeap(path)
+    finished_during_handler = []
+
+    async def handler(bot, payloads):
+        finished_during_handler.append([record for record in _records(path) if record[0] == "d"])
+        # A restart while the handler runs starts from a copy of the journal as it is now
+        copy = tmp_path / "copy.jsonl"
+        copy.write_bytes(path.read_bytes())
+        assert [payload for seq, payload in TimerHeap(copy).pending("job")] == payloads
+
+    heap.register("job", handler, batch=True)
+    heap.schedule_many([(time.time() - 1, "job", i) for i in range(3)])
+
+    async def scenario():
+        for kind, due in heap._pop_due(time.time()).items():
+            await heap._dispatch(None, kind, due)
+
+    asyncio.run(scenario())
+    assert finished_during_handler == [[]]
+    assert TimerHeap(path).pending("job") == []